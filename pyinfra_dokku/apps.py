@@ -0,0 +1,131 @@
+"""
+deploy Dokku apps from git repositories, at a pinned ref
+"""
+
+import shlex
+
+from typing import Dict, Tuple
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import files, server
+
+from .facts                 import DeployedAppRefs, DokkuReports
+from .util.git_deploy       import (DEFAULT_GIT_CACHE_DIR, build_archive, needs_deploy,
+                                    render_record_deployed_command, resolve_ref)
+
+DEPLOY_METHODS = ('archive', 'sync')
+
+# where archives are uploaded to on hosts, before being deployed
+ARCHIVE_UPLOAD_DIR = '/var/lib/pyinfra-dokku/archives'
+
+# refs resolved during this run, so every host deploys the same commit
+# even if a branch moves mid-run
+_resolved_refs: Dict[Tuple[str, str], str] = {}
+
+
+def resolve_ref_once(repo_url: str, ref: str) -> str:
+  """
+  `resolve_ref`, but each (repo_url, ref) pair is only resolved once per run.
+  """
+
+  key = (repo_url, ref)
+  if key not in _resolved_refs:
+    _resolved_refs[key] = resolve_ref(repo_url, ref)
+  return _resolved_refs[key]
+
+
+# pylint: disable=too-many-arguments
+@deploy("Deploy Dokku app from git")
+def deploy_app_from_git(app: str,
+                        repo_url: str,
+                        ref: str = 'main',
+                        method: str = 'archive',
+                        cache_dir: str = DEFAULT_GIT_CACHE_DIR,
+                        create_app: bool = True,
+                        force: bool = False,
+                       ):
+  """
+  Deploy `app` from commit `ref` of the git repository at `repo_url`,
+  skipping the deploy (and build) entirely on hosts where the app was
+  already deployed from that commit by this function, and nothing has been
+  deployed to it since.
+
+  `ref` (a branch, tag or commit sha) is resolved to a commit once per run
+  (with `git ls-remote`, not a clone), so all hosts get the same commit.
+
+  args:
+
+  - app: the app to deploy
+  - repo_url: URL (or path) of the git repository
+  - ref: branch, tag or commit to deploy
+  - method: how hosts get the code:
+
+    - 'archive' (the default): only the commit is fetched (`--depth 1`)
+      into a cache repository in `cache_dir`, on the machine running
+      pyinfra, and a single tar.gz archive of its tree is made and
+      uploaded to each host that needs it, which deploys it with
+      `dokku git:from-archive`. Hosts needn't have access to the repository.
+    - 'sync': each host fetches the commit itself with
+      `dokku git:sync --build`.
+
+  - cache_dir: where 'archive' keeps fetched commits and archives
+  - create_app: whether to create the app if it doesn't exist
+  - force: deploy even if the app is already at the commit
+
+  prereqs:
+
+  - Dokku must be installed (0.24.0 or later for `git:from-archive`,
+    0.26.0 or later for `git:sync`), and git available on the machine
+    running pyinfra.
+  """
+
+  config.SUDO = True
+  if method not in DEPLOY_METHODS:
+    raise ValueError(f"unknown deploy method '{method}', expected one of {DEPLOY_METHODS}")
+
+  sha = resolve_ref_once(repo_url, ref)
+  git_reports = host.get_fact(DokkuReports, ('git',)).get('git', {})
+  deployed = host.get_fact(DeployedAppRefs)
+
+  if not force and not needs_deploy(app, sha, deployed, git_reports):
+    logger.info("%s: app '%s' already deployed from %s (%s), skipping",
+                host.name, app, ref, sha[:12])
+    return
+
+  quoted_app = shlex.quote(app)
+  commands = []
+  if create_app:
+    commands.append(f"dokku apps:exists {quoted_app} > /dev/null 2>&1 || "
+                    f"dokku apps:create {quoted_app}")
+
+  if method == 'archive':
+    archive = build_archive(cache_dir, repo_url, sha, ref)
+    remote_archive = f"{ARCHIVE_UPLOAD_DIR}/{app}-{sha[:12]}.tar.gz"
+
+    # pylint: disable=unexpected-keyword-arg
+    files.directory(name='Create archive upload directory',
+                    path=ARCHIVE_UPLOAD_DIR,
+                    mode='700',
+                    _sudo=True,
+                   )
+    files.put(name=f"Upload archive of {ref} ({sha[:12]})",
+              src=str(archive),
+              dest=remote_archive,
+              mode='600',
+              _sudo=True,
+             )
+    commands.append(f"dokku git:from-archive --archive-type tar.gz {quoted_app} -- "
+                    f"< {shlex.quote(remote_archive)}")
+  else:
+    commands.append(f"dokku git:sync --build {quoted_app} {shlex.quote(repo_url)} {sha}")
+
+  commands.append(render_record_deployed_command(app, sha))
+  if method == 'archive':
+    commands.append(f"rm -f {shlex.quote(remote_archive)}")
+
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name=f"Deploy app {app} from {ref} ({sha[:12]})",
+               commands=commands,
+               _sudo=True,
+              )
@@ -0,0 +1,107 @@
+"""
+streaming, incremental backups of Dokku hosts
+"""
+
+from io     import StringIO
+from typing import Optional, Sequence
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import apt, files, server
+
+from .facts                 import DokkuReports
+from .util.backup           import DOKKU_DATA_PATHS, parse_storage_mounts, render_backup_script
+
+##
+# globals
+
+BACKUP_SCRIPT_PATH      = '/usr/local/sbin/dokku-backup'
+
+
+def get_backup_paths() -> Sequence[str]:
+  """
+  return the paths on the current host backed up as files: dokku's own
+  data, plus any app storage mounts (which may live elsewhere).
+  """
+
+  storage_reports = host.get_fact(DokkuReports, ('storage',)).get('storage', {})
+  mounts = parse_storage_mounts(storage_reports)
+  extra = [path for path in mounts
+           if not any(path == data or path.startswith(data + '/') for data in DOKKU_DATA_PATHS)]
+  return list(DOKKU_DATA_PATHS) + extra
+
+
+# pylint: disable=too-many-arguments
+@deploy("Back up Dokku host")
+def backup_dokku(target: str,
+                 services: Sequence[str] = ('postgres',),
+                 full_every: int = 7,
+                 bandwidth_limit: Optional[str] = None,
+                 compression_level: int = 3,
+                 run_now: bool = True,
+                ):
+  """
+  Install a backup script at `/usr/local/sbin/dokku-backup` (suitable for
+  running from cron), and run it.
+
+  The script streams app data and config (`/home/dokku`,
+  `/var/lib/dokku/config`, `/var/lib/dokku/data` and app storage mounts)
+  through tar and zstd straight to `target`, without writing temporary files
+  on the host. Most runs are incremental, backing up only files changed
+  since the previous run; every `full_every`-th run is a full backup.
+  Datastore services are dumped with `dokku PLUGIN:export`. All of it runs
+  with idle I/O priority, so backups don't stall the host.
+
+  args:
+
+  - target: where backups are written: a directory on the host (e.g. a
+    mounted backup volume), or `USER@HOST:/DIR`, written to over ssh
+    (root on the dokku host needs key-based access).
+  - services: datastore plugins whose services are dumped, e.g.
+    `('postgres', 'mysql')`
+  - full_every: do a full (rather than incremental) backup every this
+    many runs
+  - bandwidth_limit: if given, maximum bytes/second to send, e.g. "10M"
+  - compression_level: zstd compression level
+  - run_now: whether to run a backup now, as well as installing the script
+
+  Prereqs:
+
+  - Dokku must be installed.
+  """
+
+  config.SUDO = True
+
+  packages = ['tar', 'zstd']
+  if bandwidth_limit:
+    packages.append('pv')
+
+  # pylint: disable=unexpected-keyword-arg
+  apt.packages(name='Install backup prerequisites',
+               packages=packages,
+               update=True,
+               cache_time=3600,
+               _sudo=True,
+              )
+
+  paths = get_backup_paths()
+  logger.info("%s: backing up %s", host.name, ", ".join(paths))
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name="Install backup script",
+            src=StringIO(render_backup_script(target, paths,
+                                              services=services,
+                                              full_every=full_every,
+                                              bandwidth_limit=bandwidth_limit,
+                                              compression_level=compression_level)),
+            dest=BACKUP_SCRIPT_PATH,
+            mode='700',
+            _sudo=True,
+           )
+
+  if run_now:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Back up to {target}",
+                 commands=BACKUP_SCRIPT_PATH,
+                 _sudo=True,
+                )
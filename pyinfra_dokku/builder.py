@@ -0,0 +1,168 @@
+"""
+select Dokku builders, and configure persistent build caches
+"""
+
+import json
+import shlex
+import time
+
+from typing import Mapping, Optional
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import files, python, server
+
+from .docker_daemon         import update_docker_daemon_config
+from .facts                 import BuildCacheStats, DokkuGlobalProperties, DokkuReports
+
+##
+# globals
+
+BUILDERS                = ('herokuish', 'dockerfile', 'pack', 'nixpacks', 'lambda')
+DOKKU_DEFAULTS_PATH     = '/etc/default/dokku'
+
+
+def _check_builder(builder: str):
+  if builder not in BUILDERS:
+    raise ValueError(f"unknown builder '{builder}', expected one of {BUILDERS}")
+
+
+def _select_builders(builder: Optional[str], apps: Mapping[str, str]):
+  """
+  set the global builder and per-app builders, where they differ from the
+  current settings.
+  """
+
+  reports = host.get_fact(DokkuReports, ('builder',)).get('builder', {})
+
+  commands = []
+  if builder:
+    _check_builder(builder)
+    if host.get_fact(DokkuGlobalProperties, 'builder').get('selected') != builder:
+      commands.append(f"dokku builder:set --global selected {builder}")
+
+  for app, app_builder in sorted(apps.items()):
+    _check_builder(app_builder)
+    if reports.get(app, {}).get('builder selected') != app_builder:
+      commands.append(f"dokku builder:set {shlex.quote(app)} selected {app_builder}")
+
+  if commands:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name="Select builders",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+
+def _enable_buildkit(keep_storage_gb: int, restart_docker: bool):
+  """
+  build Dockerfile-based apps with BuildKit (so `RUN --mount=type=cache`
+  cache mounts work), and have BuildKit keep up to `keep_storage_gb` GB
+  of build cache.
+  """
+
+  for line in ("export DOCKER_BUILDKIT=1", "export BUILDKIT_PROGRESS=plain"):
+    var = line.split()[1].split("=")[0]
+    # pylint: disable=unexpected-keyword-arg
+    files.line(name=f"Set {var} for dokku builds",
+               path=DOKKU_DEFAULTS_PATH,
+               line=f"^export {var}=",
+               replace=line,
+               _sudo=True,
+              )
+
+  update_docker_daemon_config(
+    "Configure BuildKit and build cache retention",
+    {
+      'features': {'buildkit': True},
+      'builder': {'gc': {'enabled': True, 'defaultKeepStorage': f"{keep_storage_gb}GB"}},
+    },
+    restart_docker=restart_docker,
+  )
+
+
+def _purge_large_app_caches(max_mb: int):
+  """
+  purge the buildpack caches of apps whose cache exceeds `max_mb` MB.
+  """
+
+  app_caches = host.get_fact(BuildCacheStats)['app_caches']
+  too_big = sorted(app for app, size in app_caches.items() if size > max_mb * 1024 * 1024)
+
+  if too_big:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Purge buildpack caches larger than {max_mb}MB",
+                 commands=[f"dokku repo:purge-cache {shlex.quote(app)}" for app in too_big],
+                 _sudo=True,
+                )
+
+
+def report_build_cache_stats(stats_file: Optional[str] = None):
+  """
+  log build cache statistics for the current host (see the `BuildCacheStats`
+  fact), and if `stats_file` is given, append them to that file (on the
+  machine running pyinfra) as a line of JSON, so they can be tracked
+  over time.
+  """
+
+  stats = host.reload_fact(BuildCacheStats)
+  buildkit = stats['buildkit']
+  logger.info("%s: build cache has %s entries (%s bytes), %s hits; buildpack caches: %s",
+              host.name, buildkit['entries'], buildkit['size_bytes'], buildkit['hits'],
+              stats['app_caches'])
+
+  if stats_file:
+    record = {'time': time.time(), 'host': host.name, **stats}
+    with open(stats_file, 'a', encoding='utf8') as outfile:
+      outfile.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+# pylint: disable=too-many-arguments
+@deploy("Configure Dokku builders")
+def configure_builders(builder: Optional[str] = None,
+                       apps: Optional[Mapping[str, str]] = None,
+                       buildkit: bool = True,
+                       build_cache_keep_gb: int = 20,
+                       buildpack_cache_max_mb: Optional[int] = None,
+                       restart_docker: bool = False,
+                       stats_file: Optional[str] = None,
+                      ):
+  """
+  Select which builder Dokku uses, globally and per app, and configure
+  persistent build caches.
+
+  args:
+
+  - builder: builder to use by default for all apps; one of 'herokuish',
+    'dockerfile', 'pack', 'nixpacks' or 'lambda'.
+  - apps: maps app names to the builder to use for that app.
+  - buildkit: whether to build with BuildKit, allowing Dockerfile
+    `RUN --mount=type=cache` cache mounts, which persist between builds.
+  - build_cache_keep_gb: how much BuildKit build cache docker keeps
+    (older entries are garbage collected beyond this).
+  - buildpack_cache_max_mb: if given, apps whose buildpack cache (in
+    `/home/dokku/APP/cache`) is larger than this get it purged.
+  - restart_docker: whether to restart docker if its config changed.
+  - stats_file: if given, cache statistics are appended to this file (on
+    the machine running pyinfra) as JSON lines. They're always logged.
+
+  Prereqs:
+
+  - Dokku must be installed.
+  """
+
+  config.SUDO = True
+
+  _select_builders(builder, apps or {})
+
+  if buildkit:
+    _enable_buildkit(build_cache_keep_gb, restart_docker)
+
+  if buildpack_cache_max_mb is not None:
+    _purge_large_app_caches(buildpack_cache_max_mb)
+
+  python.call(
+    name='report build cache stats',
+    function=report_build_cache_stats,
+    stats_file=stats_file,
+  )
@@ -0,0 +1,130 @@
+"""
+issue Let's Encrypt certificates for many Dokku apps at once
+"""
+
+import shlex
+
+from typing import Mapping, Optional, Sequence
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import server
+
+from .facts                 import DokkuReports, LetsencryptCertificates
+from .util.letsencrypt      import (MAX_CERTS_PER_REGISTERED_DOMAIN, plan_certificates,
+                                    render_issue_queue_script)
+
+
+def _set_global_letsencrypt_property(prop: str, value: Optional[str]):
+  """
+  set a global dokku-letsencrypt property, if a value was given.
+  """
+
+  if value:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"set letsencrypt {prop}",
+                 commands=f"dokku letsencrypt:set --global {prop} {shlex.quote(value)}",
+                 _sudo=True,
+                )
+
+
+# pylint: disable=too-many-arguments
+@deploy("Enable Let's Encrypt for Dokku apps")
+def enable_letsencrypt(apps: Mapping[str, Sequence[str]],
+                       concurrency: int = 4,
+                       renew_within_days: int = 30,
+                       launch_interval: float = 2.0,
+                       max_orders: int = 300,
+                       max_per_registered_domain: int = MAX_CERTS_PER_REGISTERED_DOMAIN,
+                       email: Optional[str] = None,
+                       lego_docker_args: Optional[str] = None,
+                      ):
+  """
+  Issue Let's Encrypt certificates for a set of Dokku apps, several
+  at a time.
+
+  Each app gets one certificate covering all its domains (as
+  SANs); the app's domains are set accordingly first. Apps whose
+  certificate covers the same domains and is valid for more than
+  `renew_within_days` days are skipped.
+
+  Issuance runs on the host as a queue: at most `concurrency` at a
+  time, started at least `launch_interval` seconds apart, with failed
+  attempts retried after an exponentially increasing delay. To stay under
+  ACME rate limits, at most `max_orders` certificates are issued per
+  run, and at most `max_per_registered_domain` for any one registered
+  domain; remaining apps are left for a later run (and logged).
+
+  args:
+
+  - apps: maps app names to lists of domains,
+    e.g. `{"myapp": ["myapp.example.com", "www.example.com"]}`
+  - email: if given, set as the global letsencrypt email address.
+    Otherwise `host.data.get("letsencrypt_email")` is used, if set.
+  - lego_docker_args: if given, set as the global `lego-docker-args`
+    property, e.g. to make lego trust an ACME test server's CA.
+    Otherwise `host.data.get("letsencrypt_lego_docker_args")` is used,
+    if set.
+
+  (See `install_letsencrypt_plugin` for pointing at a different ACME
+  server.)
+
+  Prereqs:
+
+  - Dokku and the letsencrypt plugin must be installed,
+    and the apps must exist.
+  """
+
+  config.SUDO = True
+
+  _set_global_letsencrypt_property(
+      'email', email or host.data.get("letsencrypt_email"))
+  _set_global_letsencrypt_property(
+      'lego-docker-args', lego_docker_args or host.data.get("letsencrypt_lego_docker_args"))
+
+  domain_reports = host.get_fact(DokkuReports, ('domains',)).get('domains', {})
+  current_domains = {
+    app: report.get('domains app vhosts', '').split()
+    for app, report in domain_reports.items()
+  }
+
+  plan = plan_certificates(apps,
+                           current_domains,
+                           host.get_fact(LetsencryptCertificates),
+                           renew_within_days=renew_within_days,
+                           max_orders=max_orders,
+                           max_per_registered_domain=max_per_registered_domain,
+                          )
+
+  for app, days in sorted(plan.skipped.items()):
+    logger.info("%s: certificate for app '%s' still valid for %s days, skipping",
+                host.name, app, days)
+  if plan.deferred:
+    logger.warning("%s: deferring certificates for %s app(s) to stay under ACME rate limits: %s",
+                   host.name, len(plan.deferred), plan.deferred)
+
+  if not plan.issue:
+    return
+
+  domain_commands = [
+    f"dokku domains:set {shlex.quote(app)} " + " ".join(shlex.quote(domain) for domain in apps[app])
+    for app in plan.issue
+    if sorted(apps[app]) != sorted(current_domains.get(app, []))
+  ]
+
+  if domain_commands:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Set domains for {len(domain_commands)} app(s)",
+                 commands=domain_commands,
+                 _sudo=True,
+                )
+
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name=f"Issue certificates for {len(plan.issue)} app(s)",
+               commands=render_issue_queue_script(plan.issue,
+                                                  concurrency=concurrency,
+                                                  launch_interval=launch_interval,
+                                                 ),
+               _shell_executable='bash',
+               _sudo=True,
+              )
@@ -0,0 +1,182 @@
+"""
+tune Dokku's zero-downtime deploy checks per app, and calibrate them from
+measured app startup times
+"""
+
+import json
+import time
+
+from typing import Any, Mapping, Optional, Sequence
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import python, server
+
+from .facts                 import AppConfigVars, DokkuReports
+from .util.checks           import (CHECKS_CONFIG_VARS, parse_calibration_output,
+                                    plan_checks_commands, render_calibration_script,
+                                    suggest_checks, validate_checks_spec)
+
+
+class ChecksException(Exception):
+  """
+  Base exception for problems tuning checks.
+  """
+
+
+@deploy("Configure Dokku zero-downtime checks")
+def configure_app_checks(spec: Mapping[str, Mapping[str, Any]]):
+  """
+  Set how long Dokku's zero-downtime checks wait for each app to start
+  when it's deployed.
+
+  Current settings for all apps are read in two remote calls, and all
+  changes for an app applied in one batch. Apps aren't restarted: new
+  settings apply from each app's next deploy.
+
+  args:
+
+  - spec: maps app names to dicts with (optional) keys
+
+    - 'wait': seconds to wait before each check attempt
+      (`DOKKU_CHECKS_WAIT`, dokku's default 5)
+    - 'timeout': seconds each check may take (`DOKKU_CHECKS_TIMEOUT`,
+      default 30)
+    - 'attempts': how many times checks are tried (`DOKKU_CHECKS_ATTEMPTS`,
+      default 5)
+    - 'default_wait': for apps without their own checks, seconds a new
+      container must stay up to be considered started
+      (`DOKKU_DEFAULT_CHECKS_WAIT`, default 10)
+    - 'wait_to_retire': seconds old containers are kept after a deploy
+      (`checks:set wait-to-retire`)
+    - 'disabled', 'skipped': lists of process types whose checks are
+      disabled or skipped (`checks:disable`, `checks:skip`); process
+      types not listed are re-enabled
+
+    e.g. `{"api": {"wait": 1, "attempts": 6, "default_wait": 4}}`.
+    `calibrate_app_checks` suggests values.
+
+  prereqs:
+
+  - Dokku must be installed, and the apps must exist.
+  """
+
+  config.SUDO = True
+  validate_checks_spec(spec)
+
+  checks_config = host.get_fact(AppConfigVars, tuple(CHECKS_CONFIG_VARS.values()))
+  reports       = host.get_fact(DokkuReports, ('checks',))
+
+  for app, app_spec in sorted(spec.items()):
+    commands = plan_checks_commands(app, app_spec, checks_config.get(app, {}),
+                                    reports.get('checks', {}).get(app, {}))
+    if not commands:
+      logger.debug("checks for app '%s' already up to date", app)
+      continue
+
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Set zero-downtime checks for app {app}",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def run_checks_calibration(apps: Sequence[str], trials: int, check_path: str,
+                           timeout: int, safety_factor: float,
+                           stats_file: Optional[str] = None):
+  """
+  measure the startup time of each of `apps` on the current host (see
+  `render_calibration_script`), and log the check settings suggested for
+  each; if `stats_file` is given, also append the measurements and
+  suggestions to that file (on the machine running pyinfra) as lines of
+  JSON.
+
+  Raises a ChecksException if the calibration script fails.
+  """
+
+  script = render_calibration_script(apps, trials, check_path, timeout)
+  status, stdout, stderr = host.run_shell_command(command=script, sudo=config.SUDO,
+                                                  shell_executable='bash')
+  if not status:
+    raise ChecksException(f"checks calibration failed on {host.name}. stderr = {stderr}")
+
+  results = parse_calibration_output(stdout)
+  suggested = {}
+  for app in apps:
+    trials_for_app = [trial for trial in results if trial.app == app]
+    failures = sorted({trial.reason for trial in trials_for_app if not trial.ok})
+    startups = [trial.startup for trial in trials_for_app if trial.ok]
+    suggestion = suggest_checks(trials_for_app, safety_factor)
+
+    if suggestion is None:
+      logger.warning("%s: %s: couldn't measure startup time (%s)",
+                     host.name, app, ", ".join(failures) or "no trials")
+    else:
+      suggested[app] = suggestion
+      logger.info("%s: %s: ready after %.1f-%.1fs in %d of %d trial(s); suggested checks: %s",
+                  host.name, app, min(startups), max(startups), len(startups),
+                  len(trials_for_app), suggestion)
+      if failures:
+        logger.warning("%s: %s: some trials failed (%s)", host.name, app, ", ".join(failures))
+
+    if stats_file:
+      record = {'time': time.time(), 'host': host.name, 'app': app,
+                'startup_seconds': startups, 'failures': failures, 'suggested': suggestion}
+      with open(stats_file, 'a', encoding='utf8') as outfile:
+        outfile.write(json.dumps(record, sort_keys=True) + "\n")
+
+  if suggested:
+    logger.info("%s: spec for configure_app_checks: %s",
+                host.name, json.dumps(suggested, sort_keys=True))
+
+
+# pylint: disable=too-many-arguments
+@deploy("Calibrate Dokku zero-downtime checks")
+def calibrate_app_checks(apps: Sequence[str],
+                         trials: int = 3,
+                         check_path: str = '/',
+                         timeout: int = 120,
+                         safety_factor: float = 1.5,
+                         stats_file: Optional[str] = None,
+                        ):
+  """
+  Measure how long each app really takes to start on each host, and
+  suggest the tightest check settings that would still pass (logged, in a
+  form that can be passed to `configure_app_checks`). Nothing is changed.
+
+  For each trial, a copy of the app's running web container is started
+  alongside it (same image, command, environment and network, but no
+  published ports), and `check_path` requested from it until it responds
+  without a server error; then the copy is removed. Apps whose startup
+  has side effects (e.g. running migrations) shouldn't be calibrated this
+  way.
+
+  args:
+
+  - apps: apps to calibrate
+  - trials: how many times to measure each app's startup
+  - check_path: path to request from the app
+  - timeout: seconds to wait for each trial before giving up
+  - safety_factor: suggested settings allow for startups this many times
+    slower than the slowest seen
+  - stats_file: if given, measurements and suggestions are also appended
+    to this file (on the machine running pyinfra) as JSON lines.
+
+  prereqs:
+
+  - Dokku must be installed, and the apps deployed and running.
+  """
+
+  config.SUDO = True
+
+  python.call(
+    name='measure app startup times',
+    function=run_checks_calibration,
+    apps=list(apps),
+    trials=trials,
+    check_path=check_path,
+    timeout=timeout,
+    safety_factor=safety_factor,
+    stats_file=stats_file,
+  )
@@ -0,0 +1,148 @@
+"""
+scheduled reclamation of docker disk space on Dokku hosts
+"""
+
+from io     import StringIO
+
+from pyinfra                import config, host, inventory, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import files, python, systemd
+
+from .facts                 import DISK_CLEANUP_LOG_PATH, DiskCleanupRuns
+from .util.cleanup          import (render_cleanup_script, render_cleanup_service,
+                                    render_cleanup_timer)
+from .util.schedule         import MINUTES_PER_DAY, daily_on_calendar, host_slot
+
+##
+# globals
+
+CLEANUP_SCRIPT_PATH     = '/usr/local/sbin/dokku-disk-cleanup'
+CLEANUP_UNIT_NAME       = 'dokku-disk-cleanup'
+SYSTEMD_UNIT_DIR        = '/etc/systemd/system'
+
+
+def get_disk_cleanup_slot(strategy: str = 'hash', window_start_hour: int = 1,
+                          window_hours: int = 5) -> int:
+  """
+  return the minute of the day at which the current host's disk cleanup
+  should run: somewhere in the window starting at `window_start_hour`
+  and lasting `window_hours` hours.
+
+  args:
+
+  - strategy: 'hash' or 'spread', as for `get_letsencrypt_renewal_slot`
+  - window_start_hour: hour of the day (0-23) the cleanup window starts
+  - window_hours: length of the cleanup window, in hours (1-24)
+  """
+
+  if not 1 <= window_hours <= 24:
+    raise ValueError(f"window_hours should be between 1 and 24, got {window_hours}")
+
+  host_names = [inventory_host.name for inventory_host in inventory]
+  offset = host_slot(strategy, host.name, host_names, salt='disk-cleanup',
+                     period=window_hours * 60)
+  return (window_start_hour * 60 + offset) % MINUTES_PER_DAY
+
+
+def report_disk_cleanup_runs():
+  """
+  log the bytes reclaimed by recent disk cleanup runs on the current host.
+  """
+
+  runs = host.get_fact(DiskCleanupRuns, sudo=True)
+  if not runs:
+    logger.info("%s: disk cleanup hasn't run yet", host.name)
+    return
+
+  total = sum(run.get('reclaimed_bytes', 0) for run in runs)
+  last = runs[-1]
+  logger.info("%s: last disk cleanup reclaimed %s bytes (removing %s images); "
+              "%s bytes over the last %s runs",
+              host.name, last.get('reclaimed_bytes'), last.get('images_removed'),
+              total, len(runs))
+
+
+# pylint: disable=too-many-arguments
+@deploy("Install Dokku disk cleanup")
+def install_disk_cleanup(keep_releases: int = 3,
+                         build_cache_max_gb: int = 10,
+                         stopped_container_hours: int = 24,
+                         strategy: str = 'hash',
+                         window_start_hour: int = 1,
+                         window_hours: int = 5,
+                        ):
+  """
+  Install a systemd timer which regularly reclaims disk space used by
+  docker: old app releases, stopped containers, dangling images and build
+  cache. Images used by any container are never removed.
+
+  The timer runs once a day, at a per-host time within a (presumably
+  quiet) window, so hosts don't all do their cleanup I/O at once; and
+  the job runs with idle CPU and I/O priority. Each run's reclaimed bytes
+  are logged to the journal and to `/var/log/dokku-disk-cleanup.jsonl`
+  (see the `DiskCleanupRuns` fact), and recent runs are reported when
+  this deploy is run.
+
+  args:
+
+  - keep_releases: number of most recent images to keep for each app
+  - build_cache_max_gb: prune build cache down to this many GB
+  - stopped_container_hours: remove containers stopped for longer than this
+  - strategy: 'hash' or 'spread'; see `get_disk_cleanup_slot`
+  - window_start_hour: hour of the day (0-23) cleanups may start
+  - window_hours: how many hours after `window_start_hour` cleanups may start
+
+  Prereqs:
+
+  - Dokku must be installed.
+  """
+
+  config.SUDO = True
+
+  slot = get_disk_cleanup_slot(strategy, window_start_hour, window_hours)
+  on_calendar = daily_on_calendar(slot)
+  logger.info("%s: scheduling disk cleanup at %s", host.name, on_calendar)
+
+  # pylint: disable=unexpected-keyword-arg
+  script = files.put(name="Install disk cleanup script",
+                     src=StringIO(render_cleanup_script(keep_releases, build_cache_max_gb,
+                                                        stopped_container_hours,
+                                                        DISK_CLEANUP_LOG_PATH)),
+                     dest=CLEANUP_SCRIPT_PATH,
+                     mode='755',
+                     _sudo=True,
+                    )
+
+  # pylint: disable=unexpected-keyword-arg
+  service = files.put(name="Install disk cleanup service",
+                      src=StringIO(render_cleanup_service(CLEANUP_SCRIPT_PATH)),
+                      dest=f"{SYSTEMD_UNIT_DIR}/{CLEANUP_UNIT_NAME}.service",
+                      mode='644',
+                      _sudo=True,
+                     )
+
+  # pylint: disable=unexpected-keyword-arg
+  timer = files.put(name="Install disk cleanup timer",
+                    src=StringIO(render_cleanup_timer(on_calendar)),
+                    dest=f"{SYSTEMD_UNIT_DIR}/{CLEANUP_UNIT_NAME}.timer",
+                    mode='644',
+                    _sudo=True,
+                   )
+
+  # pylint: disable=no-member
+  units_changed = script.changed or service.changed or timer.changed
+
+  # pylint: disable=unexpected-keyword-arg
+  systemd.service(name="Enable disk cleanup timer",
+                  service=f"{CLEANUP_UNIT_NAME}.timer",
+                  running=True,
+                  enabled=True,
+                  restarted=units_changed,
+                  daemon_reload=units_changed,
+                  _sudo=True,
+                 )
+
+  python.call(
+    name='report disk cleanup runs',
+    function=report_disk_cleanup_runs,
+  )
@@ -0,0 +1,63 @@
+"""
+manage settings in the docker daemon's config file
+"""
+
+from io     import StringIO
+from typing import Any, Mapping
+
+from pyinfra                import host, logger
+from pyinfra.operations     import files, systemd
+
+from .facts                 import DOCKER_DAEMON_CONFIG_PATH, DockerDaemonConfig
+from .util.docker_config    import merge_daemon_config, render_daemon_config
+
+
+def update_docker_daemon_config(name: str, updates: Mapping[str, Any],
+                                restart_docker: bool = False) -> bool:
+  """
+  merge `updates` into `/etc/docker/daemon.json` (keeping any other settings
+  already there), and restart docker if anything changed and
+  `restart_docker` is true. (Otherwise changes take effect when docker
+  is next restarted.)
+
+  Intended to be called from within a deploy.
+
+  args:
+
+  - name: name for the operation writing the file
+  - updates: settings to merge in; nested dicts are merged recursively,
+    and settings set to None are removed
+  - restart_docker: whether to restart docker if the config changed
+
+  Returns whether the config will change.
+  """
+
+  existing = host.get_fact(DockerDaemonConfig, sudo=True)
+  wanted   = merge_daemon_config(existing, updates)
+
+  if wanted == existing:
+    host.noop(f"docker daemon config already has {dict(updates)}")
+    return False
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name=name,
+            src=StringIO(render_daemon_config(wanted)),
+            dest=DOCKER_DAEMON_CONFIG_PATH,
+            mode='644',
+            _sudo=True,
+           )
+  # later updates in this run merge into what this one writes
+  host.create_fact(DockerDaemonConfig, data=wanted, kwargs={'sudo': True})
+
+  if restart_docker:
+    # pylint: disable=unexpected-keyword-arg
+    systemd.service(name="Restart docker to apply daemon config",
+                    service="docker",
+                    restarted=True,
+                    _sudo=True,
+                   )
+  else:
+    logger.warning("%s: docker daemon config changed; "
+                   "it takes effect when docker is next restarted", host.name)
+
+  return True
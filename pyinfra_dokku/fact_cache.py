@@ -0,0 +1,172 @@
+"""
+optionally cache facts about hosts on the machine running pyinfra, so
+repeated runs needn't probe every host from scratch
+
+Caching is enabled by setting the `fact_cache_path` data (for all hosts,
+or some), e.g. `pyinfra --data fact_cache_path=.pyinfra-dokku-facts.sqlite
+...`; `fact_cache_ttl` sets how many seconds values are used for (default
+3600). Operations which may change a cached fact are tagged with its key
+(see `invalidates_cached`), and the host's cached value is discarded once
+such an operation has run.
+"""
+
+import json
+
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from pyinfra                import host, logger, state
+from pyinfra.api.state      import BaseStateCallback
+
+from .util.fact_cache       import FactCache
+
+DEFAULT_FACT_CACHE_TTL = 3600
+
+_caches: Dict[str, FactCache] = {}
+
+# cache keys each planned operation may change, by (host name, op hash)
+_op_cache_keys: Dict[Tuple[str, str], Set[str]] = {}
+
+
+class FactCacheInvalidator(BaseStateCallback):
+  """
+  pyinfra state callback which discards a host's cached values of the
+  facts an operation was tagged as changing (see `invalidates_cached`),
+  once the operation has run (or failed part way). Untagged operations,
+  e.g. `apt-get update`, leave the cache alone.
+
+  Also tracks, for the run, which cached facts each host has had a
+  planned value recorded for (see `record_planned_fact`).
+  """
+
+  def __init__(self, cache: FactCache):
+    self.cache = cache
+    # keys of facts given planned values this run, by host name
+    self.planned_keys: Dict[str, Set[str]] = {}
+
+  def _invalidate_tagged(self, op_host, op_hash):
+    keys = _op_cache_keys.pop((op_host.name, op_hash), None)
+    if keys:
+      self.cache.invalidate(op_host.name, keys)
+
+  # pylint: disable=arguments-differ,arguments-renamed,unused-argument
+  def operation_host_success(self, op_state, op_host, op_hash):
+    self._invalidate_tagged(op_host, op_hash)
+
+  def operation_host_error(self, op_state, op_host, op_hash):
+    self._invalidate_tagged(op_host, op_hash)
+
+
+def get_fact_cache() -> Optional[FactCache]:
+  """
+  return the fact cache for the current host, or None if caching isn't
+  enabled for it. The first time a cache is used, a `FactCacheInvalidator`
+  is registered with pyinfra's state.
+  """
+
+  path = host.data.get("fact_cache_path")
+  if not path:
+    return None
+
+  cache = _caches.get(path)
+  if cache is None:
+    cache = _caches[path] = FactCache(path)
+  _get_invalidator(cache)
+  return cache
+
+
+def _get_invalidator(cache: FactCache) -> FactCacheInvalidator:
+  """
+  return the `FactCacheInvalidator` for `cache` registered with pyinfra's
+  state, registering one if there isn't one yet.
+  """
+
+  for handler in state.callback_handlers:
+    if isinstance(handler, FactCacheInvalidator) and handler.cache is cache:
+      return handler
+  handler = FactCacheInvalidator(cache)
+  state.add_callback_handler(handler)
+  return handler
+
+
+def cached(key: str, fetch: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+  """
+  return the value cached under `key` for the current host if it's less
+  than `ttl` seconds old (default: `host.data.fact_cache_ttl`, or
+  DEFAULT_FACT_CACHE_TTL); otherwise call `fetch` and cache what it returns.
+  If caching isn't enabled, or a planned value was recorded for `key` this
+  run (see `record_planned_fact`), just calls `fetch`.
+  """
+
+  cache = get_fact_cache()
+  if cache is None:
+    return fetch()
+  if key in _get_invalidator(cache).planned_keys.get(host.name, ()):
+    # a planned value isn't known to be true until its operation has run
+    return fetch()
+
+  if ttl is None:
+    ttl = float(host.data.get("fact_cache_ttl", DEFAULT_FACT_CACHE_TTL))
+  found, value = cache.get(host.name, key, ttl)
+  if found:
+    logger.debug("%s: using cached value of %s", host.name, key)
+    return value
+
+  value = fetch()
+  cache.put(host.name, key, value)
+  return value
+
+
+def fact_cache_key(fact_cls, *args) -> str:
+  """
+  return the key pyinfra fact `fact_cls` with arguments `args` is cached under.
+  """
+
+  return f"{fact_cls.__name__}:{json.dumps(args)}"
+
+
+def cached_fact(fact_cls, *args, ttl: Optional[float] = None, **kwargs) -> Any:
+  """
+  `host.get_fact(fact_cls, *args, **kwargs)`, cached; see `cached`.
+  """
+
+  return cached(fact_cache_key(fact_cls, *args),
+                lambda: host.get_fact(fact_cls, *args, **kwargs), ttl)
+
+
+def invalidates_cached(op_meta, *keys: str):
+  """
+  record that the operation `op_meta` (as returned by an operation call,
+  for the current host) may change the facts cached under `keys` (see
+  `fact_cache_key`), so their cached values are discarded once it has run.
+  Does nothing if the operation has nothing to do.
+  """
+
+  if op_meta.changed and get_fact_cache() is not None:
+    _op_cache_keys.setdefault((host.name, op_meta.hash), set()).update(keys)
+
+
+def invalidate_fact_cache():
+  """
+  discard all cached facts for the current host (if caching is enabled).
+  """
+
+  cache = get_fact_cache()
+  if cache is not None:
+    cache.invalidate(host.name)
+
+
+def record_planned_fact(fact_cls, data: Any, key: str):
+  """
+  record that an operation just planned for the current host will leave
+  (argument-less) fact `fact_cls`, cached under `key`, with value `data`:
+  later reads of the fact while planning this run see `data`. The
+  control-side cache isn't read or written for `key` for the rest of the
+  run, so a planned value is never cached (e.g. by `pyinfra --dry`); tag
+  the operation with `invalidates_cached` so the cached value is discarded
+  once it has run.
+  """
+
+  host.create_fact(fact_cls, data=data)
+  cache = get_fact_cache()
+  if cache is not None:
+    _get_invalidator(cache).planned_keys.setdefault(host.name, set()).add(key)
@@ -0,0 +1,468 @@
+"""
+pyinfra facts for Dokku hosts
+"""
+
+# pylint: disable=missing-function-docstring,arguments-differ
+
+from pyinfra.api          import FactBase
+
+from .util.build_cache    import APP_CACHE_SECTION, BUILDKIT_SECTION, parse_build_cache_stats
+from .util.cleanup        import DOKKU_APP_LABEL, parse_cleanup_log
+from .util.container_usage import parse_usage_output, render_usage_command
+from .util.debconf        import parse_debconf
+from .util.docker_config  import parse_daemon_config
+from .util.dokku_plugins  import parse_plugins
+from .util.git_deploy     import DEPLOYED_REFS_DIR, parse_deployed_refs
+from .util.k3s            import parse_k3s_version
+from .util.dokku_reports  import (parse_config_vars, parse_global_properties, parse_report,
+                                 render_config_vars_command, render_global_properties_command)
+from .util.letsencrypt    import parse_letsencrypt_list
+from .util.logs           import parse_log_usage
+from .util.resources      import parse_scale, render_scale_command
+from .util.mirrors        import parse_probe_output, render_probe_command
+from .util.services       import parse_service_config, service_config_path
+
+DOCKER_DAEMON_CONFIG_PATH = '/etc/docker/daemon.json'
+DISK_CLEANUP_LOG_PATH     = '/var/log/dokku-disk-cleanup.jsonl'
+
+
+class DokkuReports(FactBase):
+  """
+  Returns the parsed output of `dokku PLUGIN:report` for each of the
+  given plugins, for all apps, gathered in a single remote call:
+
+  .. code:: python
+
+      {
+        "ps": {
+          "node-js-app": {"deployed": "true", "processes": "2", ...},
+        },
+        "resource": {...},
+      }
+
+  Plugins with no apps (or hosts without dokku) give no entries.
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, plugins):
+    reports = " ".join(f"{plugin}:report" for plugin in plugins)
+    return (
+        f"for report in {reports}; do "
+        "dokku \"$report\" 2>/dev/null || true; "
+        "done"
+    )
+
+  def process(self, output):
+    return parse_report(output)
+
+
+class DokkuGlobalProperties(FactBase):
+  """
+  Returns the global properties set for the given dokku plugin, read from
+  dokku's property files, so they're known even on hosts with no apps
+  (whose `*:report` output is empty):
+
+  .. code:: python
+
+      {"selected": "dockerfile"}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, plugin):
+    return render_global_properties_command(plugin)
+
+  def process(self, output):
+    return parse_global_properties(output)
+
+
+class LetsencryptCertificates(FactBase):
+  """
+  Returns a dict mapping app names to the number of days before each app's
+  Let's Encrypt certificate expires (None if unknown), as shown by
+  `dokku letsencrypt:list`:
+
+  .. code:: python
+
+      {"node-js-app": 89, "other-app": None}
+
+  Hosts without dokku or the letsencrypt plugin give an empty dict.
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return "dokku letsencrypt:list 2>/dev/null || true"
+
+  def process(self, output):
+    return parse_letsencrypt_list(output)
+
+
+class DockerDaemonConfig(FactBase):
+  """
+  Returns the parsed contents of `/etc/docker/daemon.json` (an empty
+  dict if the file doesn't exist).
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return f"cat {DOCKER_DAEMON_CONFIG_PATH} 2>/dev/null || true"
+
+  def process(self, output):
+    return parse_daemon_config(output)
+
+
+class BuildCacheStats(FactBase):
+  """
+  Returns statistics on BuildKit's build cache and dokku's per-app
+  buildpack caches:
+
+  .. code:: python
+
+      {
+        "buildkit": {"entries": 12, "size_bytes": 1234567, "reused_entries": 5, "hits": 9},
+        "app_caches": {"node-js-app": 45678},
+      }
+
+  See `pyinfra_dokku.util.build_cache.parse_build_cache_stats`.
+  """
+
+  @staticmethod
+  def default():
+    return parse_build_cache_stats("")
+
+  def command(self):
+    return (
+        f"echo '{BUILDKIT_SECTION}'; "
+        "docker system df -v --format '{{json .BuildCache}}' 2>/dev/null || true; "
+        f"echo '{APP_CACHE_SECTION}'; "
+        "du -sb /home/dokku/*/cache 2>/dev/null || true"
+    )
+
+  def process(self, output):
+    return parse_build_cache_stats(output)
+
+
+class DiskCleanupRuns(FactBase):
+  """
+  Returns the most recent `limit` runs of the disk cleanup job installed by
+  `pyinfra_dokku.cleanup.install_disk_cleanup`, oldest first:
+
+  .. code:: python
+
+      [{"time": 1700000000, "duration_secs": 42, "images_removed": 3, "reclaimed_bytes": 123456}]
+  """
+
+  @staticmethod
+  def default():
+    return []
+
+  def command(self, limit=10):
+    return f"tail -n {int(limit)} {DISK_CLEANUP_LOG_PATH} 2>/dev/null || true"
+
+  def process(self, output):
+    return parse_cleanup_log(output)
+
+
+class DatastoreServices(FactBase):
+  """
+  Returns a dict mapping the services of datastore plugin `plugin` (e.g.
+  'postgres') to lists of the apps they're linked to:
+
+  .. code:: python
+
+      {"app-db": ["node-js-app"], "unlinked-db": []}
+
+  Hosts without the plugin give an empty dict.
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, plugin):
+    return (
+        f"for service in $(dokku --quiet {plugin}:list 2>/dev/null); do "
+        f"echo \"$service $(dokku {plugin}:info \"$service\" --links)\"; "
+        "done"
+    )
+
+  def process(self, output):
+    services = {}
+    for line in output:
+      fields = line.split()
+      if fields:
+        services[fields[0]] = sorted(fields[1:])
+    return services
+
+
+class DatastoreSettings(FactBase):
+  """
+  Returns the settings in the config file of `service` of datastore plugin
+  `plugin` (see `pyinfra_dokku.util.services.parse_service_config`), or an
+  empty dict if there's no such service.
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, plugin, service):
+    return f"cat {service_config_path(plugin, service)} 2>/dev/null || true"
+
+  def process(self, output):
+    return parse_service_config(output)
+
+
+class DokkuNetworks(FactBase):
+  """
+  Returns a list of the docker networks dokku knows about (as shown by
+  `dokku network:list`), including docker's built-in ones.
+  """
+
+  @staticmethod
+  def default():
+    return []
+
+  def command(self):
+    return "dokku --quiet network:list 2>/dev/null || true"
+
+  def process(self, output):
+    return [line.strip() for line in output if line.strip()]
+
+
+class AppLogUsage(FactBase):
+  """
+  Returns a dict mapping app names to the total bytes of container log
+  files (from the `json-file` and `local` log drivers) their containers
+  have on disk:
+
+  .. code:: python
+
+      {"node-js-app": 1234567}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return (
+        "root=\"$(docker info --format '{{.DockerRootDir}}' 2>/dev/null)\" || exit 0; "
+        f"docker ps --all --no-trunc --filter label={DOKKU_APP_LABEL} "
+        f"--format '{{{{.ID}}}} {{{{.Label \"{DOKKU_APP_LABEL}\"}}}}' 2>/dev/null | "
+        "while read -r id app; do "
+        "dir=\"$root/containers/$id\"; "
+        "echo \"$app $(du -cb \"$dir/\"*-json.log* \"$dir/local-logs\" 2>/dev/null "
+        "| tail -n 1 | cut -f 1)\"; "
+        "done"
+    )
+
+  def process(self, output):
+    return parse_log_usage(output)
+
+
+class AppResourceUsage(FactBase):
+  """
+  Returns the CPU, memory, network and block I/O usage of each app's
+  running containers, combined per process type, read from their cgroups
+  in one remote call (see `parse_usage_output` for the keys):
+
+  .. code:: python
+
+      {"node-js-app": {"web": {"containers": 2, "cpu_seconds": 84.2,
+                               "cpu_cores": 0.012, "memory_bytes": 95420416,
+                               "memory_limit_bytes": 536870912,
+                               "net_rx_bytes": 1834112, "net_tx_bytes": 9123811,
+                               "block_read_bytes": 4096, "block_write_bytes": 0}}}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return render_usage_command()
+
+  def process(self, output):
+    return parse_usage_output(output)
+
+
+class MirrorProbes(FactBase):
+  """
+  Fetches each of the given URLs (with curl) from the host, and returns a
+  dict mapping each URL to a `pyinfra_dokku.util.mirrors.Probe` (whether
+  the fetch succeeded, seconds to connect, and download speed in bytes
+  per second):
+
+  .. code:: python
+
+      {"http://archive.ubuntu.com/ubuntu/dists/focal/Release":
+         Probe(ok=True, latency=0.012, bytes_per_sec=2345678.0)}
+
+  Returns an empty dict if curl isn't installed.
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, urls, timeout=10):
+    return "command -v curl >/dev/null || exit 0; " + render_probe_command(urls, timeout)
+
+  def process(self, output):
+    return parse_probe_output(output)
+
+
+class K3sVersion(FactBase):
+  """
+  Returns the version of k3s installed on the host, e.g. 'v1.28.2+k3s1',
+  or None if k3s isn't installed.
+  """
+
+  @staticmethod
+  def default():
+    return None
+
+  def command(self):
+    return "k3s --version 2>/dev/null || true"
+
+  def process(self, output):
+    return parse_k3s_version(output)
+
+
+class DpkgArchitecture(FactBase):
+  """
+  Returns the host's architecture as named by dpkg (and used in apt
+  sources), e.g. "amd64" or "arm64".
+  """
+
+  def command(self):
+    return "dpkg --print-architecture"
+
+  def process(self, output):
+    return output[0].strip() if output else None
+
+
+class DokkuDebconf(FactBase):
+  """
+  Returns dokku's debconf settings (`debconf-show dokku`), lightly parsed:
+
+  .. code:: python
+
+      {("dokku", "hostname"): "example.io", ("dokku", "vhost_enable"): "true", ...}
+  """
+
+  requires_command = 'debconf-show'
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return "debconf-show dokku"
+
+  def process(self, output):
+    return parse_debconf(output)
+
+
+class DokkuPlugins(FactBase):
+  """
+  Returns the installed dokku plugins (`dokku plugin:list`), or an empty
+  dict if dokku isn't installed:
+
+  .. code:: python
+
+      {"letsencrypt": {"version": "0.20.0", "status": "enabled", "description": "..."}}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return "dokku plugin:list 2>/dev/null || true"
+
+  def process(self, output):
+    return parse_plugins(output)
+
+
+class AppConfigVars(FactBase):
+  """
+  Returns the values of the given config vars (where set) for each of the
+  given apps (default: every app), gathered in one remote call. Other
+  config vars aren't fetched.
+
+  .. code:: python
+
+      {"node-js-app": {"DOKKU_CHECKS_WAIT": "2", "DOKKU_CHECKS_ATTEMPTS": "8"}}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, keys, apps=None):
+    return render_config_vars_command(keys, apps)
+
+  def process(self, output):
+    return parse_config_vars(output)
+
+
+class AppScale(FactBase):
+  """
+  Returns the configured process counts (from `dokku ps:scale`) for each
+  of the given apps (default: every app), gathered in one remote call.
+  These are what the app runs once deployed or started, whether or not
+  it's running now:
+
+  .. code:: python
+
+      {"node-js-app": {"web": 1, "worker": 0}}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self, apps=None):
+    return render_scale_command(apps)
+
+  def process(self, output):
+    return parse_scale(output)
+
+
+class DeployedAppRefs(FactBase):
+  """
+  Returns the commit each app was last deployed from by
+  `pyinfra_dokku.apps.deploy_app_from_git`, with the git sha dokku gave
+  that deploy:
+
+  .. code:: python
+
+      {"node-js-app": ("3b18e512dba79e4c8300dd08aeb37f8e728b8dad", "9c1d...")}
+  """
+
+  @staticmethod
+  def default():
+    return {}
+
+  def command(self):
+    return (
+        f"for f in {DEPLOYED_REFS_DIR}/*; do "
+        "if [ -f \"$f\" ]; then echo \"$(basename \"$f\") $(cat \"$f\")\"; fi; "
+        "done"
+    )
+
+  def process(self, output):
+    return parse_deployed_refs(output)
@@ -6,24 +6,61 @@
 install and configure Dokku on an Ubuntu server
 """
 
-from io     import BytesIO
-from typing import Any, Dict, Mapping, Tuple
+import shlex
 
-from pyinfra              import config, host, logger
+from io     import BytesIO, StringIO
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+from pyinfra              import config, host, inventory, logger
 from pyinfra.api          import deploy
-from pyinfra.facts.server import LinuxName, LsbRelease
+from pyinfra.facts.server import Crontab, LinuxName, LsbRelease
 from pyinfra.facts.files  import File
-from pyinfra.operations   import apt, python, server
+from pyinfra.operations   import apt, files, python, server
 from pyinfra.facts.deb    import DebPackage
 
-from .util.debconf        import parse_debconf
-from .util.dokku_plugins  import parse_plugins
+from .fact_cache          import (cached, cached_fact, fact_cache_key, invalidate_fact_cache,
+                                 invalidates_cached, record_planned_fact)
+from .facts               import DokkuDebconf, DokkuPlugins, DpkgArchitecture
+from .mirrors             import select_apt_mirrors
+from .util.arch           import check_architecture, ubuntu_archive_url
+from .util.compiled_install import (INSTALL_LOG_PATH, install_steps, parse_step_results,
+                                    render_install_script)
+from .util.schedule       import daily_cron_line, host_slot, slot_to_time
 
 ##
 # globals
 
 DOKKU_APT_REPO  = 'https://packagecloud.io/dokku/dokku'
+DOCKER_APT_REPO = 'https://download.docker.com/linux/ubuntu'
+DOCKER_APT_KEY_URL = 'https://download.docker.com/linux/ubuntu/gpg'
+DOKKU_APT_KEY_URL  = 'https://packagecloud.io/dokku/dokku/gpgkey'
 ROOT_ID_PATH    = '/root/.ssh/id_rsa'
+APT_SOURCES_DIR = '/etc/apt/sources.list.d'
+LETSENCRYPT_CRON_PATH = '/etc/cron.d/dokku-letsencrypt'
+LETSENCRYPT_PLUGIN_URL = 'https://github.com/dokku/dokku-letsencrypt.git'
+COMPILED_INSTALL_PATH  = '/usr/local/lib/pyinfra-dokku/install-dokku.sh'
+
+# fact cache keys
+DOKKU_CONFIGURATION_KEY = 'dokku_configuration'
+INSTALLED_PLUGINS_KEY   = 'installed_plugins'
+
+PREREQ_PACKAGES = (
+  'apt-transport-https',
+  'bzip2',
+  'ca-certificates',
+  'curl',
+  'docker.io',
+  'git',
+  'gnupg',
+  'gnupg-agent',
+  'lsb-base',
+  'lsb-release',
+  'openssh-client',
+  'openssh-server',
+  'software-properties-common',
+  'tzdata',
+  'wget',
+)
 
 class InstallException(Exception):
   """
@@ -52,22 +89,25 @@ def get_expected_debconf_values(fqdn: str) -> Mapping[Tuple[str, str], str]:
     }
 
 
-def get_dokku_configuration():
+def get_dokku_configuration(use_cache: bool = True):
   """
   return the result of `debconf-show dokku` as a (lightly parsed)
-  dict containing configuration keys and values for dokku.
+  dict containing configuration keys and values for dokku
+  (the `DokkuDebconf` fact).
 
   e.g. ('dokku','key_file') maps to '/root/.ssh/id_rsa.pub'
+
+  If `use_cache` is true, the fact is only fetched once per run
+  (and may come from the control-side fact cache, if enabled -
+  see `pyinfra_dokku.fact_cache`); otherwise it's re-fetched.
   """
 
-  command = 'debconf-show dokku'
-  status, stdout, stderr = host.run_shell_command(command=command, sudo=config.SUDO)
-  if not status:
-    raise InstallException(f"couldn't execute '{command}' on host. stderr = {stderr}")
-  return parse_debconf(stdout)
+  if not use_cache:
+    return host.reload_fact(DokkuDebconf)
+  return cached(DOKKU_CONFIGURATION_KEY, lambda: host.get_fact(DokkuDebconf))
 
 
-def check_dokku_configuration(fqdn: str):
+def check_dokku_configuration(fqdn: str, use_cache: bool = False):
   """
   check that dokku was installed and configured correctly.
   Checks debconf values and contents of `/home/dokku/VHOST`.
@@ -78,9 +118,11 @@ def check_dokku_configuration(fqdn: str):
   Args:
 
   - fqdn: fully-qualified domain name of host.
+  - use_cache: whether debconf values fetched earlier in the run
+    may be used (i.e. nothing has changed them since).
   """
 
-  debconf_values = get_dokku_configuration()
+  debconf_values = get_dokku_configuration(use_cache=use_cache)
   if debconf_values != get_expected_debconf_values(fqdn):
     mesg = f"dokku configuration didn't give correct debconf values: {debconf_values}"
     raise InstallException(mesg)
@@ -104,22 +146,61 @@ def check_dokku_configuration(fqdn: str):
     logger.error("contents of vhost_file '%s' not as expected: %s", vhost_file, ex)
 
 
-def get_installed_plugins() -> Dict[str, Any]:
+def get_installed_plugins(use_cache: bool = True) -> Dict[str, Any]:
   """
   get a dict of plugin info if dokku is installed,
-  or empty dict if not (or if something goes wrong).
+  or empty dict if not (the `DokkuPlugins` fact).
+
+  If `use_cache` is true, the fact is only fetched once per run
+  (and may come from the control-side fact cache, if enabled -
+  see `pyinfra_dokku.fact_cache`), and reflects plugin installs
+  already planned; otherwise it's re-fetched.
   """
 
-  command = 'dokku plugin:list'
-  try:
-    status, stdout, _stderr = host.run_shell_command(command=command, sudo=config.SUDO)
-    assert status
-    return parse_plugins(stdout)
-  except Exception as ex:
-    logger.debug("Wasn't able to get list of dokku plugins: %s", ex)
-    return {}
+  if not use_cache:
+    return host.reload_fact(DokkuPlugins)
+  return cached(INSTALLED_PLUGINS_KEY, lambda: host.get_fact(DokkuPlugins))
 
-def check_letsencrypt_installed():
+def install_dokku_plugin(name: str, url: str,
+                         installed_plugins: Optional[Dict[str, Any]] = None) -> bool:
+  """
+  install dokku plugin `name` from `url` (a git repository), unless it's
+  already installed. Returns whether an install was needed.
+
+  Intended to be called from within a deploy.
+
+  args:
+
+  - name: name the plugin is installed under (as shown by `dokku plugin:list`)
+  - url: git URL to install the plugin from
+  - installed_plugins: currently installed plugins, as returned by
+    `get_installed_plugins` (which is called if this isn't given)
+  """
+
+  if installed_plugins is None:
+    installed_plugins = get_installed_plugins()
+    logger.debug("Got installed dokku plugins: %s", installed_plugins)
+
+  if name in installed_plugins:
+    host.noop(f"dokku plugin '{name}' is already installed")
+    return False
+
+  # pylint: disable=unexpected-keyword-arg
+  install = server.shell(
+    name=f"install {name} plugin",
+    commands=(
+        f"dokku plugin:install {shlex.quote(url)} {shlex.quote(name)}"
+    ),
+    _sudo=True,
+  )
+  invalidates_cached(install, INSTALLED_PLUGINS_KEY)
+
+  installed_plugins[name] = {'version': '', 'status': 'enabled', 'description': url}
+  record_planned_fact(DokkuPlugins, dict(installed_plugins), INSTALLED_PLUGINS_KEY)
+  return True
+
+
+def check_letsencrypt_installed(use_cache: bool = False):
   """
   check that letsencrypt was installed okay
   (as reported by `dokku plugin:list`).
@@ -127,97 +208,188 @@ def check_letsencrypt_installed():
   Raises an exception if not.
   """
 
-  installed_plugins = get_installed_plugins()
+  installed_plugins = get_installed_plugins(use_cache=use_cache)
 
   assert 'letsencrypt' in installed_plugins, \
     "letsencrypt plugin should be installed"
 
-def _install_dokku_prereqs():
+def get_host_architecture() -> str:
+  """
+  return the current host's architecture (as named by dpkg, e.g. "amd64"
+  or "arm64"), and log it, so that the architecture of each host in a
+  mixed inventory shows in deploy output.
+
+  Raises an InstallException if Dokku can't be installed on it.
+  """
+
+  arch = host.get_fact(DpkgArchitecture)
+  logger.info("%s: architecture is %s", host.name, arch)
+  try:
+    check_architecture(arch)
+  except ValueError as ex:
+    raise InstallException(f"{host.name}: {ex}") from ex
+  return arch
+
+def _apt_repo_lines(mirror_candidates: Optional[Mapping[str, Sequence[str]]] = None
+                   ) -> Dict[str, str]:
+  """
+  return the apt source lines for the docker and dokku repos, for the
+  current host's release and architecture.
+
+  If `mirror_candidates` (or `host.data.apt_mirror_candidates`)
+  is given, the fastest mirrors are selected first (which adds
+  operations); see `pyinfra_dokku.mirrors.select_apt_mirrors`. Otherwise
+  any Ubuntu mirror setup from earlier runs is undone.
+  """
+
+  lsb_info = host.get_fact(LsbRelease)
+  linux_id = lsb_info["id"].lower()
+  code_name = lsb_info["codename"]
+  arch = get_host_architecture()
+
+  if mirror_candidates is None:
+    mirror_candidates = host.data.get("apt_mirror_candidates")
+  mirror_uris = select_apt_mirrors(mirror_candidates or {}, code_name, fallbacks={
+                                     'ubuntu': ubuntu_archive_url(arch),
+                                     'docker': DOCKER_APT_REPO,
+                                     'dokku':  f"{DOKKU_APT_REPO}/{linux_id}",
+                                   })
+  docker_repo = mirror_uris.get('docker', DOCKER_APT_REPO)
+  dokku_repo = mirror_uris.get('dokku', f"{DOKKU_APT_REPO}/{linux_id}/")
+
+  return {
+    'docker': f"deb [arch={arch}] {docker_repo} {code_name} stable",
+    'dokku':  f"deb [arch={arch}] {dokku_repo} {code_name} main",
+  }
+
+def _install_dokku_prereqs(mirror_candidates: Optional[Mapping[str, Sequence[str]]] = None):
   """
   just the prereq steps. Add apt keys for docker and dokku,
   install some prereq packages, create root ssh key pair if
   needed.
 
+  If `mirror_candidates` (or `host.data.apt_mirror_candidates`)
+  is given, the fastest mirrors are selected first; see
+  `pyinfra_dokku.mirrors.select_apt_mirrors`.
+
   Used by `install_dokku` and `install_dokku_prereqs`.
   """
 
+  repo_lines = _apt_repo_lines(mirror_candidates)
+
   # pylint: disable=unexpected-keyword-arg
   apt.packages(name='Install required packages',
-               packages=[\
-                 'apt-transport-https',
-                 'bzip2',
-                 'ca-certificates',
-                 'curl',
-                 'docker.io',
-                 'git',
-                 'gnupg',
-                 'gnupg-agent',
-                 'lsb-base',
-                 'lsb-release',
-                 'openssh-client',
-                 'openssh-server',
-                 'openssh-server',
-                 'software-properties-common',
-                 'tzdata',
-                 'wget',
-                 ],
+               packages=list(PREREQ_PACKAGES),
                update=True,
                _sudo=True,
               )
 
   # pylint: disable=unexpected-keyword-arg
   apt.key(name="Install docker apt key",
-          src="https://download.docker.com/linux/ubuntu/gpg",
+          src=DOCKER_APT_KEY_URL,
           _sudo=True,
          )
 
-  lsb_info = host.get_fact(LsbRelease)
-  linux_id = lsb_info["id"].lower()
-  code_name = lsb_info["codename"]
-
+  # the whole file is written, so switching to or from a mirror replaces
+  # the previous source line rather than adding to it
   # pylint: disable=unexpected-keyword-arg
-  apt.repo(name='Add the Docker apt repo',
-           src=(
-               f"deb [arch=amd64] https://download.docker.com/linux/ubuntu {code_name} stable"
-           ),
-           filename="docker",
-           _sudo=True,
-          )
+  files.put(name='Add the Docker apt repo',
+            src=StringIO(repo_lines['docker'] + "\n"),
+            dest=f"{APT_SOURCES_DIR}/docker.list",
+            mode="644",
+            _sudo=True,
+           )
 
   # pylint: disable=unexpected-keyword-arg
   apt.key(name="Install Dokku apt key",
-          src="https://packagecloud.io/dokku/dokku/gpgkey",
+          src=DOKKU_APT_KEY_URL,
           _sudo=True,
          )
 
   # pylint: disable=unexpected-keyword-arg
-  apt.repo(name='Add the Dokku apt repo',
-           src=(
-               f"deb {DOKKU_APT_REPO}/{linux_id}/ {code_name} main"
-           ),
-           filename="dokku",
-           _sudo=True,
-          )
+  files.put(name='Add the Dokku apt repo',
+            src=StringIO(repo_lines['dokku'] + "\n"),
+            dest=f"{APT_SOURCES_DIR}/dokku.list",
+            mode="644",
+            _sudo=True,
+           )
 
   # do we need sudo perms, since this is one of root's
   # files?
-  has_root_id = host.get_fact(File, ROOT_ID_PATH, sudo=True,)
+  has_root_id = cached_fact(File, ROOT_ID_PATH, sudo=True,)
 
   if not has_root_id:
-    server.shell(
+    keygen = server.shell(
       name="create root .ssh key if not exist",
       commands=(
           f"sudo ssh-keygen -t rsa -C root@localhost -q -f {ROOT_ID_PATH} -N ''"
       ),
       _sudo=True,
     )
+    invalidates_cached(keygen, fact_cache_key(File, ROOT_ID_PATH))
+
+def run_compiled_install(script_path: str = COMPILED_INSTALL_PATH):
+  """
+  run a compiled install script (see `_compiled_install`) on the current
+  host, in a single session, streaming its per-step status lines, and log
+  the result of each step.
+
+  Raises an InstallException if a step failed.
+  """
+
+  status, stdout, stderr = host.run_shell_command(command=f"bash {shlex.quote(script_path)}",
+                                                  sudo=config.SUDO,
+                                                  print_output=True,
+                                                 )
+  results = parse_step_results(stdout)
+  if any(result.status in ('changed', 'failed') for result in results):
+    invalidate_fact_cache()
+  for result in results:
+    logger.info("%s: install step '%s': %s (%.1fs)",
+                host.name, result.name, result.status, result.seconds)
+
+  if not status:
+    failed = [result.name for result in results if result.status == 'failed']
+    raise InstallException(f"compiled install failed at step(s) {failed or '(unknown)'}; "
+                           f"see {INSTALL_LOG_PATH} on {host.name}. stderr = {stderr}")
+
+def _compiled_install(fqdn: str,
+                      mirror_candidates: Optional[Mapping[str, Sequence[str]]] = None):
+  """
+  the whole install as one operation uploading a script, and one
+  running it. See `install_dokku`.
+  """
+
+  steps = install_steps(packages=PREREQ_PACKAGES,
+                        apt_keys=[('docker', DOCKER_APT_KEY_URL), ('dokku', DOKKU_APT_KEY_URL)],
+                        apt_repos=_apt_repo_lines(mirror_candidates),
+                        root_id_path=ROOT_ID_PATH,
+                        debconf_values=get_expected_debconf_values(fqdn),
+                       )
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name="Upload compiled Dokku install script",
+            src=StringIO(render_install_script(steps)),
+            dest=COMPILED_INSTALL_PATH,
+            mode="755",
+            _sudo=True,
+           )
+
+  python.call(
+    name='run compiled Dokku install script',
+    function=run_compiled_install,
+  )
 
 @deploy("Install Dokku prerequisites only")
-def install_dokku_prerequisites():
+def install_dokku_prerequisites(mirror_candidates: Optional[Mapping[str, Sequence[str]]] = None):
   """
   Convenience function for installing just Dokku's prerequisites
   (openssh, docker, etc) and creating a root .ssh key pair if needed.
 
+  optional: `mirror_candidates` (or `host.data.get("apt_mirror_candidates")`)
+  lists candidate apt mirrors, from which the fastest for each host
+  is picked; see `pyinfra_dokku.mirrors.select_apt_mirrors`.
+
   prerequisites:
 
   Needs to be an Ubuntu host. (Bionic and focal okay; not
@@ -230,10 +402,11 @@ def install_dokku_prerequisites():
 
   assert host.get_fact(LinuxName) == 'Ubuntu'
 
-  _install_dokku_prereqs()
+  _install_dokku_prereqs(mirror_candidates)
 
 @deploy("Install Dokku")
-def install_dokku():
+def install_dokku(mirror_candidates: Optional[Mapping[str, Sequence[str]]] = None,
+                  compiled: Optional[bool] = None):
   """
   Install Dokku on an Ubuntu host.
 
@@ -254,6 +427,17 @@ def install_dokku():
   E.g. a server's fqdn might be "example.io";
   then individual dokku apps will get hosted on subdomains of
   that, like "myapp.example.io"
+
+  optional: `mirror_candidates` (or `host.data.get("apt_mirror_candidates")`)
+  lists candidate apt mirrors, from which the fastest for each host
+  is picked; see `pyinfra_dokku.mirrors.select_apt_mirrors`.
+
+  optional: if `compiled` (or `host.data.get("dokku_compiled_install")`)
+  is true, the install steps are compiled into one idempotent shell
+  script, uploaded and run in a single session (much faster over
+  high-latency links). Each step is checked, and only run if it isn't in
+  effect; the status of each step is logged. See
+  `pyinfra_dokku.util.compiled_install`.
   """
 
   # TODO: why isn't config.SUDO working? why is _sudo needed
@@ -262,20 +446,32 @@ def install_dokku():
 
   assert host.get_fact(LinuxName) == 'Ubuntu'
 
-  _install_dokku_prereqs()
-
   fqdn = host.data.get("fqdn")
   assert fqdn
 
+  if compiled is None:
+    compiled = host.data.get("dokku_compiled_install", False)
+  if compiled:
+    _compiled_install(fqdn, mirror_candidates)
+    python.call(
+      name='check Dokku was configured correctly',
+      function=check_dokku_configuration,
+      fqdn=fqdn,
+    )
+    return
+
+  _install_dokku_prereqs(mirror_candidates)
+
   # See whether dokku has already been configured using
   # using 'debconf-set-selections', and if not, do so.
 
   debconf_values = get_dokku_configuration()
   logger.info("Got initial Dokku debconf result: %s", debconf_values)
 
-  has_dokku = host.get_fact(DebPackage, "dokku")
+  has_dokku = cached_fact(DebPackage, "dokku")
 
-  if not has_dokku or debconf_values != get_expected_debconf_values(fqdn):
+  reconfigure = not has_dokku or debconf_values != get_expected_debconf_values(fqdn)
+  if reconfigure:
     dokku_configure_script = f"""
     set -euo pipefail;
     set -x;
@@ -294,7 +490,7 @@ def install_dokku():
 
     logger.info("NB reconfiguring dokku may take a few minutes")
 
-    server.shell(
+    configure = server.shell(
       name="configure dokku",
       commands=(
           dokku_configure_script
@@ -303,57 +499,115 @@ def install_dokku():
       _sudo=True,
     )
 
-    apt.packages(
+    reinstall = apt.packages(
       name="force-(re)install dokku with provided options",
       packages="dokku",
       force=True,
       update=True,
       _sudo=True,
     )
+    invalidates_cached(configure, DOKKU_CONFIGURATION_KEY)
+    invalidates_cached(reinstall, DOKKU_CONFIGURATION_KEY, fact_cache_key(DebPackage, "dokku"))
+
+    record_planned_fact(DokkuDebconf, get_expected_debconf_values(fqdn), DOKKU_CONFIGURATION_KEY)
 
   python.call(
     name='check Dokku was configured correctly',
-    function=lambda: check_dokku_configuration(fqdn),
+    function=check_dokku_configuration,
+    fqdn=fqdn,
+    use_cache=not reconfigure,
   )
 
+def get_letsencrypt_renewal_slot(strategy: str = 'hash') -> int:
+  """
+  return the minute of the day at which the current host should
+  run `dokku letsencrypt:auto-renew`.
+
+  args:
+
+  - strategy: 'hash' (derive the slot from a hash of the host name; stable
+    no matter what else is in the inventory) or 'spread' (space all hosts
+    in the inventory evenly across the day).
+  """
+
+  host_names = [inv_host.name for inv_host in inventory]
+  return host_slot(strategy, host.name, host_names, salt='letsencrypt-renew')
+
+
 @deploy("Install Dokku LetsEncrypt plugin")
-def install_letsencrypt_plugin():
+def install_letsencrypt_plugin(renewal_strategy: str = 'hash',
+                               acme_server: Optional[str] = None):
   """
-  Install Dokku LetsEncrypt plugin on a host.
+  Install Dokku LetsEncrypt plugin on a host, and schedule daily
+  certificate renewal.
+
+  Rather than using `dokku letsencrypt:cron-job --add` (which renews
+  at the same time on every host), renewal runs from
+  `/etc/cron.d/dokku-letsencrypt` at a per-host time - see
+  `get_letsencrypt_renewal_slot`. Any cron job previously added by the
+  plugin is removed.
+
+  args:
+
+  - renewal_strategy: 'hash' or 'spread'; see `get_letsencrypt_renewal_slot`.
+  - acme_server: ACME directory URL to use instead of Let's Encrypt's
+    (e.g. a local test server, or Let's Encrypt staging). If not given,
+    `host.data.get("letsencrypt_server")` is used, if set.
 
   Prereqs:
 
   - Dokku must be installed.
   """
 
-  # install 'letsencrypt' plugin if not already installed
+  newly_installed = install_dokku_plugin('letsencrypt', LETSENCRYPT_PLUGIN_URL)
 
-  installed_plugins = get_installed_plugins()
-  logger.debug("Got installed dokku plugins: %s", installed_plugins)
+  if acme_server is None:
+    acme_server = host.data.get("letsencrypt_server")
 
-  if 'letsencrypt' not in installed_plugins:
+  if acme_server:
     # pylint: disable=unexpected-keyword-arg
     server.shell(
-      name="install letsencrypt plugin",
+      name="set letsencrypt ACME server",
       commands=(
-          "dokku plugin:install https://github.com/dokku/dokku-letsencrypt.git"
+          f"dokku letsencrypt:set --global server {shlex.quote(acme_server)}"
       ),
       _sudo=True,
     )
 
-    # adds a cron job to /var/spool/cron/crontabs/dokku
-    # which will call `dokku letsencrypt:auto-renew`
+  # `letsencrypt:cron-job --add` puts a job in the dokku user's crontab;
+  # we schedule our own instead.
+  dokku_crontab = host.get_fact(Crontab, user='dokku', sudo=True)
+  if any('letsencrypt:auto-renew' in command for command in dokku_crontab):
+    # pylint: disable=unexpected-keyword-arg
     server.shell(
-      name="enable letsencrypt auto-renew",
+      name="remove letsencrypt plugin's own cron job",
       commands=(
-          "dokku letsencrypt:cron-job --add"
+          "dokku letsencrypt:cron-job --remove"
       ),
       _sudo=True,
     )
 
+  slot = get_letsencrypt_renewal_slot(renewal_strategy)
+  hour, minute = slot_to_time(slot)
+  logger.info("%s: letsencrypt renewal scheduled daily at %02d:%02d (strategy '%s')",
+              host.name, hour, minute, renewal_strategy)
+
+  cron_file = (
+      "# managed by pyinfra-dokku\n"
+      + daily_cron_line(slot, 'dokku', '/usr/bin/dokku letsencrypt:auto-renew') + "\n"
+  )
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(
+    name=f"schedule letsencrypt auto-renew at {hour:02d}:{minute:02d}",
+    src=StringIO(cron_file),
+    dest=LETSENCRYPT_CRON_PATH,
+    mode='644',
+    _sudo=True,
+  )
+
   python.call(
     name='check letsencrypt got installed',
     function=check_letsencrypt_installed,
+    use_cache=not newly_installed,
   )
-
-
@@ -0,0 +1,232 @@
+"""
+set up a multi-node Dokku cluster using the k3s scheduler
+"""
+
+import shlex
+
+from io     import StringIO
+from typing import Mapping, Optional
+
+from pyinfra                import config, host, inventory, logger
+from pyinfra.api            import MaskString, StringCommand, deploy
+from pyinfra.facts.files    import File
+from pyinfra.facts.server   import LinuxName
+from pyinfra.operations     import apt, files, server
+
+from .facts                 import AppScale, DokkuReports, K3sVersion
+from .util.k3s              import K3S_ROLES, find_control_plane, render_registries_yaml
+from .util.resources        import scale_differs
+
+##
+# globals
+
+K3S_INSTALL_URL         = 'https://get.k3s.io'
+K3S_API_PORT            = 6443
+K3S_REGISTRIES_PATH     = '/etc/rancher/k3s/registries.yaml'
+K3S_SERVER_UNIT_PATH    = '/etc/systemd/system/k3s.service'
+K3S_AGENT_UNIT_PATH     = '/etc/systemd/system/k3s-agent.service'
+K3S_TOKEN_PATH          = '/etc/rancher/k3s/cluster-token'
+
+
+def _configure_control_plane(token: str, registry: Optional[str]):
+  """
+  initialize k3s via dokku's scheduler-k3s plugin, and make k3s the
+  default scheduler.
+  """
+
+  if not host.get_fact(File, K3S_SERVER_UNIT_PATH):
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name="Initialize k3s control plane",
+                 commands=[
+                   # masked, so the token isn't shown in output
+                   StringCommand("dokku scheduler-k3s:set --global token",
+                                 MaskString(shlex.quote(token))),
+                   "dokku scheduler-k3s:initialize",
+                 ],
+                 _sudo=True,
+                )
+
+  if registry:
+    commands = [
+      f"dokku registry:set --global server {shlex.quote(registry)}",
+      "dokku registry:set --global push-on-release true",
+    ]
+    username = host.data.get("dokku_registry_username")
+    password = host.data.get("dokku_registry_password")
+    if username and password:
+      # passed on stdin (printf is a shell builtin), and masked in output,
+      # so the password isn't visible in the process list or logs
+      commands.append(StringCommand(
+        "printf '%s'", MaskString(shlex.quote(password)), "|",
+        f"dokku registry:login --password-stdin {shlex.quote(registry)} {shlex.quote(username)}",
+      ))
+
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Use registry {registry}",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name="Select k3s scheduler",
+               commands="dokku scheduler:set --global selected k3s",
+               _sudo=True,
+              )
+
+
+def _configure_worker(token: str, server_address: str, registry: Optional[str],
+                      version: Optional[str]):
+  """
+  install k3s `version` (the control plane's, so the agent is never newer
+  than the apiserver) as an agent, and join it to the control plane. If
+  `version` isn't known yet, joining is left for a later run.
+  """
+
+  # pylint: disable=unexpected-keyword-arg
+  apt.packages(name='Install k3s worker prerequisites',
+               packages=['ca-certificates', 'curl'],
+               update=True,
+               cache_time=3600,
+               _sudo=True,
+              )
+
+  if registry:
+    # pylint: disable=unexpected-keyword-arg
+    files.put(name=f"Let k3s pull from {registry}",
+              src=StringIO(render_registries_yaml(registry,
+                                                  host.data.get("dokku_registry_username"),
+                                                  host.data.get("dokku_registry_password"))),
+              dest=K3S_REGISTRIES_PATH,
+              mode='600',
+              _sudo=True,
+             )
+
+  if host.get_fact(File, K3S_AGENT_UNIT_PATH):
+    return
+  if not version:
+    logger.warning("%s: k3s isn't installed on the control plane yet, so its version isn't "
+                   "known; run again once it is, or set k3s_version data", host.name)
+    host.noop("k3s agent install waits for the control plane")
+    return
+
+  # the agent reads the token from a root-only file, so it isn't on any
+  # command line
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name="Write k3s cluster token",
+            src=StringIO(token + "\n"),
+            dest=K3S_TOKEN_PATH,
+            mode='600',
+            _sudo=True,
+           )
+
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name="Install k3s agent and join cluster",
+               commands=(
+                 f"curl -sfL {K3S_INSTALL_URL} | "
+                 f"INSTALL_K3S_VERSION={shlex.quote(version)} "
+                 f"K3S_URL=https://{server_address}:{K3S_API_PORT} "
+                 f"K3S_TOKEN_FILE={K3S_TOKEN_PATH} "
+                 "INSTALL_K3S_EXEC=agent sh -"
+               ),
+               _shell_executable='bash',
+               _sudo=True,
+              )
+
+
+def _set_replicas(replicas: Mapping[str, Mapping[str, int]]):
+  """
+  set per-app process (replica) counts, for apps where they differ from
+  the configured (`dokku ps:scale`) counts. Running apps are rescaled
+  straight away; for stopped or not-yet-deployed apps the counts are just
+  recorded, and used once the app is next deployed or started.
+  """
+
+  ps_reports = host.get_fact(DokkuReports, ('ps',)).get('ps', {})
+  scales     = host.get_fact(AppScale, tuple(sorted(replicas)))
+
+  commands = []
+  for app, scale in sorted(replicas.items()):
+    if not scale_differs(scales.get(app, {}), scale):
+      continue
+    ps_report = ps_reports.get(app, {})
+    running = ps_report.get('deployed') == 'true' and ps_report.get('running', 'false') != 'false'
+    skip_deploy = "" if running else "--skip-deploy "
+    args = " ".join(f"{proctype}={int(count)}" for proctype, count in sorted(scale.items()))
+    commands.append(f"dokku ps:scale {skip_deploy}{shlex.quote(app)} {args}")
+
+  if commands:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Set replicas for {len(commands)} app(s)",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+
+@deploy("Install Dokku k3s cluster")
+def install_k3s_cluster(registry: Optional[str] = None,
+                        replicas: Optional[Mapping[str, Mapping[str, int]]] = None):
+  """
+  Set up a Dokku control-plane host plus worker nodes, using Dokku's
+  k3s scheduler. Run this against the whole inventory: each host's
+  role comes from its data.
+
+  The control-plane host initializes k3s with `dokku
+  scheduler-k3s:initialize`; workers install the k3s agent directly and
+  join using a pre-shared cluster token, so all workers are set up in
+  parallel (rather than one at a time, over ssh from the control plane,
+  as `dokku scheduler-k3s:cluster-add` would).
+
+  required "data":
+
+  - `k3s_role`: 'server' for the (single) control-plane host, 'worker'
+    for worker nodes
+  - `k3s_token`: cluster join token (any hard-to-guess string), the same
+    for all hosts
+
+  optional "data":
+
+  - `k3s_server_address`: address workers use to reach the control plane;
+    defaults to the control-plane host's inventory name
+  - `dokku_registry_username`, `dokku_registry_password`: credentials
+    for `registry`
+  - `k3s_version`: k3s version installed on workers, e.g. 'v1.28.2+k3s1';
+    defaults to the version running on the control plane
+
+  args:
+
+  - registry: container registry that built images are pushed to, and
+    which nodes pull from. (Needed for apps to run on more than one node.)
+  - replicas: maps app names to dicts of process type and count,
+    e.g. `{"myapp": {"web": 3}}`; applied on the control plane.
+
+  prerequisites:
+
+  - Ubuntu hosts.
+  - Dokku must be installed on the control-plane host (see `install_dokku`).
+  """
+
+  config.SUDO = True
+
+  assert host.get_fact(LinuxName) == 'Ubuntu'
+
+  role  = host.data.get("k3s_role")
+  token = host.data.get("k3s_token")
+  if role not in K3S_ROLES:
+    raise ValueError(f"host {host.name}: k3s_role should be one of {K3S_ROLES}, got {role!r}")
+  assert token, "k3s_token must be set"
+
+  control_plane   = find_control_plane(inventory)
+  server_address  = host.data.get("k3s_server_address") or control_plane.name
+
+  logger.info("%s: setting up as k3s %s (control plane %s)", host.name, role, server_address)
+
+  # control-plane operations are declared first, so k3s is up before
+  # workers try to join.
+  if role == 'server':
+    _configure_control_plane(token, registry)
+  else:
+    version = host.data.get("k3s_version") or control_plane.get_fact(K3sVersion)
+    _configure_worker(token, server_address, registry, version)
+
+  if role == 'server' and replicas:
+    _set_replicas(replicas)
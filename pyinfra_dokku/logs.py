@@ -0,0 +1,158 @@
+"""
+configure container log drivers, rotation and log shipping on Dokku hosts
+"""
+
+import json
+import shlex
+import time
+
+from typing import Any, Mapping, Optional
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.facts.hardware import Cpus
+from pyinfra.facts.server   import Command
+from pyinfra.operations     import python, server
+
+from .docker_daemon         import update_docker_daemon_config
+from .facts                 import AppLogUsage, DokkuGlobalProperties, DokkuReports
+from .resources             import restart_apps
+from .util.logs             import daemon_log_config, plan_app_log_commands
+from .util.resources        import default_restart_parallelism
+
+
+def report_log_usage(stage: str, stats_file: Optional[str] = None):
+  """
+  log the bytes of container logs each app on the current host has on disk
+  (see the `AppLogUsage` fact), and if `stats_file` is given, append them to
+  that file (on the machine running pyinfra) as a line of JSON.
+  """
+
+  usage = host.reload_fact(AppLogUsage)
+  logger.info("%s: log bytes per app (%s): %s", host.name, stage, usage)
+
+  if stats_file:
+    record = {'time': time.time(), 'host': host.name, 'stage': stage, 'log_bytes': usage}
+    with open(stats_file, 'a', encoding='utf8') as outfile:
+      outfile.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def _global_logs_commands(max_size: str, vector_sink: Optional[str]):
+  """
+  return the commands needed to set dokku's global log settings, judged
+  from the logs plugin's global property files (which, unlike
+  `logs:report`, are there on hosts with no apps).
+  """
+
+  current = host.get_fact(DokkuGlobalProperties, 'logs')
+  commands = []
+  if current.get('max-size') != max_size:
+    commands.append(f"dokku logs:set --global max-size {shlex.quote(max_size)}")
+  if vector_sink is not None and current.get('vector-sink') != vector_sink:
+    commands.append(f"dokku logs:set --global vector-sink {shlex.quote(vector_sink)}")
+  return commands
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+@deploy("Configure Dokku logging")
+def configure_logs(apps: Optional[Mapping[str, Mapping[str, Any]]] = None,
+                   driver: Optional[str] = 'local',
+                   max_size: str = '10m',
+                   max_file: int = 3,
+                   vector_sink: Optional[str] = None,
+                   restart: bool = True,
+                   restart_parallelism: Optional[int] = None,
+                   restart_docker: bool = False,
+                   measure: bool = False,
+                   stats_file: Optional[str] = None,
+                  ):
+  """
+  Configure how container logs are stored, rotated and shipped, globally
+  and per app.
+
+  Current settings for all apps are read in one remote call, all changes
+  are applied in one batch, and only apps whose own settings changed are
+  restarted. (Global changes apply to each app's next deploy or restart.)
+
+  args:
+
+  - apps: maps app names to per-app log settings; see
+    `pyinfra_dokku.util.logs.plan_app_log_commands`. e.g.
+
+    .. code:: python
+
+        {"noisy-app": {"max_size": "5m", "max_file": 2, "non_blocking": True},
+         "api": {"vector_sink": "http://?uri=https%3A//logs.example.com/api"}}
+
+  - driver: default docker log driver, set in `/etc/docker/daemon.json`
+    ('local' stores logs compactly, with rotation); None leaves it alone
+  - max_size: global log rotation size (`logs:set --global max-size`)
+  - max_file: number of rotated log files docker keeps, by default
+  - vector_sink: if given, global vector sink DSN to ship all apps' logs to
+  - restart: whether to restart apps whose settings changed
+  - restart_parallelism: how many apps to restart at once. Defaults to half
+    the host's cores.
+  - restart_docker: whether to restart docker if its config changed
+  - measure: if true, report bytes of logs on disk per app before and after
+    applying settings (run again later to see the effect over time)
+  - stats_file: if given (with `measure`), log usage is also appended to
+    this file (on the machine running pyinfra) as JSON lines.
+
+  Prereqs:
+
+  - Dokku must be installed, and the apps must exist.
+  """
+
+  config.SUDO = True
+  apps = apps or {}
+
+  if measure:
+    python.call(
+      name='report log usage before',
+      function=report_log_usage,
+      stage='before',
+      stats_file=stats_file,
+    )
+
+  if driver:
+    update_docker_daemon_config("Set default docker log driver",
+                                daemon_log_config(driver, max_size, max_file),
+                                restart_docker=restart_docker)
+
+  reports = host.get_fact(DokkuReports, ('logs', 'docker-options'))
+  logs_reports = reports.get('logs', {})
+  options_reports = reports.get('docker options', {})
+
+  commands = _global_logs_commands(max_size, vector_sink)
+  changed_apps = []
+  for app, spec in sorted(apps.items()):
+    app_commands = plan_app_log_commands(app, spec,
+                                         logs_reports.get(app, {}),
+                                         options_reports.get(app, {}))
+    if app_commands:
+      changed_apps.append(app)
+      commands.extend(app_commands)
+
+  if vector_sink or any(spec.get('vector_sink') for spec in apps.values()):
+    if not host.get_fact(Command, "docker ps --quiet --filter name=^vector$"):
+      commands.append("dokku logs:vector-start")
+
+  if commands:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Configure logging ({len(changed_apps)} app(s) changed)",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+  if restart:
+    if restart_parallelism is None:
+      restart_parallelism = default_restart_parallelism(host.get_fact(Cpus))
+    restart_apps(changed_apps, restart_parallelism)
+
+  if measure:
+    python.call(
+      name='report log usage after',
+      function=report_log_usage,
+      stage='after',
+      stats_file=stats_file,
+    )
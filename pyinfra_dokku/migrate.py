@@ -0,0 +1,238 @@
+"""
+move Dokku apps between hosts
+"""
+
+import shlex
+import time
+
+from typing import Dict, Optional
+
+from pyinfra                import config, host, inventory, logger
+from pyinfra.api            import deploy
+from pyinfra.operations     import apt, python, server
+
+from .facts                 import AppScale, DokkuReports, DpkgArchitecture
+from .util.migrate          import (host_path_mounts, migrated_image, parse_mount_specs,
+                                    parse_transfer_output, render_transfer_script,
+                                    summarize_transfers)
+from .util.resources        import scale_differs
+
+# when each app's cutover started (app name => time.time()), so downtime
+# can be reported once the app is running on the target host.
+_cutover_started: Dict[str, float] = {}
+
+
+class MigrateException(Exception):
+  """
+  Base exception for app migration problems.
+  """
+
+
+def transfer_app_data(app: str, ssh_target: str, mounts, include_image: bool, phase: str):
+  """
+  run a transfer script (see `render_transfer_script`) on the current
+  (source) host, and log what was transferred.
+
+  Raises a MigrateException if any transfer fails.
+  """
+
+  script = render_transfer_script(app, ssh_target, mounts, include_image=include_image)
+  status, stdout, stderr = host.run_shell_command(command=script, sudo=config.SUDO,
+                                                  shell_executable='bash')
+  transfers = parse_transfer_output(stdout)
+  for transfer in transfers:
+    logger.info("%s: %s: %s %s: %s bytes in %.1fs",
+                host.name, app, phase, transfer.item, transfer.bytes, transfer.seconds)
+  if not status:
+    raise MigrateException(f"{phase} of app '{app}' to {ssh_target} failed. stderr = {stderr}")
+  logger.info("%s: %s: %s transferred %s", host.name, app, phase, summarize_transfers(transfers))
+
+
+def cut_over(app: str, ssh_target: str, mounts):
+  """
+  stop `app` on the current (source) host, then transfer whatever changed
+  since the initial sync.
+  """
+
+  _cutover_started[app] = time.time()
+  status, _stdout, stderr = host.run_shell_command(command=f"dokku ps:stop {shlex.quote(app)}",
+                                                   sudo=config.SUDO)
+  if not status:
+    raise MigrateException(f"couldn't stop app '{app}'. stderr = {stderr}")
+  transfer_app_data(app, ssh_target, mounts, include_image=False, phase="final sync")
+
+
+def report_downtime(app: str):
+  """
+  log how long `app` was down for, from being stopped on the source
+  host to being deployed on the current (target) host.
+  """
+
+  started = _cutover_started.pop(app, None)
+  if started is not None:
+    logger.info("%s: %s: migration downtime %.1fs", host.name, app, time.time() - started)
+
+
+def _prepare_target(app: str, source_reports, source_scale, mount_specs):
+  """
+  create `app` on the current (target) host, with the same storage
+  mounts, domains and process scale it has on the source.
+  """
+
+  target_reports = host.get_fact(DokkuReports, ('ps', 'storage', 'domains'))
+  quoted_app = shlex.quote(app)
+
+  commands = []
+  if app not in target_reports.get('ps', {}):
+    commands.append(f"dokku apps:create {quoted_app}")
+
+  current_specs = parse_mount_specs(target_reports.get('storage', {}).get(app, {}))
+  for spec in mount_specs:
+    if spec not in current_specs:
+      if spec.startswith('/'):
+        commands.append(f"mkdir -p {shlex.quote(spec.split(':', 1)[0])}")
+      commands.append(f"dokku storage:mount {quoted_app} {shlex.quote(spec)}")
+
+  domains = source_reports.get('domains', {}).get(app, {}).get('domains app vhosts', '').split()
+  current_domains = target_reports.get('domains', {}).get(app, {}).get('domains app vhosts', '')
+  if domains and sorted(domains) != sorted(current_domains.split()):
+    commands.append(f"dokku domains:set {quoted_app} "
+                    + " ".join(shlex.quote(domain) for domain in domains))
+
+  target_scale = host.get_fact(AppScale, (app,)).get(app, {})
+  if source_scale and scale_differs(target_scale, source_scale):
+    args = " ".join(f"{proctype}={count}" for proctype, count in sorted(source_scale.items()))
+    commands.append(f"dokku ps:scale --skip-deploy {quoted_app} {args}")
+
+  if commands:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Create app '{app}' for migration",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+@deploy("Migrate Dokku app")
+def migrate_app(app: str,
+                source: str,
+                target: str,
+                target_address: Optional[str] = None,
+                ssh_user: str = 'root',
+                cutover: bool = True,
+               ):
+  """
+  Move an app from one inventory host to another. Run this against (at
+  least) both hosts.
+
+  The app is created on the target host with the same domains, storage
+  mounts and process scale. Its current image, config (`ENV`) and storage
+  directories are then streamed directly from the source host to the
+  target, all in parallel, while the app keeps running on the source. At
+  cutover, the app is stopped on the source, the (typically small) changes
+  since are re-synced, and the app is deployed on the target from the
+  transferred image. Bytes transferred, throughput and downtime are logged.
+
+  The app is left stopped (not destroyed) on the source host, and DNS
+  isn't changed.
+
+  args:
+
+  - app: app to migrate
+  - source: inventory name of the host the app is on
+  - target: inventory name of the host to move it to
+  - target_address: address the source host uses to reach the target;
+    defaults to `target`
+  - ssh_user: user the source host connects to the target as; needs
+    key-based ssh access, and to be able to run docker and write dokku's
+    files (normally root)
+  - cutover: if false, only do the initial sync (e.g. to pre-seed a big
+    migration); running again with `cutover=True` re-syncs only changes.
+
+  Prereqs:
+
+  - Dokku must be installed on both hosts, and named docker volumes aren't
+    migrated (only host directory mounts are).
+  - Both hosts must have the same architecture (e.g. both arm64), since the
+    app's image is transferred as is.
+  """
+
+  config.SUDO = True
+
+  if host.name not in (source, target):
+    host.noop(f"not involved in migrating app '{app}'")
+    return
+
+  source_host = inventory.get_host(source)
+  if source_host is None or inventory.get_host(target) is None:
+    raise MigrateException(f"hosts '{source}' and '{target}' must both be in the inventory")
+
+  source_arch = source_host.get_fact(DpkgArchitecture)
+  target_arch = inventory.get_host(target).get_fact(DpkgArchitecture)
+  if source_arch != target_arch:
+    raise MigrateException(f"can't migrate app '{app}' from {source} ({source_arch}) to "
+                           f"{target} ({target_arch}): its image won't run there; "
+                           "deploy it to the target from source instead")
+
+  source_reports = source_host.get_fact(DokkuReports, ('ps', 'storage', 'domains'))
+  if app not in source_reports.get('ps', {}):
+    raise MigrateException(f"app '{app}' not found on host '{source}'")
+
+  mount_specs = parse_mount_specs(source_reports.get('storage', {}).get(app, {}))
+  mounts = host_path_mounts(mount_specs)
+  if len(mounts) != len(mount_specs):
+    logger.warning("%s: app '%s' uses named docker volumes, which won't be migrated",
+                   host.name, app)
+  ssh_target = f"{ssh_user}@{target_address or target}"
+
+  # pylint: disable=unexpected-keyword-arg
+  apt.packages(name='Install migration prerequisites',
+               packages=['rsync', 'zstd'],
+               update=True,
+               cache_time=3600,
+               _sudo=True,
+              )
+
+  if host.name == target:
+    _prepare_target(app, source_reports, source_host.get_fact(AppScale, (app,)).get(app, {}),
+                    mount_specs)
+
+  if host.name == source:
+    python.call(
+      name=f"Sync app '{app}' to {target}",
+      function=transfer_app_data,
+      app=app,
+      ssh_target=ssh_target,
+      mounts=mounts,
+      include_image=True,
+      phase="initial sync",
+    )
+
+  if not cutover:
+    return
+
+  if host.name == source:
+    python.call(
+      name=f"Stop app '{app}' and re-sync to {target}",
+      function=cut_over,
+      app=app,
+      ssh_target=ssh_target,
+      mounts=mounts,
+    )
+
+  if host.name == target:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Deploy migrated app '{app}'",
+                 commands=(
+                   f"dokku git:from-image {shlex.quote(app)} "
+                   f"{shlex.quote(migrated_image(app))}"
+                 ),
+                 _sudo=True,
+                )
+
+    python.call(
+      name=f"Report downtime for app '{app}'",
+      function=report_downtime,
+      app=app,
+    )
+
@@ -0,0 +1,153 @@
+"""
+pick the fastest apt mirrors for each host, for the Ubuntu, docker and
+dokku package sources
+"""
+
+from io     import StringIO
+from typing import Dict, Mapping, Optional, Sequence
+
+from pyinfra              import host, logger
+from pyinfra.facts.files  import File, FindInFile
+from pyinfra.operations   import files, server
+
+from .facts               import MirrorProbes
+from .util.mirrors        import (MIRROR_LIST_DIR, MIRROR_SOURCES, mirror_list_path, probe_url,
+                                  rank_mirrors, render_mirror_list, render_ubuntu_sources)
+
+UBUNTU_SOURCES_PATH     = '/etc/apt/sources.list'
+UBUNTU_MIRRORS_FILENAME = 'ubuntu-mirrors'
+UBUNTU_MIRRORS_PATH     = f"/etc/apt/sources.list.d/{UBUNTU_MIRRORS_FILENAME}.list"
+
+
+def _disable_default_ubuntu_sources(code_name: str):
+  """
+  comment out the release, updates and backports lines in
+  /etc/apt/sources.list, which the mirror list replaces. (Security lines
+  are left alone.)
+  """
+
+  pocket = r"\s.*\s" + code_name
+  enabled = host.get_fact(FindInFile, UBUNTU_SOURCES_PATH,
+                          r"^deb\(-src\)\?" + pocket + r"\(-updates\|-backports\)\?\s")
+  if enabled:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name="Disable default Ubuntu apt sources",
+                 commands=(
+                   r"sed -i -E 's/^(deb(-src)?" + pocket + r"(-updates|-backports)?\s)/# \1/' "
+                   + UBUNTU_SOURCES_PATH
+                 ),
+                 _sudo=True,
+                )
+
+
+def _restore_default_ubuntu_sources(code_name: str):
+  """
+  undo `_disable_default_ubuntu_sources`, if Ubuntu mirrors were in use:
+  remove the apt sources file using the mirror list, and uncomment the
+  default lines in /etc/apt/sources.list.
+  """
+
+  if not host.get_fact(File, UBUNTU_MIRRORS_PATH):
+    return
+
+  pocket = r"\s.*\s" + code_name
+  # pylint: disable=unexpected-keyword-arg
+  files.file(name="Remove Ubuntu apt sources using mirror list",
+             path=UBUNTU_MIRRORS_PATH,
+             present=False,
+             _sudo=True,
+            )
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name="Re-enable default Ubuntu apt sources",
+               commands=(
+                 r"sed -i -E 's/^# (deb(-src)?" + pocket + r"(-updates|-backports)?\s)/\1/' "
+                 + UBUNTU_SOURCES_PATH
+               ),
+               _sudo=True,
+              )
+
+
+def select_apt_mirrors(candidates: Mapping[str, Sequence[str]],
+                       code_name: str,
+                       fallbacks: Optional[Mapping[str, str]] = None,
+                       timeout: int = 10,
+                      ) -> Dict[str, str]:
+  """
+  Measure latency and throughput from the current host to each candidate
+  mirror (by fetching its `Release` file for `code_name`), and write an
+  apt mirror list per source under /etc/apt/mirrors, fastest mirror first.
+  apt uses the first mirror in a list, and falls back to the next if a
+  mirror fails. Mirrors which failed to respond are kept, last.
+
+  For the 'ubuntu' source, an apt sources file using the list is added,
+  and the matching default lines in /etc/apt/sources.list are commented
+  out; without 'ubuntu' candidates, a previous run's changes are undone.
+  The caller is responsible for using the returned URIs for other
+  sources.
+
+  args:
+
+  - candidates: maps sources (some of 'ubuntu', 'docker', 'dokku') to
+    candidate base URLs, as would appear in an apt `deb` line, e.g.
+    `{"ubuntu": ["http://mirror.example.com/ubuntu"]}`
+  - code_name: Ubuntu release codename, e.g. 'focal'
+  - fallbacks: maps sources to the official repository URL, which is
+    added as the last candidate if not already present
+  - timeout: maximum seconds to spend fetching from each mirror
+
+  Returns a dict mapping each source with candidates to an apt URI
+  (`mirror+file:...`) for its mirror list.
+  """
+
+  unknown = sorted(set(candidates) - set(MIRROR_SOURCES))
+  if unknown:
+    raise ValueError(f"unknown mirror sources {unknown}, expected some of {MIRROR_SOURCES}")
+
+  fallbacks = fallbacks or {}
+  by_source = {}
+  for source, bases in candidates.items():
+    bases = list(bases)
+    if fallbacks.get(source) and fallbacks[source] not in bases:
+      bases.append(fallbacks[source])
+    if bases:
+      by_source[source] = bases
+  if not by_source:
+    _restore_default_ubuntu_sources(code_name)
+    return {}
+
+  urls = sorted({probe_url(base, code_name) for bases in by_source.values() for base in bases})
+  probes = host.get_fact(MirrorProbes, urls, timeout)
+
+  # pylint: disable=unexpected-keyword-arg
+  files.directory(name="Create apt mirror list directory",
+                  path=MIRROR_LIST_DIR,
+                  _sudo=True,
+                 )
+
+  uris = {}
+  for source, bases in sorted(by_source.items()):
+    ranked = rank_mirrors(bases, probes, code_name)
+    logger.info("%s: %s mirrors, fastest first: %s", host.name, source, ranked)
+
+    # pylint: disable=unexpected-keyword-arg
+    files.put(name=f"Write {source} apt mirror list",
+              src=StringIO(render_mirror_list(ranked)),
+              dest=mirror_list_path(source),
+              mode="644",
+              _sudo=True,
+             )
+    uris[source] = f"mirror+file:{mirror_list_path(source)}"
+
+  if 'ubuntu' in uris:
+    # pylint: disable=unexpected-keyword-arg
+    files.put(name="Add Ubuntu apt sources using mirror list",
+              src=StringIO(render_ubuntu_sources(code_name)),
+              dest=UBUNTU_MIRRORS_PATH,
+              mode="644",
+              _sudo=True,
+             )
+    _disable_default_ubuntu_sources(code_name)
+  else:
+    _restore_default_ubuntu_sources(code_name)
+
+  return uris
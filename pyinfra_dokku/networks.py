@@ -0,0 +1,77 @@
+"""
+manage private docker networks between Dokku apps
+"""
+
+from typing import Any, Mapping, Optional, Sequence
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.facts.hardware import Cpus
+from pyinfra.operations     import server
+
+from .facts                 import DokkuNetworks, DokkuReports
+from .resources             import restart_apps
+from .util.networks         import app_network_hosts, plan_network_commands
+from .util.resources        import default_restart_parallelism
+
+
+@deploy("Configure Dokku networks")
+def configure_networks(networks: Sequence[str],
+                       apps: Mapping[str, Mapping[str, Any]],
+                       restart: bool = True,
+                       restart_parallelism: Optional[int] = None):
+  """
+  Create docker networks, and attach apps to them, so apps can talk to each
+  other directly rather than via their public domains and the proxy.
+
+  Current settings are read from `dokku network:report` in one remote call,
+  and all changes for the host are applied in one batch.
+
+  args:
+
+  - networks: names of networks to create (if they don't already exist)
+  - apps: maps app names to dicts of network properties (as accepted by
+    `dokku network:set`) and values, e.g.
+
+    .. code:: python
+
+        {
+          "api":    {"attach-post-deploy": ["internal"]},
+          "worker": {"attach-post-create": ["internal"]},
+        }
+
+    Apps attached to a network can reach each other's processes at
+    `APP.PROCESS_TYPE`, e.g. `http://api.web:5000`.
+  - restart: whether to restart apps whose settings changed, so the changes
+    take effect (otherwise they take effect on the next deploy)
+  - restart_parallelism: how many apps to restart at once. Defaults to half
+    the host's cores.
+
+  Prereqs:
+
+  - Dokku must be installed, and the apps must exist.
+  """
+
+  config.SUDO = True
+
+  reports = host.get_fact(DokkuReports, ('network',)).get('network', {})
+  commands, changed_apps = plan_network_commands(networks, apps,
+                                                 host.get_fact(DokkuNetworks), reports)
+
+  for network, attached in sorted(app_network_hosts(apps).items()):
+    logger.info("%s: network '%s' connects apps %s", host.name, network, attached)
+
+  if not commands:
+    host.noop("dokku networks already up to date")
+    return
+
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name=f"Configure networks for {len(changed_apps)} app(s)",
+               commands=commands,
+               _sudo=True,
+              )
+
+  if restart:
+    if restart_parallelism is None:
+      restart_parallelism = default_restart_parallelism(host.get_fact(Cpus))
+    restart_apps(changed_apps, restart_parallelism)
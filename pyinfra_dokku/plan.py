@@ -0,0 +1,134 @@
+"""
+preview what `install_dokku` (and plugin installs) would change across a
+fleet, from facts cached by earlier runs (see `pyinfra_dokku.fact_cache`),
+without connecting to any host
+
+e.g.:
+
+.. code:: bash
+
+    $ python -m pyinfra_dokku.plan --cache .pyinfra-dokku-facts.sqlite \\
+        --fqdn dokku1.example.com=example.io --plugin letsencrypt
+"""
+
+import argparse
+
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from pyinfra.facts.deb    import DebPackage
+from pyinfra.facts.files  import File
+
+from .fact_cache          import DEFAULT_FACT_CACHE_TTL, fact_cache_key
+from .install             import (DOKKU_CONFIGURATION_KEY, INSTALLED_PLUGINS_KEY, ROOT_ID_PATH,
+                                  get_expected_debconf_values)
+from .util.fact_cache     import DEFAULT_FACT_CACHE_PATH, FactCache
+
+CachedFacts = Mapping[str, Tuple[Any, float]]
+
+
+def plan_install(facts: CachedFacts, fqdn: str, plugins: Sequence[str] = ()) -> List[str]:
+  """
+  return descriptions of the changes `install_dokku` (followed by installing
+  `plugins`) would make to a host, judged from its cached `facts` (as
+  returned by `FactCache.entries`). Facts which aren't cached are reported
+  as unknown.
+  """
+
+  changes = []
+
+  def lookup(key):
+    if key not in facts:
+      changes.append(f"unknown: nothing cached for {key}")
+      return None, False
+    return facts[key][0], True
+
+  has_dokku, known = lookup(fact_cache_key(DebPackage, "dokku"))
+  if known and not has_dokku:
+    changes.append("install dokku")
+
+  debconf_values, known = lookup(DOKKU_CONFIGURATION_KEY)
+  if known and has_dokku and debconf_values != get_expected_debconf_values(fqdn):
+    changed = sorted(f"{key}={value}"
+                     for (_owner, key), value in get_expected_debconf_values(fqdn).items()
+                     if (debconf_values or {}).get(('dokku', key)) != value)
+    changes.append(f"reconfigure and reinstall dokku ({', '.join(changed)})")
+
+  has_root_id, known = lookup(fact_cache_key(File, ROOT_ID_PATH))
+  if known and not has_root_id:
+    changes.append("create root ssh key")
+
+  if plugins:
+    installed, known = lookup(INSTALLED_PLUGINS_KEY)
+    for plugin in plugins:
+      if known and plugin not in (installed or {}):
+        changes.append(f"install {plugin} plugin")
+
+  return changes
+
+
+def plan_fleet(cache_path: str = DEFAULT_FACT_CACHE_PATH,
+               fqdns: Optional[Mapping[str, str]] = None,
+               plugins: Sequence[str] = (),
+               hosts: Optional[Sequence[str]] = None,
+              ) -> Dict[str, Tuple[List[str], float]]:
+  """
+  return a dict mapping each host (by default, every host with cached
+  facts) to the changes `plan_install` predicts for it, and the age in
+  seconds of the oldest cached fact used.
+
+  Each host's fqdn is taken from `fqdns`, defaulting to its name.
+  """
+
+  entries = FactCache(cache_path).entries()
+  fqdns = fqdns or {}
+  plan = {}
+  for host_name in (hosts if hosts is not None else sorted(entries)):
+    facts = entries.get(host_name, {})
+    oldest = max((age for _value, age in facts.values()), default=0.0)
+    plan[host_name] = (plan_install(facts, fqdns.get(host_name, host_name), plugins), oldest)
+  return plan
+
+
+def format_plan(plan: Mapping[str, Tuple[List[str], float]],
+                ttl: float = DEFAULT_FACT_CACHE_TTL) -> str:
+  """
+  format the result of `plan_fleet` for display; hosts whose cached facts
+  are older than `ttl` seconds are flagged as stale.
+  """
+
+  lines = []
+  for host_name, (changes, oldest) in plan.items():
+    stale = " - STALE" if oldest >= ttl else ""
+    lines.append(f"{host_name} (facts up to {oldest / 60:.0f} min old{stale}):")
+    lines.extend(f"  - {change}" for change in changes)
+    if not changes:
+      lines.append("  no changes")
+  changed = sum(1 for changes, _oldest in plan.values() if changes)
+  lines.append(f"{changed} of {len(plan)} host(s) would change")
+  return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+  """
+  command-line entry point; see module docstring.
+  """
+
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument('--cache', default=DEFAULT_FACT_CACHE_PATH,
+                      help="fact cache database (default: %(default)s)")
+  parser.add_argument('--fqdn', action='append', default=[], metavar='HOST=FQDN',
+                      help="fqdn Dokku should have on HOST (default: the host name)")
+  parser.add_argument('--plugin', action='append', default=[],
+                      help="dokku plugin which should be installed")
+  parser.add_argument('--ttl', type=float, default=DEFAULT_FACT_CACHE_TTL,
+                      help="flag facts older than this many seconds as stale")
+  parser.add_argument('hosts', nargs='*', help="hosts to plan for (default: all cached)")
+  args = parser.parse_args(argv)
+
+  fqdns = dict(spec.split('=', 1) for spec in args.fqdn)
+  plan = plan_fleet(args.cache, fqdns, args.plugin, args.hosts or None)
+  print(format_plan(plan, args.ttl))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,95 @@
+"""
+declaratively manage resource limits and process scaling for Dokku apps
+"""
+
+import shlex
+
+from typing import Any, Mapping, Optional, Sequence
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.facts.hardware import Cpus
+from pyinfra.operations     import server
+
+from .facts                 import AppScale, DokkuReports
+from .util.resources        import (default_restart_parallelism, plan_resource_commands,
+                                    resolve_resource_spec)
+
+
+def restart_apps(apps: Sequence[str], parallelism: int):
+  """
+  restart `apps` (if any) in one batch, `parallelism` at a time.
+
+  Intended to be called from within a deploy.
+  """
+
+  if not apps:
+    return
+
+  quoted_apps = " ".join(shlex.quote(app) for app in apps)
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name=f"Restart {len(apps)} changed app(s)",
+               commands=(
+                   f"printf '%s\\n' {quoted_apps} | "
+                   f"xargs -P {int(parallelism)} -n 1 dokku ps:restart"
+               ),
+               _sudo=True,
+              )
+
+
+@deploy("Configure Dokku app resources")
+def configure_app_resources(spec: Mapping[str, Mapping[str, Any]],
+                            restart_parallelism: Optional[int] = None):
+  """
+  Apply resource limits, reservations and process counts to Dokku apps,
+  then restart the apps that changed.
+
+  Current state for all apps is read with two remote calls; all changes
+  for an app are applied without restarting it; and changed apps are then
+  restarted in one batch, `restart_parallelism` at a time.
+
+  args:
+
+  - spec: maps app names to dicts with (optional) keys
+
+    - 'limit': dict of resource to value, passed to `dokku resource:limit`,
+      e.g. `{'cpu': 1, 'memory': '512m'}`
+    - 'reserve': likewise, for `dokku resource:reserve`
+    - 'scale': dict of process type to count, passed to `dokku ps:scale`,
+      e.g. `{'web': 2, 'worker': 1}`
+
+    Apps without a CPU limit get one of half the host's cores.
+
+  - restart_parallelism: how many apps to restart at once. Defaults
+    to half the host's cores.
+
+  prereqs:
+
+  - Dokku must be installed, and the apps must exist.
+  """
+
+  config.SUDO = True
+
+  cpus    = host.get_fact(Cpus)
+  desired = resolve_resource_spec(spec, cpus)
+  reports = host.get_fact(DokkuReports, ('resource',))
+  scales  = host.get_fact(AppScale, tuple(sorted(desired)))
+
+  if restart_parallelism is None:
+    restart_parallelism = default_restart_parallelism(cpus)
+
+  changed_apps = []
+  for app, app_spec in sorted(desired.items()):
+    commands = plan_resource_commands(app, app_spec, reports, scales.get(app, {}))
+    if not commands:
+      logger.debug("resources for app '%s' already up to date", app)
+      continue
+
+    changed_apps.append(app)
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Set resources for app {app}",
+                 commands=commands,
+                 _sudo=True,
+                )
+
+  restart_apps(changed_apps, restart_parallelism)
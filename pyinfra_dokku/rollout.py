@@ -0,0 +1,201 @@
+"""
+roll a deploy out across an inventory in waves: a canary host first, then
+growing batches, each gated on health checks
+
+This drives pyinfra through its Python API, so call it from a Python
+script (not from a pyinfra deploy file), e.g.:
+
+.. code:: python
+
+    from pyinfra_dokku.install import install_dokku
+    from pyinfra_dokku.rollout import rollout
+
+    result = rollout([("dokku1.example.com", {"ssh_user": "ubuntu"}), ...],
+                     install_dokku, config_kwargs={"SUDO": True})
+"""
+
+from typing import Any, Callable, Collection, Dict, Mapping, Optional, Sequence, Set, Tuple, Union
+
+from pyinfra                import host, logger
+from pyinfra.api            import Config, Inventory, State
+from pyinfra.api.connect    import connect_all, disconnect_all
+from pyinfra.api.deploy     import add_deploy
+from pyinfra.api.operations import run_ops
+from pyinfra.context        import ctx_host, ctx_state
+
+from .util.rollout          import RolloutResult, WaveResult, plan_waves, run_waves
+
+HostSpec = Union[str, Tuple[str, Mapping[str, Any]]]
+
+
+class RolloutException(Exception):
+  """
+  Base exception for rollout problems; raised by health checks.
+  """
+
+
+def check_dokku_health():
+  """
+  default rollout health check: make sure docker and dokku both respond
+  on the current host.
+
+  Raises a RolloutException if not.
+  """
+
+  for command in ('docker info --format "{{.ServerVersion}}"', 'dokku version'):
+    status, _stdout, stderr = host.run_shell_command(command=command, sudo=True)
+    if not status:
+      raise RolloutException(f"health check '{command}' failed on {host.name}: {stderr}")
+
+
+def _host_name(spec: HostSpec) -> str:
+  return spec if isinstance(spec, str) else spec[0]
+
+
+def _deploy_wave(state: State,
+                 deploy_func: Callable[..., Any],
+                 deploy_args: Sequence[Any],
+                 deploy_kwargs: Mapping[str, Any],
+                ) -> Set[str]:
+  """
+  connect to the hosts in `state`'s inventory and run `deploy_func` on
+  them. Returns the names of hosts which couldn't be connected to or
+  failed the deploy; if pyinfra raises (e.g. the deploy raises while it's
+  being planned), that's every host.
+  """
+
+  inventory = state.inventory
+  try:
+    connect_all(state)
+    add_deploy(state, deploy_func, *deploy_args, **deploy_kwargs)
+    run_ops(state)
+  except Exception as ex: # pylint: disable=broad-except
+    names = [wave_host.name for wave_host in inventory]
+    logger.error("rollout wave %s failed: %s", names, ex)
+    return set(names)
+
+  return {
+    wave_host.name for wave_host in inventory
+    if wave_host in state.failed_hosts or wave_host not in state.activated_hosts
+  }
+
+
+# pylint: disable=too-many-arguments
+def run_wave(hosts: Sequence[HostSpec],
+             deploy_func: Callable[..., Any],
+             deploy_args: Sequence[Any] = (),
+             deploy_kwargs: Optional[Mapping[str, Any]] = None,
+             health_check: Optional[Callable[[], Any]] = check_dokku_health,
+             parallelism: Optional[int] = None,
+             config_kwargs: Optional[Mapping[str, Any]] = None,
+             group_data: Optional[Mapping[str, Any]] = None,
+            ) -> Collection[str]:
+  """
+  run `deploy_func` against `hosts` in parallel (at most `parallelism` at
+  a time), then run `health_check` (with the pyinfra `host` set) on each
+  host where the deploy succeeded.
+
+  Returns the names of hosts which couldn't be connected to, failed the
+  deploy, or failed the health check (by raising an exception). If the
+  deploy raises while being planned or run, every host in the wave has
+  failed. Hosts are disconnected from before returning.
+  """
+
+  inventory = Inventory((list(hosts), dict(group_data or {})))
+  config = Config(PARALLEL=parallelism or len(hosts), **dict(config_kwargs or {}))
+  state = State(inventory, config)
+
+  try:
+    failed = _deploy_wave(state, deploy_func, deploy_args, dict(deploy_kwargs or {}))
+
+    if health_check is not None:
+      for wave_host in inventory:
+        if wave_host.name in failed:
+          continue
+        with ctx_state.use(state), ctx_host.use(wave_host):
+          try:
+            health_check()
+          except Exception as ex: # pylint: disable=broad-except
+            logger.error("%s: health check failed: %s", wave_host.name, ex)
+            failed.add(wave_host.name)
+  finally:
+    disconnect_all(state)
+
+  return failed
+
+
+def _log_wave(result: WaveResult):
+  logger.info("rollout wave of %s host(s) took %.1fs; failed: %s",
+              len(result.hosts), result.seconds, result.failed or "none")
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def rollout(hosts: Sequence[HostSpec],
+            deploy_func: Callable[..., Any],
+            *deploy_args,
+            canary: int = 1,
+            growth: float = 2.0,
+            max_wave_size: Optional[int] = None,
+            parallelism: Optional[int] = None,
+            max_failure_fraction: float = 0.0,
+            health_check: Optional[Callable[[], Any]] = check_dokku_health,
+            config_kwargs: Optional[Mapping[str, Any]] = None,
+            group_data: Optional[Mapping[str, Any]] = None,
+            **deploy_kwargs,
+           ) -> RolloutResult:
+  """
+  Run a deploy (e.g. `install_dokku`) across `hosts` in waves: first
+  `canary` host(s), then batches `growth` times larger each time (up to
+  `max_wave_size` hosts), so a bad change is caught before it reaches
+  every host, without the slowness of a fully serial run.
+
+  After each wave, `health_check` is run on each host in it. Once the
+  fraction of hosts that failed (to connect, to deploy, or the health
+  check) exceeds `max_failure_fraction`, the rollout stops. The time taken
+  by each wave is logged and returned.
+
+  args:
+
+  - hosts: host names, or (name, data) tuples, as for a pyinfra inventory
+  - deploy_func: the deploy to run; `deploy_args` and `deploy_kwargs` are
+    passed to it
+  - canary: number of hosts in the first wave
+  - growth: factor by which each wave is bigger than the last
+  - max_wave_size: maximum number of hosts in a wave
+  - parallelism: maximum number of hosts deployed to at once, within a
+    wave (defaults to the whole wave)
+  - max_failure_fraction: fraction of hosts (so far) allowed to fail before
+    the rollout is aborted; the default, 0, aborts on any failure
+  - health_check: function called with the pyinfra `host` set to each
+    deployed host, which should raise an exception if the host is
+    unhealthy; defaults to `check_dokku_health`. Something like
+    `lambda: check_dokku_configuration(host.name)` can be used for
+    checking dokku installs in more depth. None skips health checks.
+  - config_kwargs: pyinfra config settings, e.g. `{"SUDO": True}`
+  - group_data: data shared by all hosts
+
+  Returns a `RolloutResult`, with a `WaveResult` (hosts, failed hosts and
+  seconds taken) for each wave run.
+  """
+
+  waves = plan_waves(list(hosts), canary=canary, growth=growth, max_wave_size=max_wave_size)
+  specs_by_name: Dict[str, HostSpec] = {_host_name(spec): spec for spec in hosts}
+
+  def _run(names):
+    return run_wave([specs_by_name[name] for name in names],
+                    deploy_func,
+                    deploy_args=deploy_args,
+                    deploy_kwargs=deploy_kwargs,
+                    health_check=health_check,
+                    parallelism=parallelism,
+                    config_kwargs=config_kwargs,
+                    group_data=group_data,
+                   )
+
+  result = run_waves([[_host_name(spec) for spec in wave] for wave in waves], _run,
+                     max_failure_fraction=max_failure_fraction, on_wave=_log_wave)
+
+  if result.aborted:
+    logger.error("rollout aborted after %s of %s wave(s); failed hosts: %s",
+                 len(result.waves), len(waves), result.failed)
+  return result
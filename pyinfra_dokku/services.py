@@ -0,0 +1,104 @@
+"""
+create Dokku datastore services (postgres, redis), tuned to host memory
+"""
+
+import shlex
+
+from typing import Any, Mapping
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.facts.hardware import Memory
+from pyinfra.operations     import server
+
+from .facts                 import DatastoreServices, DatastoreSettings
+from .install               import get_installed_plugins, install_dokku_plugin
+from .util.services         import (SERVICE_PLUGIN_URLS, changed_settings,
+                                    render_settings_commands, resolve_service_specs)
+
+
+def _configure_service(plugin: str, service: str, wanted: Mapping[str, Any],
+                       existing_links):
+  """
+  create `service` if need be, apply any changed settings (restarting the
+  service only if some did change), and link it to apps.
+  """
+
+  quoted = shlex.quote(service)
+  exists = existing_links is not None
+
+  if not exists:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Create {plugin} service {service}",
+                 commands=f"dokku {plugin}:create {quoted}",
+                 _sudo=True,
+                )
+
+  current = host.get_fact(DatastoreSettings, plugin, service) if exists else {}
+  to_change = changed_settings(current, wanted['settings'])
+  if to_change:
+    logger.info("%s: %s service %s: setting %s", host.name, plugin, service, to_change)
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Tune {plugin} service {service}",
+                 commands=(render_settings_commands(plugin, service, to_change)
+                           + [f"dokku {plugin}:restart {quoted}"]),
+                 _sudo=True,
+                )
+  else:
+    host.noop(f"{plugin} service {service} settings unchanged")
+
+  to_link = [app for app in wanted['apps'] if app not in (existing_links or [])]
+  if to_link:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Link {plugin} service {service} to {', '.join(to_link)}",
+                 commands=[f"dokku {plugin}:link {quoted} {shlex.quote(app)}" for app in to_link],
+                 _sudo=True,
+                )
+
+
+@deploy("Configure Dokku datastore services")
+def configure_services(spec: Mapping[str, Mapping[str, Mapping[str, Any]]],
+                       memory_fraction: float = 0.5):
+  """
+  Install datastore service plugins, and create, tune and link services.
+
+  Service settings (postgres `shared_buffers`, `work_mem` etc.; redis
+  `maxmemory`, eviction policy and persistence) are derived from the RAM
+  each service is allotted. Settings are compared with those in each
+  service's config file, and a service is only restarted if a setting
+  changed.
+
+  args:
+
+  - spec: maps plugin names ('postgres' or 'redis') to service names to
+    service options; see `pyinfra_dokku.util.services.resolve_service_specs`.
+    e.g.
+
+    .. code:: python
+
+        {
+          "postgres": {"app-db": {"apps": ["node-js-app"], "max_connections": 50}},
+          "redis": {"app-cache": {"apps": ["node-js-app"], "persistence": "none",
+                                  "memory_mb": 256}},
+        }
+
+  - memory_fraction: fraction of host RAM split between services which
+    don't give an explicit `memory_mb`.
+
+  Prereqs:
+
+  - Dokku must be installed, and the apps must exist.
+  """
+
+  config.SUDO = True
+
+  resolved = resolve_service_specs(spec, host.get_fact(Memory), memory_fraction)
+
+  installed_plugins = get_installed_plugins()
+  for plugin in sorted(resolved):
+    install_dokku_plugin(plugin, SERVICE_PLUGIN_URLS[plugin], installed_plugins)
+
+  for plugin, services in sorted(resolved.items()):
+    existing = host.get_fact(DatastoreServices, plugin)
+    for service, wanted in sorted(services.items()):
+      _configure_service(plugin, service, wanted, existing.get(service))
@@ -0,0 +1,215 @@
+"""
+tune kernel, limits and swap settings on a Dokku host
+"""
+
+from io     import StringIO
+
+from pyinfra                import config, host, logger
+from pyinfra.api            import deploy
+from pyinfra.facts.files    import File
+from pyinfra.facts.hardware import Cpus, Memory
+from pyinfra.facts.server   import Command, LinuxName
+from pyinfra.operations     import files, server, systemd
+
+from .util.tuning           import compute_tuning, parse_thp_mode, render_sysctl_conf
+
+##
+# globals
+
+SYSCTL_DROP_IN_PATH     = '/etc/sysctl.d/60-dokku.conf'
+DOCKER_LIMITS_PATH      = '/etc/systemd/system/docker.service.d/60-dokku-limits.conf'
+DOKKU_LIMITS_PATH       = '/etc/security/limits.d/60-dokku.conf'
+THP_TMPFILES_PATH       = '/etc/tmpfiles.d/60-dokku-thp.conf'
+THP_ENABLED_PATH        = '/sys/kernel/mm/transparent_hugepage/enabled'
+SWAP_FILE_PATH          = '/swapfile'
+
+
+def _tune_sysctl(settings):
+  """
+  write the sysctl drop-in file, and apply (live) any keys whose current value
+  differs from the desired one.
+  """
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name=f"Write sysctl drop-in {SYSCTL_DROP_IN_PATH}",
+            src=StringIO(render_sysctl_conf(settings)),
+            dest=SYSCTL_DROP_IN_PATH,
+            user='root',
+            group='root',
+            mode='644',
+            _sudo=True,
+           )
+
+  # server.sysctl compares against the live value, so unchanged
+  # keys are no-ops.
+  for key, value in sorted(settings.items()):
+    # pylint: disable=unexpected-keyword-arg
+    server.sysctl(name=f"Apply sysctl {key}",
+                  key=key,
+                  value=value,
+                  _sudo=True,
+                 )
+
+
+def _tune_limits(nofile: int, nproc: int, restart_docker: bool):
+  """
+  set open-file and process limits for the docker service (via a systemd
+  drop-in) and for the dokku user (via pam limits, which apply to
+  `git push` sessions and hence to builds).
+  """
+
+  docker_limits = (
+      "# managed by pyinfra-dokku\n"
+      "[Service]\n"
+      f"LimitNOFILE={nofile}\n"
+      "LimitNPROC=infinity\n"
+      "TasksMax=infinity\n"
+  )
+
+  # pylint: disable=unexpected-keyword-arg
+  docker_drop_in = files.put(name="Set docker service limits",
+                             src=StringIO(docker_limits),
+                             dest=DOCKER_LIMITS_PATH,
+                             mode='644',
+                             _sudo=True,
+                            )
+
+  dokku_limits = (
+      "# managed by pyinfra-dokku\n"
+      f"dokku soft nofile {nofile}\n"
+      f"dokku hard nofile {nofile}\n"
+      f"dokku soft nproc {nproc}\n"
+      f"dokku hard nproc {nproc}\n"
+  )
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name="Set dokku user limits",
+            src=StringIO(dokku_limits),
+            dest=DOKKU_LIMITS_PATH,
+            mode='644',
+            _sudo=True,
+           )
+
+  # pylint: disable=no-member
+  if docker_drop_in.changed:
+    # pylint: disable=unexpected-keyword-arg
+    systemd.daemon_reload(name="Reload systemd units", _sudo=True)
+
+    if restart_docker:
+      # pylint: disable=unexpected-keyword-arg
+      systemd.service(name="Restart docker to apply new limits",
+                      service="docker",
+                      restarted=True,
+                      _sudo=True,
+                     )
+    else:
+      logger.warning("docker limits changed; they take effect when docker is next restarted")
+
+
+def _tune_swap(swap_mb: int):
+  """
+  make sure a swap file of `swap_mb` MB exists and is enabled.
+  A `swap_mb` of 0 leaves any existing swap alone.
+  """
+
+  if not swap_mb:
+    return
+
+  swap_file = host.get_fact(File, SWAP_FILE_PATH, sudo=True)
+  wanted_bytes = swap_mb * 1024 * 1024
+
+  if not swap_file or swap_file.get("size") != wanted_bytes:
+    make_swap_script = f"""
+    set -euo pipefail;
+
+    if swapon --show=NAME --noheadings | grep -qx {SWAP_FILE_PATH}; then
+      swapoff {SWAP_FILE_PATH};
+    fi
+    rm -f {SWAP_FILE_PATH};
+    fallocate -l {swap_mb}M {SWAP_FILE_PATH} ||
+      dd if=/dev/zero of={SWAP_FILE_PATH} bs=1M count={swap_mb};
+    chmod 600 {SWAP_FILE_PATH};
+    mkswap {SWAP_FILE_PATH};
+    swapon {SWAP_FILE_PATH};
+    """
+
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Create {swap_mb}MB swap file",
+                 commands=make_swap_script,
+                 _shell_executable='bash',
+                 _sudo=True,
+                )
+
+  # pylint: disable=unexpected-keyword-arg
+  files.line(name="Enable swap file at boot",
+             path="/etc/fstab",
+             line=f"^{SWAP_FILE_PATH} ",
+             replace=f"{SWAP_FILE_PATH} none swap sw 0 0",
+             _sudo=True,
+            )
+
+
+def _tune_thp(mode: str):
+  """
+  set transparent hugepage mode, both live and (via tmpfiles.d) at boot.
+  """
+
+  # pylint: disable=unexpected-keyword-arg
+  files.put(name="Persist transparent hugepage setting",
+            src=StringIO(
+              "# managed by pyinfra-dokku\n"
+              f"w {THP_ENABLED_PATH} - - - - {mode}\n"
+            ),
+            dest=THP_TMPFILES_PATH,
+            mode='644',
+            _sudo=True,
+           )
+
+  current = parse_thp_mode(host.get_fact(Command, f"cat {THP_ENABLED_PATH} || true") or "")
+  if current != mode:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Set transparent hugepages to {mode}",
+                 commands=f"echo {mode} > {THP_ENABLED_PATH}",
+                 _sudo=True,
+                )
+
+
+@deploy("Tune Dokku host")
+def tune_dokku_host(profile: str = 'default', restart_docker: bool = False):
+  """
+  Tune kernel and limit settings on a Dokku host: sysctl values (listen
+  backlog, ephemeral ports, conntrack table size), open-file and process
+  limits for docker and the dokku user, a swap file sized from RAM,
+  and transparent hugepage mode.
+
+  Values scale with the host's CPU count and memory; see
+  `pyinfra_dokku.util.tuning.compute_tuning` for details.
+
+  args:
+
+  - profile: one of 'default', 'high-connection' (hosts behind
+    load balancers) or 'build' (small, build-heavy hosts).
+  - restart_docker: whether to restart docker if its limits changed.
+    (Otherwise they take effect on the next restart.)
+
+  prerequisites:
+
+  Needs to be an Ubuntu host; intended to be run after
+  `install_dokku_prerequisites()` or `install_dokku()`.
+  """
+
+  config.SUDO = True
+
+  assert host.get_fact(LinuxName) == 'Ubuntu'
+
+  cpus      = host.get_fact(Cpus)
+  memory_mb = host.get_fact(Memory)
+  tuning    = compute_tuning(profile, cpus, memory_mb)
+
+  logger.info("Tuning host with %s CPUs and %sMB RAM using profile '%s': %s",
+              cpus, memory_mb, profile, tuning)
+
+  _tune_sysctl(tuning['sysctl'])
+  _tune_limits(tuning['nofile'], tuning['nproc'], restart_docker)
+  _tune_swap(tuning['swap_mb'])
+  _tune_thp(tuning['thp'])
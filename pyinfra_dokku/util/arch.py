@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""
+CPU architectures (as named by dpkg) Dokku hosts can run on, and the
+repositories which differ between them
+"""
+
+SUPPORTED_ARCHITECTURES = ('amd64', 'arm64')
+
+UBUNTU_ARCHIVE_URL = 'http://archive.ubuntu.com/ubuntu'
+UBUNTU_PORTS_URL   = 'http://ports.ubuntu.com/ubuntu-ports'
+
+
+def check_architecture(arch: str):
+  """
+  raise a ValueError if `arch` (e.g. from `dpkg --print-architecture`)
+  isn't one of SUPPORTED_ARCHITECTURES.
+  """
+
+  if arch not in SUPPORTED_ARCHITECTURES:
+    raise ValueError(f"unsupported architecture '{arch}', expected one of "
+                     f"{SUPPORTED_ARCHITECTURES}")
+
+
+def ubuntu_archive_url(arch: str) -> str:
+  """
+  return the official Ubuntu repository for `arch`: the main archive only
+  carries amd64 (and i386) packages; other architectures use the ports
+  archive.
+  """
+
+  return UBUNTU_ARCHIVE_URL if arch in ('amd64', 'i386') else UBUNTU_PORTS_URL
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+"""
+render the streaming backup script installed by
+`pyinfra_dokku.backup.backup_dokku`
+"""
+
+import re
+import shlex
+
+from typing import Any, List, Mapping, Optional, Sequence
+
+DOCKER_VOLUMES_DIR  = '/var/lib/docker/volumes'
+
+# dokku app and config data that's backed up as files. Service data
+# directories aren't included: services are backed up via their plugin's
+# `:export` command, which gives a consistent dump.
+DOKKU_DATA_PATHS    = ('/home/dokku', '/var/lib/dokku/config', '/var/lib/dokku/data')
+
+# regenerable data, excluded from file backups
+DEFAULT_EXCLUDES    = ('home/dokku/*/cache',)
+
+SSH_TARGET_REGEX    = re.compile(r'^(?P<userhost>[^/:]+):(?P<path>/.*)$')
+
+BANDWIDTH_REGEX     = re.compile(r'^[0-9]+[kKmMgG]?$')
+
+
+def parse_storage_mounts(storage_reports: Mapping[str, Mapping[str, Any]]) -> List[str]:
+  """
+  given parsed `dokku storage:report` output (app names mapped to report
+  keys, as from the `DokkuReports` fact), return a sorted list of host paths
+  mounted into apps' containers. Named docker volumes are mapped to their
+  data directory.
+  """
+
+  paths = set()
+  for report in storage_reports.values():
+    args = shlex.split(report.get('storage deploy mounts') or '')
+    for flag, value in zip(args, args[1:]):
+      if flag != '-v':
+        continue
+      source = value.split(':', 1)[0]
+      if source.startswith('/'):
+        paths.add(source.rstrip('/') or '/')
+      elif source:
+        paths.add(f"{DOCKER_VOLUMES_DIR}/{source}/_data")
+  return sorted(paths)
+
+
+def render_sink_function(target: str) -> str:
+  """
+  return a bash function `sink FILENAME`, which writes its standard input to
+  FILENAME at `target`: either a directory on the host being backed up,
+  or `USER@HOST:/DIR` (written via ssh). Files are written under a
+  `.partial` name and renamed once complete.
+  """
+
+  ssh_match = SSH_TARGET_REGEX.match(target)
+  if ssh_match:
+    userhost = shlex.quote(ssh_match.group('userhost'))
+    path = shlex.quote(ssh_match.group('path'))
+    return (
+        "sink() {\n"
+        f"  ssh -o BatchMode=yes {userhost} "
+        f"\"mkdir -p {path} && cat > {path}/$1.partial && mv {path}/$1.partial {path}/$1\"\n"
+        "}\n"
+    )
+
+  if not target.startswith('/'):
+    raise ValueError("backup target should be an absolute path or USER@HOST:/PATH, "
+                     f"got '{target}'")
+
+  path = shlex.quote(target)
+  return (
+      "sink() {\n"
+      f"  mkdir -p {path} &&\n"
+      f"    cat > {path}/\"$1.partial\" && mv {path}/\"$1.partial\" {path}/\"$1\"\n"
+      "}\n"
+  )
+
+
+# pylint: disable=too-many-arguments
+def render_backup_script(target: str,
+                         paths: Sequence[str],
+                         services: Sequence[str] = ('postgres',),
+                         full_every: int = 7,
+                         bandwidth_limit: Optional[str] = None,
+                         compression_level: int = 3,
+                         excludes: Sequence[str] = DEFAULT_EXCLUDES,
+                         state_dir: str = '/var/lib/dokku-backup',
+                        ) -> str:
+  """
+  return a bash script which streams a backup of a dokku host to `target`
+  (see `render_sink_function`), without writing temporary files on the host:
+
+  - `paths` are archived with GNU tar, as a full backup every
+    `full_every` runs and otherwise incrementally (only files changed since
+    the previous run, per tar's `--listed-incremental` snapshot kept in
+    `state_dir`). Restore a full backup followed by each later incremental
+    one, in order.
+  - each service of each datastore plugin in `services` is dumped with
+    `dokku PLUGIN:export`.
+
+  Everything is compressed with zstd, and run with idle I/O and CPU
+  priority; `bandwidth_limit` (e.g. "10M", bytes per second) caps the
+  rate at which data is sent, using pv.
+
+  Files are named `HOST-TIMESTAMP-files-{full,incremental}.tar.zst` and
+  `HOST-TIMESTAMP-PLUGIN-SERVICE.dump.zst`.
+  """
+
+  if full_every < 1:
+    raise ValueError("full_every should be at least 1")
+  if bandwidth_limit is not None and not BANDWIDTH_REGEX.match(str(bandwidth_limit)):
+    raise ValueError("bandwidth_limit should be a number of bytes/sec, like '10M', "
+                     f"got '{bandwidth_limit}'")
+
+  throttle = f"pv --quiet --rate-limit {bandwidth_limit}" if bandwidth_limit else "cat"
+  quoted_paths = " ".join(shlex.quote(path) for path in paths)
+  exclude_args = " ".join(f"--exclude={shlex.quote(pattern)}" for pattern in excludes)
+  plugins = " ".join(shlex.quote(plugin) for plugin in services)
+  state = shlex.quote(state_dir)
+
+  return f"""#!/usr/bin/env bash
+# managed by pyinfra-dokku
+
+set -euo pipefail
+
+state_dir={state}
+snapshot="$state_dir/files.snar"
+host="$(hostname -f)"
+stamp="$(date -u +%Y%m%dT%H%M%SZ)"
+
+{render_sink_function(target)}
+compress() {{
+  zstd --quiet --stdout -{compression_level}
+}}
+
+throttle() {{
+  {throttle}
+}}
+
+# tar exits with 1 if files changed while being read; that's expected on
+# a live host.
+archive_files() {{
+  ionice -c 3 nice -n 19 tar --create --file=- --listed-incremental="$snapshot.new" \\
+    --ignore-failed-read --warning=no-file-changed {exclude_args} \\
+    {quoted_paths} || [ "$?" -eq 1 ]
+}}
+
+mkdir -p "$state_dir"
+runs="$(cat "$state_dir/runs" 2>/dev/null || echo 0)"
+if [ ! -e "$snapshot" ] || [ "$runs" -ge {full_every} ]; then
+  level=full
+  runs=0
+  rm -f "$snapshot.new"
+else
+  level=incremental
+  cp "$snapshot" "$snapshot.new"
+fi
+
+archive_files | compress | throttle | sink "$host-$stamp-files-$level.tar.zst"
+mv "$snapshot.new" "$snapshot"
+echo "$((runs + 1))" > "$state_dir/runs"
+echo "BACKED UP files ($level)"
+
+for plugin in {plugins}; do
+  for service in $(dokku --quiet "$plugin:list" 2>/dev/null || true); do
+    ionice -c 3 nice -n 19 dokku "$plugin:export" "$service" |
+      compress | throttle | sink "$host-$stamp-$plugin-$service.dump.zst"
+    echo "BACKED UP $plugin $service"
+  done
+done
+"""
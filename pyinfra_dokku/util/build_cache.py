@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+parse build cache statistics gathered from a dokku host
+"""
+
+import json
+
+from typing import Any, Dict, List, Sequence, Union, cast
+
+from .docker_config import parse_size
+
+BUILDKIT_SECTION  = '[buildkit]'
+APP_CACHE_SECTION = '[app-caches]'
+
+APP_CACHE_PREFIX  = '/home/dokku/'
+
+
+def parse_build_cache_stats(inp: Union[str, Sequence[str]]) -> Dict[str, Any]:
+  """
+  parse build cache statistics, as output by the `BuildCacheStats` fact:
+  a `[buildkit]` section containing the output of
+  `docker system df -v --format '{{json .BuildCache}}'` (a JSON list of
+  cache records), followed by an `[app-caches]` section containing
+  the output of `du -sb /home/dokku/*/cache`.
+
+  Will take either a string (str) or list of lines.
+
+  Returns a dict like
+
+  .. code:: python
+
+      {
+        "buildkit": {
+          "entries": 12,          # cache records
+          "size_bytes": 1234567,  # total size of records
+          "reused_entries": 5,    # records used more than once
+          "hits": 9,              # uses beyond the first, over all records
+        },
+        "app_caches": {"node-js-app": 45678},   # buildpack cache sizes, in bytes
+      }
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  buildkit_lines: List[str] = []
+  app_cache_lines: List[str] = []
+  current = None
+  for line in lines:
+    line = line.strip()
+    if line == BUILDKIT_SECTION:
+      current = buildkit_lines
+    elif line == APP_CACHE_SECTION:
+      current = app_cache_lines
+    elif line and current is not None:
+      current.append(line)
+
+  records: List[Dict[str, Any]] = []
+  for line in buildkit_lines:
+    try:
+      parsed = json.loads(line)
+    except ValueError:
+      continue
+    if isinstance(parsed, list):
+      records.extend(parsed)
+
+  usage_counts = [int(record.get('UsageCount', 0) or 0) for record in records]
+  buildkit = {
+    'entries': len(records),
+    'size_bytes': sum(parse_size(str(record.get('Size', '0B'))) for record in records),
+    'reused_entries': sum(1 for count in usage_counts if count > 1),
+    'hits': sum(max(0, count - 1) for count in usage_counts),
+  }
+
+  app_caches = {}
+  for line in app_cache_lines:
+    size, path = line.split(maxsplit=1)
+    if path.startswith(APP_CACHE_PREFIX):
+      app = path[len(APP_CACHE_PREFIX):].split('/', 1)[0]
+      app_caches[app] = int(size)
+
+  return {'buildkit': buildkit, 'app_caches': app_caches}
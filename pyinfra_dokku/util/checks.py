@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+"""
+plan Dokku zero-downtime check settings for apps, and calibrate them from
+measured app startup times
+"""
+
+import math
+import shlex
+
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Set, Union, cast
+
+from .cleanup import DOKKU_APP_LABEL
+
+# spec keys set via app config, and the dokku config vars they set
+CHECKS_CONFIG_VARS = {
+  'wait':         'DOKKU_CHECKS_WAIT',
+  'timeout':      'DOKKU_CHECKS_TIMEOUT',
+  'attempts':     'DOKKU_CHECKS_ATTEMPTS',
+  'default_wait': 'DOKKU_DEFAULT_CHECKS_WAIT',
+}
+
+CHECKS_SPEC_KEYS = tuple(CHECKS_CONFIG_VARS) + ('wait_to_retire', 'disabled', 'skipped')
+
+DOKKU_PROCESS_TYPE_LABEL = 'com.dokku.process-type'
+
+# shortest check timeout we'll suggest, in seconds
+MIN_CHECKS_TIMEOUT = 2
+
+# with startup budgets longer than this many seconds, checks are
+# spaced out to keep to about this many attempts
+MAX_SUGGESTED_ATTEMPTS = 10
+
+def validate_checks_spec(spec: Mapping[str, Mapping[str, Any]]):
+  """
+  raise a ValueError if `spec` (mapping app names to dicts of the keys in
+  CHECKS_SPEC_KEYS) has unknown keys or invalid values.
+  """
+
+  for app, app_spec in spec.items():
+    unknown = set(app_spec) - set(CHECKS_SPEC_KEYS)
+    if unknown:
+      raise ValueError(f"unknown keys in checks spec for app '{app}': {sorted(unknown)}")
+    for key in tuple(CHECKS_CONFIG_VARS) + ('wait_to_retire',):
+      value = app_spec.get(key)
+      if value is not None and (not isinstance(value, int) or value < 0):
+        raise ValueError(f"'{key}' in checks spec for app '{app}' should be a "
+                         f"non-negative int, not {value!r}")
+    if app_spec.get('attempts') == 0:
+      raise ValueError(f"'attempts' in checks spec for app '{app}' should be at least 1")
+
+
+def _process_types(listed: str) -> Set[str]:
+  """
+  process types in a `checks:report` list, e.g. "web,worker" (or "none").
+  """
+
+  return {proctype for proctype in listed.split(',') if proctype and proctype != 'none'}
+
+
+def plan_checks_commands(app: str,
+                         desired: Mapping[str, Any],
+                         config: Mapping[str, str],
+                         checks_report: Mapping[str, str],
+                        ) -> List[str]:
+  """
+  return the dokku commands needed to give `app` the `desired` check
+  settings (keys from CHECKS_SPEC_KEYS; missing or None values are left
+  alone), given its current checks config vars (as returned by the
+  `AppConfigVars` fact) and its parsed `checks:report` section. None of
+  the commands restart the app; settings apply from its next deploy.
+
+  Returns an empty list if nothing needs changing.
+  """
+
+  quoted_app = shlex.quote(app)
+  commands = []
+
+  changed = {
+    var: str(desired[key]) for key, var in CHECKS_CONFIG_VARS.items()
+    if desired.get(key) is not None and config.get(var) != str(desired[key])
+  }
+  if changed:
+    assignments = " ".join(f"{var}={shlex.quote(value)}" for var, value in changed.items())
+    commands.append(f"dokku config:set --no-restart {quoted_app} {assignments}")
+
+  wait_to_retire = desired.get('wait_to_retire')
+  if wait_to_retire is not None and \
+      checks_report.get('checks wait to retire', '') != str(wait_to_retire):
+    commands.append(f"dokku checks:set {quoted_app} wait-to-retire {int(wait_to_retire)}")
+
+  if desired.get('disabled') is not None or desired.get('skipped') is not None:
+    current_disabled = _process_types(checks_report.get('checks disabled list', ''))
+    current_skipped  = _process_types(checks_report.get('checks skipped list', ''))
+    disabled = set(desired['disabled']) if desired.get('disabled') is not None \
+                                        else current_disabled
+    skipped = set(desired['skipped']) if desired.get('skipped') is not None \
+                                      else current_skipped
+
+    to_enable = (current_disabled - disabled) | (current_skipped - skipped)
+    if to_enable:
+      commands.append(f"dokku checks:enable {quoted_app} {','.join(sorted(to_enable))}")
+    if disabled and disabled != current_disabled:
+      commands.append(f"dokku checks:disable {quoted_app} {','.join(sorted(disabled))}")
+    if skipped and skipped != current_skipped:
+      commands.append(f"dokku checks:skip {quoted_app} {','.join(sorted(skipped))}")
+
+  return commands
+
+
+class CalibrationTrial(NamedTuple):
+  """
+  one measurement of an app's startup: whether it became ready, how long
+  that took from starting its container, and how long the first successful
+  request took (in seconds); or why it failed.
+  """
+  app: str
+  ok: bool
+  startup: float
+  response: float
+  reason: str = ''
+
+
+def render_calibration_script(apps: Sequence[str], trials: int, check_path: str = '/',
+                              timeout: int = 120) -> str:
+  """
+  return a bash script which measures how long each of `apps` takes to
+  become ready, `trials` times each. For each trial, a copy of the app's
+  running web container (same image, command, environment, network and
+  links, but no published ports) is started, and `check_path` requested
+  from it until it responds without a server error, for up to `timeout`
+  seconds; the copy is then removed. The app itself isn't touched.
+
+  Each trial prints a line `CALIBRATE APP ok STARTUP_MS RESPONSE_SECONDS`
+  or `CALIBRATE APP failed REASON`; see `parse_calibration_output`.
+  """
+
+  quoted_apps = " ".join(shlex.quote(app) for app in apps)
+  return f"""set -uo pipefail
+
+calibrate() {{
+  local app="$1" ctr image net port env_file link src start clone ip out code
+  local -a cmd links
+  ctr=$(docker ps -q --filter "label={DOKKU_APP_LABEL}=$app" \\
+          --filter "label={DOKKU_PROCESS_TYPE_LABEL}=web" | head -n 1)
+  if [ -z "$ctr" ]; then
+    echo "CALIBRATE $app failed no-web-container"; return
+  fi
+  image=$(docker inspect --format '{{{{.Config.Image}}}}' "$ctr")
+  net=$(docker inspect --format '{{{{.HostConfig.NetworkMode}}}}' "$ctr")
+  env_file=$(mktemp)
+  docker inspect --format '{{{{range .Config.Env}}}}{{{{println .}}}}{{{{end}}}}' "$ctr" \\
+    | grep -v '^$' > "$env_file"
+  port=$(sed -n 's/^PORT=//p' "$env_file" | head -n 1)
+  if [ -z "$port" ]; then
+    port=$(docker inspect --format \\
+             '{{{{range $p, $_ := .Config.ExposedPorts}}}}{{{{println $p}}}}{{{{end}}}}' "$ctr" \\
+           | head -n 1 | cut -d/ -f1)
+  fi
+  port=${{port:-5000}}
+  mapfile -t cmd < <(docker inspect --format '{{{{range .Config.Cmd}}}}{{{{println .}}}}{{{{end}}}}' "$ctr" \\
+                     | grep -v '^$')
+  links=()
+  while read -r link; do
+    src=${{link%%:*}}
+    if [ -n "$link" ]; then links+=(--link "${{src#/}}:${{link##*/}}"); fi
+  done < <(docker inspect --format '{{{{range .HostConfig.Links}}}}{{{{println .}}}}{{{{end}}}}' "$ctr")
+
+  start=$(date +%s%N)
+  if ! clone=$(docker run -d --rm --env-file "$env_file" --network "$net" "${{links[@]}}" \\
+                 "$image" "${{cmd[@]}}" 2>/dev/null); then
+    rm -f "$env_file"
+    echo "CALIBRATE $app failed run-error"; return
+  fi
+  rm -f "$env_file"
+
+  ip=""
+  while (( ($(date +%s%N) - start) / 1000000000 < {int(timeout)} )); do
+    if [ "$(docker inspect --format '{{{{.State.Running}}}}' "$clone" 2>/dev/null)" != true ]; then
+      echo "CALIBRATE $app failed exited"; return
+    fi
+    if [ -z "$ip" ]; then
+      ip=$(docker inspect --format \\
+             '{{{{range .NetworkSettings.Networks}}}}{{{{.IPAddress}}}}{{{{end}}}}' "$clone")
+    fi
+    out=$(curl --silent --output /dev/null --max-time 5 \\
+            --write-out '%{{http_code}} %{{time_total}}' "http://$ip:$port"{shlex.quote(check_path)})
+    code=${{out%% *}}
+    if [ "$code" != 000 ] && [ "$code" -lt 500 ]; then
+      echo "CALIBRATE $app ok $(( ($(date +%s%N) - start) / 1000000 )) ${{out##* }}"
+      docker stop -t 0 "$clone" > /dev/null 2>&1
+      return
+    fi
+    sleep 0.2
+  done
+  docker stop -t 0 "$clone" > /dev/null 2>&1
+  echo "CALIBRATE $app failed timeout"
+}}
+
+for app in {quoted_apps}; do
+  for (( trial = 1; trial <= {int(trials)}; trial++ )); do
+    calibrate "$app"
+  done
+done
+"""
+
+
+def parse_calibration_output(inp: Union[str, Sequence[str]]) -> List[CalibrationTrial]:
+  """
+  parse the `CALIBRATE` lines output by a calibration script (see
+  `render_calibration_script`) into `CalibrationTrial`s, ignoring other
+  lines.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  trials = []
+  for line in lines:
+    fields = line.split()
+    if len(fields) < 3 or fields[0] != 'CALIBRATE':
+      continue
+    app, outcome = fields[1], fields[2]
+    if outcome == 'ok' and len(fields) == 5:
+      try:
+        trials.append(CalibrationTrial(app, True, int(fields[3]) / 1000, float(fields[4])))
+      except ValueError:
+        continue
+    elif outcome == 'failed':
+      reason = fields[3] if len(fields) > 3 else 'unknown'
+      trials.append(CalibrationTrial(app, False, 0.0, 0.0, reason))
+  return trials
+
+
+def suggest_checks(trials: Sequence[CalibrationTrial],
+                   safety_factor: float = 1.5) -> Optional[Dict[str, int]]:
+  """
+  suggest the tightest check settings (keys as for `plan_checks_commands`)
+  that would still pass for an app, given `trials` of its startup, or None
+  if no trial succeeded.
+
+  Dokku sleeps for `wait` seconds before each of up to `attempts` checks,
+  so checks are spaced 1 second apart (more, for slow starters), with
+  enough attempts to cover the slowest startup seen times `safety_factor`.
+  Apps without their own checks are only given `default_wait` seconds to
+  crash, which is set to the same budget.
+  """
+
+  ok = [trial for trial in trials if trial.ok]
+  if not ok:
+    return None
+
+  budget = max(trial.startup for trial in ok) * safety_factor
+  wait = max(1, math.ceil(budget / MAX_SUGGESTED_ATTEMPTS))
+  return {
+    'wait': wait,
+    'attempts': max(1, math.ceil(budget / wait)),
+    'timeout': max(MIN_CHECKS_TIMEOUT,
+                   math.ceil(max(trial.response for trial in ok) * safety_factor)),
+    'default_wait': max(1, math.ceil(budget)),
+  }
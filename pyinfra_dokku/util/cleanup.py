@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+render the disk cleanup script and systemd units installed by
+`pyinfra_dokku.cleanup.install_disk_cleanup`, and parse its run log
+"""
+
+import json
+
+from typing import Any, Dict, List, Sequence, Union, cast
+
+DOKKU_APP_LABEL = 'com.dokku.app-name'
+
+
+def render_cleanup_script(keep_releases: int, build_cache_max_gb: int,
+                          stopped_container_hours: int, log_path: str) -> str:
+  """
+  return a bash script which reclaims docker disk space on a dokku host:
+
+  - removes containers that have been stopped for more than
+    `stopped_container_hours` hours
+  - for each app, removes images beyond the `keep_releases` most recent
+    ones (by creation time), skipping images used by any container
+  - removes dangling images not belonging to any dokku app
+  - prunes build cache down to `build_cache_max_gb` GB
+
+  Each run appends a line of JSON to `log_path`, recording the time,
+  the number of images removed, and the bytes reclaimed (the drop in
+  space used on the filesystem holding docker's data).
+  """
+
+  if keep_releases < 1:
+    raise ValueError("keep_releases should be at least 1, so running releases are kept")
+
+  return f"""#!/usr/bin/env bash
+# managed by pyinfra-dokku
+
+set -uo pipefail
+
+log_path={log_path}
+
+docker_root="$(docker info --format '{{{{.DockerRootDir}}}}')"
+used_bytes() {{
+  df --output=used -B1 "$docker_root" | tail -n 1 | tr -d ' '
+}}
+
+start="$(date +%s)"
+before="$(used_bytes)"
+
+docker container prune --force --filter "until={stopped_container_hours}h" >/dev/null
+
+in_use="$(docker ps --all --quiet | xargs --no-run-if-empty docker inspect --format '{{{{.Image}}}}' | sort -u)"
+
+old_releases="$(
+  docker image ls --quiet --no-trunc --filter "label={DOKKU_APP_LABEL}" | sort -u |
+  xargs --no-run-if-empty docker image inspect \\
+      --format '{{{{index .Config.Labels "{DOKKU_APP_LABEL}"}}}} {{{{.Created}}}} {{{{.Id}}}}' |
+  sort -k1,1 -k2,2r |
+  awk -v keep={keep_releases} '$1 != app {{ app = $1; n = 0 }} {{ n++; if (n > keep) print $3 }}' |
+  grep -vxF -f <(printf '%s\\n' "$in_use") || true
+)"
+
+images_removed=0
+for image in $old_releases; do
+  if docker image rm "$image" >/dev/null 2>&1; then
+    images_removed=$((images_removed + 1))
+  fi
+done
+
+docker image prune --force --filter "label!={DOKKU_APP_LABEL}" >/dev/null
+docker builder prune --force --keep-storage "{build_cache_max_gb}GB" >/dev/null
+
+after="$(used_bytes)"
+reclaimed=$((before - after))
+if [ "$reclaimed" -lt 0 ]; then
+  reclaimed=0
+fi
+
+record="$(printf '{{"time": %s, "duration_secs": %s, "images_removed": %s, "reclaimed_bytes": %s}}' \\
+  "$start" "$(( $(date +%s) - start ))" "$images_removed" "$reclaimed")"
+echo "$record" >> "$log_path"
+echo "dokku disk cleanup: $record"
+"""
+
+
+def render_cleanup_service(script_path: str) -> str:
+  """
+  return a systemd service unit running the cleanup script at `script_path`
+  with idle CPU and I/O priority.
+  """
+
+  return (
+      "# managed by pyinfra-dokku\n"
+      "[Unit]\n"
+      "Description=Reclaim docker disk space on a dokku host\n"
+      "After=docker.service\n"
+      "Requires=docker.service\n"
+      "\n"
+      "[Service]\n"
+      "Type=oneshot\n"
+      f"ExecStart={script_path}\n"
+      "Nice=19\n"
+      "CPUSchedulingPolicy=idle\n"
+      "IOSchedulingClass=idle\n"
+  )
+
+
+def render_cleanup_timer(on_calendar: str) -> str:
+  """
+  return a systemd timer unit triggering the cleanup service at
+  `on_calendar` (a systemd calendar expression). Missed runs aren't
+  caught up on at boot, since that might be a busy time.
+  """
+
+  return (
+      "# managed by pyinfra-dokku\n"
+      "[Unit]\n"
+      "Description=Scheduled dokku disk cleanup\n"
+      "\n"
+      "[Timer]\n"
+      f"OnCalendar={on_calendar}\n"
+      "Persistent=false\n"
+      "\n"
+      "[Install]\n"
+      "WantedBy=timers.target\n"
+  )
+
+
+def parse_cleanup_log(inp: Union[str, Sequence[str]]) -> List[Dict[str, Any]]:
+  """
+  parse the cleanup script's run log: one JSON object per line.
+  Unparseable lines are skipped.
+
+  Will take either a string (str) or list of lines.
+
+  Returns a list of dicts like
+
+  .. code:: python
+
+      {"time": 1700000000, "duration_secs": 42, "images_removed": 3, "reclaimed_bytes": 123456}
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  runs = []
+  for line in lines:
+    try:
+      record = json.loads(line)
+    except ValueError:
+      continue
+    if isinstance(record, dict):
+      runs.append(record)
+  return runs
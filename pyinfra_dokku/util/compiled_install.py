@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+compile the Dokku install plan into a single idempotent, checkpointed
+shell script (run in one session, rather than as many pyinfra operations),
+and parse the per-step results it outputs
+"""
+
+import hashlib
+import shlex
+
+from typing import List, Mapping, NamedTuple, Sequence, Tuple, Union, cast
+
+INSTALL_STATE_DIR = '/var/lib/pyinfra-dokku/install'
+INSTALL_LOG_PATH  = '/var/log/pyinfra-dokku-install.log'
+
+STEP_STATUSES = ('ok', 'done', 'changed', 'failed')
+
+
+class Step(NamedTuple):
+  """
+  one step of a compiled install. `check` is a shell command which
+  succeeds if the step is already in effect; otherwise `run` is run.
+  """
+  name: str
+  description: str
+  check: str
+  run: str
+
+  def digest(self) -> str:
+    """
+    short hash of the step's commands, recorded in its checkpoint.
+    """
+    return hashlib.sha256(f"{self.check}\n{self.run}".encode('utf8')).hexdigest()[:16]
+
+
+class StepResult(NamedTuple):
+  """
+  outcome of a step: status is 'done' (in effect, and a checkpoint shows
+  it was completed with the same commands), 'ok' (already in effect),
+  'changed' or 'failed'.
+  """
+  name: str
+  status: str
+  seconds: float
+
+
+def _write_file_step(name: str, description: str, path: str, contents: str) -> Step:
+  quoted_path = shlex.quote(path)
+  quoted_contents = shlex.quote(contents)
+  return Step(name, description,
+              check=f"[ \"$(cat {quoted_path} 2>/dev/null)\" = {quoted_contents} ]",
+              run=f"printf '%s\\n' {quoted_contents} > {quoted_path}")
+
+
+def _apt_key_step(name: str, description: str, url: str, key_path: str) -> Step:
+  quoted_path = shlex.quote(key_path)
+  return Step(name, description,
+              check=f"[ -s {quoted_path} ]",
+              run=f"curl --fail --silent --show-error --location {shlex.quote(url)} "
+                  f"--output {quoted_path}.tmp && mv {quoted_path}.tmp {quoted_path}")
+
+
+# pylint: disable=too-many-arguments
+def install_steps(packages: Sequence[str],
+                  apt_keys: Sequence[Tuple[str, str]],
+                  apt_repos: Mapping[str, str],
+                  root_id_path: str,
+                  debconf_values: Mapping[Tuple[str, str], str],
+                 ) -> List[Step]:
+  """
+  return the steps of a Dokku install:
+
+  - packages: prerequisite packages to install
+  - apt_keys: (name, url) pairs of apt signing keys, stored in
+    /etc/apt/trusted.gpg.d/NAME.asc
+  - apt_repos: maps names to apt source lines, written to
+    /etc/apt/sources.list.d/NAME.list
+  - root_id_path: root's ssh key, generated if missing
+  - debconf_values: dokku's expected debconf settings (see
+    `pyinfra_dokku.install.get_expected_debconf_values`); if dokku isn't
+    installed or `debconf-show dokku` differs, they're set and dokku is
+    (re)installed.
+  """
+
+  quoted_packages = " ".join(shlex.quote(package) for package in packages)
+  steps = [
+    Step('packages', 'Install required packages',
+         check=f"dpkg-query --show --showformat='${{Status}}\\n' {quoted_packages} 2>/dev/null "
+               "| grep --invert-match --quiet --fixed-strings 'install ok installed'; "
+               "[ \"${PIPESTATUS[0]}${PIPESTATUS[1]}\" = 01 ]",
+         run=f"apt-get update && apt-get install --yes {quoted_packages}"),
+  ]
+
+  for name, url in apt_keys:
+    steps.append(_apt_key_step(f"{name}_key", f"Install {name} apt key", url,
+                               f"/etc/apt/trusted.gpg.d/{name}.asc"))
+
+  for name, line in apt_repos.items():
+    steps.append(_write_file_step(f"{name}_repo", f"Add the {name} apt repo",
+                                  f"/etc/apt/sources.list.d/{name}.list", line))
+
+  quoted_id_path = shlex.quote(root_id_path)
+  steps.append(Step('root_ssh_key', 'create root .ssh key if not exist',
+                    check=f"[ -f {quoted_id_path} ]",
+                    run=f"ssh-keygen -t rsa -C root@localhost -q -f {quoted_id_path} -N ''"))
+
+  selections = "\n".join(
+    f"{owner} {owner}/{key} {'boolean' if value in ('true', 'false') else 'string'} {value}"
+    for (owner, key), value in sorted(debconf_values.items())
+  )
+  expected = "\n".join(sorted(f"{owner}/{key}={value}"
+                              for (owner, key), value in debconf_values.items()))
+  steps.append(Step('dokku', 'configure and (re)install dokku',
+                    check=(
+                      "dpkg-query --show --showformat='${Status}' dokku 2>/dev/null "
+                      "| grep --quiet 'install ok installed' && "
+                      "[ \"$(debconf-show dokku | sed -E 's/^[* ] +//; s/: /=/' "
+                      "| LC_ALL=C sort)\" = "
+                      f"{shlex.quote(expected)} ]"
+                    ),
+                    run=(
+                      f"printf '%s\\n' {shlex.quote(selections)} | debconf-set-selections && "
+                      "apt-get update && apt-get install --yes --reinstall dokku"
+                    )))
+  return steps
+
+
+def render_install_script(steps: Sequence[Step],
+                          state_dir: str = INSTALL_STATE_DIR,
+                          log_path: str = INSTALL_LOG_PATH) -> str:
+  """
+  render a bash script which runs `steps` in order, stopping at the first
+  failure. Each step is always checked, and run if need be, so a host
+  that has drifted since an earlier run is repaired; its checkpoint (in
+  `state_dir`) only tells a step completed before with the same commands
+  ('done') from one that was already in effect ('ok'). Step output goes to
+  `log_path`; only a line `STEP NAME STATUS MILLISECONDS` per step goes to
+  stdout (see `parse_step_results`).
+  """
+
+  functions = "".join(
+    f"check_{step.name}() {{\n  {step.check}\n}}\n"
+    f"run_{step.name}() {{\n  {step.run}\n}}\n"
+    for step in steps
+  )
+  calls = "\n".join(f"run_step {step.name} {step.digest()} || exit 1" for step in steps)
+
+  return f"""#!/usr/bin/env bash
+# generated by pyinfra_dokku; steps print STEP NAME STATUS MILLISECONDS
+
+set -uo pipefail
+export DEBIAN_FRONTEND=noninteractive
+
+state_dir={shlex.quote(state_dir)}
+log={shlex.quote(log_path)}
+mkdir -p "$state_dir"
+
+{functions}
+run_step() {{
+  local name="$1" digest="$2" start status
+  start=$(date +%s%N)
+  echo "=== $(date --iso-8601=seconds) $name" >> "$log"
+  if "check_$name" >> "$log" 2>&1; then
+    if [ "$(cat "$state_dir/$name" 2>/dev/null)" = "$digest" ]; then
+      status=done
+    else
+      status=ok
+    fi
+  elif "run_$name" >> "$log" 2>&1; then
+    status=changed
+  else
+    status=failed
+  fi
+  if [ "$status" != failed ]; then
+    echo "$digest" > "$state_dir/$name"
+  fi
+  echo "STEP $name $status $(( ($(date +%s%N) - start) / 1000000 ))"
+  [ "$status" != failed ]
+}}
+
+{calls}
+"""
+
+
+def parse_step_results(inp: Union[str, Sequence[str]]) -> List[StepResult]:
+  """
+  parse the `STEP` lines output by a compiled install script into
+  `StepResult`s, ignoring other lines.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  results = []
+  for line in lines:
+    fields = line.split()
+    if len(fields) == 4 and fields[0] == 'STEP' and fields[2] in STEP_STATUSES \
+        and fields[3].isdigit():
+      results.append(StepResult(fields[1], fields[2], int(fields[3]) / 1000))
+  return results
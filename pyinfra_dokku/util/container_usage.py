@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""
+sample the CPU, memory, network and block I/O usage of every Dokku app
+container on a host in one pass over their cgroups, for the
+`AppResourceUsage` fact
+"""
+
+import shlex
+
+from typing import Any, Dict, List, Optional, Sequence, Union, cast
+
+from .checks  import DOKKU_PROCESS_TYPE_LABEL
+from .cleanup import DOKKU_APP_LABEL
+
+# cgroup v1 reports "no limit" as a huge page-aligned number
+UNLIMITED_MEMORY_THRESHOLD = 2 ** 62
+
+USAGE_COUNTERS = ('cpu_seconds', 'memory_bytes', 'net_rx_bytes', 'net_tx_bytes',
+                  'block_read_bytes', 'block_write_bytes')
+
+
+def render_usage_command(proc_root: str = '/proc', cgroup_root: str = '/sys/fs/cgroup') -> str:
+  """
+  return a shell command which prints a line per running app container:
+
+      USAGE APP PROCTYPE UPTIME_S CPU_USEC MEM_BYTES MEM_LIMIT RX TX READ WRITE
+
+  read straight from the container's cgroup (v2, or v1's cpuacct, memory
+  and blkio controllers) and network namespace, rather than with
+  `docker stats`, which samples each container for a second or more.
+  Values that can't be read are printed as `-`; MEM_LIMIT is `max` when
+  there's no limit.
+  """
+
+  proc = shlex.quote(proc_root)
+  cgroup = shlex.quote(cgroup_root)
+  return f"""now=$(date +%s)
+ids=$(docker ps -q --no-trunc --filter label={DOKKU_APP_LABEL} \\
+        --filter label={DOKKU_PROCESS_TYPE_LABEL} 2>/dev/null)
+[ -n "$ids" ] || exit 0
+docker inspect --format '{{{{.State.Pid}}}} {{{{.State.StartedAt}}}} {{{{index .Config.Labels "{DOKKU_APP_LABEL}"}}}} {{{{index .Config.Labels "{DOKKU_PROCESS_TYPE_LABEL}"}}}}' \\
+  $ids 2>/dev/null | while read -r pid started app proctype; do
+  [ "$pid" -gt 0 ] 2>/dev/null || continue
+  uptime=$(( now - $(date -d "$started" +%s 2>/dev/null || echo "$now") ))
+  cpu=- mem=- lim=- blk="- -"
+  if [ -f {cgroup}/cgroup.controllers ]; then
+    dir={cgroup}$(sed -n 's/^0:://p' {proc}/"$pid"/cgroup)
+    cpu=$(awk '$1 == "usage_usec" {{ print $2 }}' "$dir/cpu.stat" 2>/dev/null)
+    mem=$(cat "$dir/memory.current" 2>/dev/null)
+    lim=$(cat "$dir/memory.max" 2>/dev/null)
+    blk=$(awk '{{ for (i = 2; i <= NF; i++) {{ split($i, kv, "=");
+                   if (kv[1] == "rbytes") r += kv[2]; if (kv[1] == "wbytes") w += kv[2] }} }}
+               END {{ printf "%.0f %.0f", r, w }}' "$dir/io.stat" 2>/dev/null)
+  else
+    v1() {{ awk -F: -v c="$1" '{{ n = split($2, cs, ","); for (i = 1; i <= n; i++) if (cs[i] == c) print $3 }}' \\
+             {proc}/"$pid"/cgroup; }}
+    ns=$(cat {cgroup}/cpuacct"$(v1 cpuacct)"/cpuacct.usage 2>/dev/null) && cpu=$(( ns / 1000 ))
+    mem=$(cat {cgroup}/memory"$(v1 memory)"/memory.usage_in_bytes 2>/dev/null)
+    lim=$(cat {cgroup}/memory"$(v1 memory)"/memory.limit_in_bytes 2>/dev/null)
+    blk=$(awk '$2 == "Read" {{ r += $3 }} $2 == "Write" {{ w += $3 }}
+               END {{ printf "%.0f %.0f", r, w }}' \\
+            {cgroup}/blkio"$(v1 blkio)"/blkio.throttle.io_service_bytes 2>/dev/null)
+  fi
+  net=$(awk 'NR > 2 {{ split($0, parts, ":"); gsub(/ /, "", parts[1]);
+                      if (parts[1] != "lo") {{ split(parts[2], f, " "); rx += f[1]; tx += f[9] }} }}
+             END {{ printf "%.0f %.0f", rx, tx }}' {proc}/"$pid"/net/dev 2>/dev/null)
+  echo "USAGE $app $proctype $uptime ${{cpu:--}} ${{mem:--}} ${{lim:--}} ${{net:-- -}} ${{blk:-- -}}"
+done"""
+
+
+def _number(field: str) -> Optional[int]:
+  return int(field) if field.isdigit() else None
+
+
+def parse_usage_output(inp: Union[str, Sequence[str]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+  """
+  parse the output of `render_usage_command` into a dict mapping app names
+  to dicts mapping process types to their containers' combined usage:
+
+  - 'containers': number of running containers
+  - 'cpu_seconds': CPU time used since the containers started
+  - 'cpu_cores': average CPU cores used since the containers started
+  - 'memory_bytes': memory in use (including page cache)
+  - 'memory_limit_bytes': combined memory limit, or None if any container
+    has none
+  - 'net_rx_bytes', 'net_tx_bytes': network traffic received and sent
+  - 'block_read_bytes', 'block_write_bytes': block device I/O
+
+  Counters (all but 'memory_bytes' and 'memory_limit_bytes') are totals
+  since each container started; compare two samples for rates. Counters a
+  container's values couldn't be read for are left out of the totals.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+  for line in lines:
+    fields = line.split()
+    if len(fields) != 11 or fields[0] != 'USAGE':
+      continue
+    uptime = _number(fields[3])
+    cpu_usec, memory, limit, *io_counters = (_number(field) for field in fields[4:])
+
+    usage = result.setdefault(fields[1], {}).setdefault(fields[2], {
+      'containers': 0, 'cpu_cores': 0.0, 'memory_limit_bytes': 0,
+      **{counter: 0 for counter in USAGE_COUNTERS},
+    })
+    usage['containers'] += 1
+
+    if cpu_usec is not None:
+      usage['cpu_seconds'] = round(usage['cpu_seconds'] + cpu_usec / 1e6, 3)
+      if uptime:
+        usage['cpu_cores'] = round(usage['cpu_cores'] + cpu_usec / 1e6 / uptime, 3)
+    for counter, value in zip(USAGE_COUNTERS[1:], [memory, *io_counters]):
+      if value is not None:
+        usage[counter] += value
+
+    if usage['memory_limit_bytes'] is not None:
+      if limit is None or limit >= UNLIMITED_MEMORY_THRESHOLD:
+        usage['memory_limit_bytes'] = None
+      else:
+        usage['memory_limit_bytes'] += limit
+  return result
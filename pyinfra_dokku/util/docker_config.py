@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+docker daemon configuration and output-parsing helpers
+"""
+
+import json
+import re
+
+from typing import Any, Dict, List, Mapping, Sequence, Union, cast
+
+SIZE_REGEX = re.compile(r'^(?P<number>[0-9.]+)\s*(?P<unit>[kKMGTP]?i?B)?$')
+
+SIZE_UNITS = {
+  '':   1,
+  'B':  1,
+  'kB': 1000,   'KB': 1000,   'KiB': 1024,
+  'MB': 1000**2,              'MiB': 1024**2,
+  'GB': 1000**3,              'GiB': 1024**3,
+  'TB': 1000**4,              'TiB': 1024**4,
+  'PB': 1000**5,              'PiB': 1024**5,
+}
+
+
+def parse_daemon_config(inp: Union[str, Sequence[str]]) -> Dict[str, Any]:
+  """
+  parse the contents of `/etc/docker/daemon.json`.
+
+  Will take either a string (str) or list of lines.
+
+  Returns an empty dict for empty input. Raises a ValueError if the input
+  isn't a JSON object.
+  """
+
+  conts = inp if isinstance(inp, str) else "\n".join(cast(List[str], inp))
+
+  if not conts.strip():
+    return {}
+  result = json.loads(conts)
+  if not isinstance(result, dict):
+    raise ValueError("docker daemon config should be a JSON object")
+  return result
+
+
+def merge_daemon_config(existing: Mapping[str, Any], updates: Mapping[str, Any]) -> Dict[str, Any]:
+  """
+  return a copy of docker daemon config `existing`, with `updates` merged in.
+  Nested dicts are merged recursively; settings which are None in `updates`
+  are removed; other values in `updates` replace those in `existing`.
+  Settings not mentioned in `updates` are kept.
+  """
+
+  result = dict(existing)
+  for key, value in updates.items():
+    if value is None:
+      result.pop(key, None)
+    elif isinstance(value, Mapping) and isinstance(result.get(key), Mapping):
+      result[key] = merge_daemon_config(result[key], value)
+    else:
+      result[key] = value
+  return result
+
+
+def render_daemon_config(config: Mapping[str, Any]) -> str:
+  """
+  render docker daemon config as (stably ordered) JSON.
+  """
+
+  return json.dumps(config, indent=2, sort_keys=True) + "\n"
+
+
+def parse_size(size: str) -> int:
+  """
+  parse a size as shown by docker (e.g. "1.5GB", "512kB", "0B") into bytes.
+
+  Raises a ValueError for unparseable input.
+  """
+
+  match = SIZE_REGEX.match(size.strip())
+  if not match:
+    raise ValueError(f"can't parse size '{size}'")
+  unit = match.group('unit') or ''
+  return int(float(match.group('number')) * SIZE_UNITS[unit])
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""
+parse output of dokku `*:report` commands
+"""
+
+import re
+import shlex
+
+from typing import Dict, Iterable, List, Optional, Sequence, Union, cast
+
+# plugin names may be several words, e.g. "docker options" for `docker-options:report`
+HEADER_REGEX = re.compile(r'^=====>\s+(?P<app>\S+)\s+(?P<plugin>\S+(?:\s+\S+)*?)\s+information\s*$')
+
+APP_HEADER_REGEX = re.compile(r'^=====>\s+(?P<app>\S+)\s*$')
+
+# dokku keeps each plugin property in a file, DOKKU_CONFIG_DIR/PLUGIN/APP/PROPERTY
+DOKKU_CONFIG_DIR = '/var/lib/dokku/config'
+
+def parse_report(inp: Union[str, Sequence[str]]) -> Dict[str, Dict[str, Dict[str, str]]]:
+  """
+  parse output of one or more `dokku PLUGIN:report` commands, e.g. something
+  like
+
+      =====> node-js-app resource information
+             web limit cpu:
+             web limit memory:              1024
+      =====> node-js-app ps information
+             Deployed:                      true
+             Processes:                     2
+
+  etc.
+
+  Will take either a string (str) or list of lines.
+
+  Returns a dict mapping plugin name to dicts, which map app name to
+  dicts of (lower-cased) keys and values. e.g.
+  `result['ps']['node-js-app']['processes'] == '2'`. Plugins whose report
+  headers have several words (e.g. `docker-options`) are keyed by those
+  words, e.g. `result['docker options']`.
+
+  Empty values are kept (as empty strings); lines before the first header,
+  and lines without a colon, are ignored.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result: Dict[str, Dict[str, Dict[str, str]]] = {}
+  section = None
+  for line in lines:
+    match = HEADER_REGEX.match(line.strip())
+    if match:
+      section = result.setdefault(match.group('plugin'), {}) \
+                      .setdefault(match.group('app'), {})
+      continue
+    if section is None or ':' not in line:
+      continue
+    key, val = line.split(':', 1)
+    section[key.strip().lower()] = val.strip()
+  return result
+
+
+def render_app_list_command(apps: Optional[Iterable[str]] = None) -> str:
+  """
+  return a shell command which prints `apps` (default: every app), one per
+  line.
+  """
+
+  if apps is None:
+    return "dokku --quiet apps:list 2>/dev/null"
+  return "printf '%s\\n' " + " ".join(shlex.quote(app) for app in apps)
+
+
+def render_config_vars_command(keys: Iterable[str], apps: Optional[Iterable[str]] = None) -> str:
+  """
+  return a shell command which prints, for each of `apps` (default: every
+  app), a header line `=====> APP` followed by the app's values (if set) of
+  the config vars `keys` (and no others, so other secrets in app config
+  aren't fetched).
+  """
+
+  pattern = "|".join(re.escape(key) for key in keys)
+  return (
+      f"{render_app_list_command(apps)} | while read -r app; do "
+      "echo \"=====> $app\"; "
+      "dokku config:export --format envfile \"$app\" < /dev/null 2>/dev/null "
+      f"| grep -E '^(export )?({pattern})=' || true; "
+      "done"
+  )
+
+
+def parse_config_vars(inp: Union[str, Sequence[str]]) -> Dict[str, Dict[str, str]]:
+  """
+  parse the output of `render_config_vars_command`, returning a dict
+  mapping app names to dicts of config var to value, e.g.
+  `{"node-js-app": {"DOKKU_CHECKS_WAIT": "2"}}`.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result: Dict[str, Dict[str, str]] = {}
+  section = None
+  for line in lines:
+    line = line.strip()
+    match = APP_HEADER_REGEX.match(line)
+    if match:
+      section = result.setdefault(match.group('app'), {})
+      continue
+    if section is None or '=' not in line:
+      continue
+    key, val = line.split('=', 1)
+    key = key[len('export '):] if key.startswith('export ') else key
+    if len(val) >= 2 and val[0] == val[-1] and val[0] in "'\"":
+      val = val[1:-1]
+    section[key] = val
+  return result
+
+
+def render_global_properties_command(plugin: str) -> str:
+  """
+  return a shell command which prints a line `PROPERTY VALUE` for each
+  global property set for dokku plugin `plugin`.
+  """
+
+  global_dir = shlex.quote(f"{DOKKU_CONFIG_DIR}/{plugin}/--global")
+  return (
+      f"for f in {global_dir}/*; do "
+      "if [ -f \"$f\" ]; then echo \"$(basename \"$f\") $(cat \"$f\")\"; fi; "
+      "done"
+  )
+
+
+def parse_global_properties(inp: Union[str, Sequence[str]]) -> Dict[str, str]:
+  """
+  parse the output of `render_global_properties_command`, returning a dict
+  of property name to value, e.g. `{"selected": "dockerfile"}`.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result = {}
+  for line in lines:
+    if not line.strip():
+      continue
+    name, _sep, value = line.partition(' ')
+    result[name] = value.strip()
+  return result
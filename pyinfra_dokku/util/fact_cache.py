@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+a local (control-side) SQLite cache of per-host fact values, with TTLs
+"""
+
+import contextlib
+import datetime
+import json
+import sqlite3
+import time
+
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+DEFAULT_FACT_CACHE_PATH = '.pyinfra-dokku-facts.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+  host      TEXT NOT NULL,
+  key       TEXT NOT NULL,
+  value     TEXT NOT NULL,
+  stored_at REAL NOT NULL,
+  PRIMARY KEY (host, key)
+)
+"""
+
+
+def encode_value(value: Any) -> Any:
+  """
+  convert a fact value into something JSON can store: dicts with
+  non-string (e.g. tuple) keys and datetimes are tagged, so `decode_value`
+  can restore them; tuples become lists.
+  """
+
+  if isinstance(value, dict):
+    if all(isinstance(key, str) for key in value):
+      return {key: encode_value(val) for key, val in value.items()}
+    return {'__items__': [[encode_value(key), encode_value(val)] for key, val in value.items()]}
+  if isinstance(value, (list, tuple)):
+    return [encode_value(item) for item in value]
+  if isinstance(value, datetime.datetime):
+    return {'__datetime__': value.isoformat()}
+  return value
+
+
+def decode_value(value: Any) -> Any:
+  """
+  reverse `encode_value` (lists used as dict keys become tuples).
+  """
+
+  if isinstance(value, dict):
+    if set(value) == {'__items__'}:
+      return {_hashable(decode_value(key)): decode_value(val) for key, val in value['__items__']}
+    if set(value) == {'__datetime__'}:
+      return datetime.datetime.fromisoformat(value['__datetime__'])
+    return {key: decode_value(val) for key, val in value.items()}
+  if isinstance(value, list):
+    return [decode_value(item) for item in value]
+  return value
+
+
+def _hashable(value: Any) -> Any:
+  return tuple(_hashable(item) for item in value) if isinstance(value, list) else value
+
+
+class FactCache:
+  """
+  fact values keyed by host name and fact key, each stored with the time
+  it was fetched, in an SQLite database at `path`.
+  """
+
+  def __init__(self, path: str = DEFAULT_FACT_CACHE_PATH,
+               clock: Callable[[], float] = time.time):
+    self.path = path
+    self.clock = clock
+    with self._connect() as conn:
+      conn.execute(_SCHEMA)
+
+  @contextlib.contextmanager
+  def _connect(self) -> Iterator[sqlite3.Connection]:
+    conn = sqlite3.connect(self.path, timeout=30)
+    try:
+      with conn:
+        yield conn
+    finally:
+      conn.close()
+
+  def get(self, host: str, key: str, ttl: Optional[float]) -> Tuple[bool, Any]:
+    """
+    return (True, value) if a value for `key` on `host` was stored less than
+    `ttl` seconds ago (or at all, if `ttl` is None), else (False, None).
+    """
+
+    with self._connect() as conn:
+      row = conn.execute("SELECT value, stored_at FROM facts WHERE host = ? AND key = ?",
+                         (host, key)).fetchone()
+    if row is None or (ttl is not None and self.clock() - row[1] >= ttl):
+      return False, None
+    return True, decode_value(json.loads(row[0]))
+
+  def put(self, host: str, key: str, value: Any):
+    """
+    store `value` for `key` on `host`, fetched now.
+    """
+
+    with self._connect() as conn:
+      conn.execute("INSERT OR REPLACE INTO facts (host, key, value, stored_at) "
+                   "VALUES (?, ?, ?, ?)",
+                   (host, key, json.dumps(encode_value(value), sort_keys=True), self.clock()))
+
+  def invalidate(self, host: str, keys: Optional[Iterable[str]] = None):
+    """
+    forget the values stored for `keys` on `host` (default: everything
+    stored for `host`).
+    """
+
+    with self._connect() as conn:
+      if keys is None:
+        conn.execute("DELETE FROM facts WHERE host = ?", (host,))
+      else:
+        conn.executemany("DELETE FROM facts WHERE host = ? AND key = ?",
+                         [(host, key) for key in keys])
+
+  def entries(self) -> Dict[str, Dict[str, Tuple[Any, float]]]:
+    """
+    return everything stored, regardless of age, as a dict mapping host
+    names to dicts mapping fact keys to (value, age in seconds) pairs.
+    """
+
+    now = self.clock()
+    with self._connect() as conn:
+      rows = conn.execute("SELECT host, key, value, stored_at FROM facts").fetchall()
+    result: Dict[str, Dict[str, Tuple[Any, float]]] = {}
+    for host, key, value, stored_at in rows:
+      result.setdefault(host, {})[key] = (decode_value(json.loads(value)), now - stored_at)
+    return result
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+resolve, shallowly fetch and archive git refs on the machine running
+pyinfra, for `pyinfra_dokku.apps.deploy_app_from_git`; and track which
+ref each app on a host was last deployed from
+"""
+
+import hashlib
+import re
+import shlex
+import subprocess
+
+from pathlib import Path
+from typing  import Dict, List, Mapping, Optional, Sequence, Tuple, Union, cast
+
+DEFAULT_GIT_CACHE_DIR = '.pyinfra-dokku-git'
+
+# on hosts: a file per app, recording the commit it was deployed from
+DEPLOYED_REFS_DIR = '/var/lib/pyinfra-dokku/deployed'
+
+SHA_REGEX = re.compile(r'^[0-9a-f]{40}$')
+
+
+class GitDeployError(Exception):
+  """
+  raised when a git command run on the machine running pyinfra fails.
+  """
+
+
+def _git(*args: str) -> str:
+  res = subprocess.run(["git", *args], capture_output=True, encoding="utf8", check=False)
+  if res.returncode != 0:
+    raise GitDeployError(f"'git {' '.join(args)}' failed: {res.stderr.strip()}")
+  return res.stdout
+
+
+def resolve_ref(repo_url: str, ref: str) -> str:
+  """
+  return the commit `ref` (a branch, tag, full ref name, HEAD or commit
+  sha) currently points to in the repository at `repo_url`, without
+  cloning it (via `git ls-remote`). Annotated tags are resolved to the
+  commit they tag.
+  """
+
+  if SHA_REGEX.match(ref):
+    return ref
+
+  refs = {}
+  for line in _git("ls-remote", repo_url).splitlines():
+    sha, _, name = line.partition("\t")
+    refs[name] = sha
+
+  if ref.startswith("refs/") or ref == "HEAD":
+    candidates = [ref]
+  else:
+    candidates = [f"refs/heads/{ref}", f"refs/tags/{ref}"]
+  for name in candidates:
+    for key in (f"{name}^{{}}", name):
+      if key in refs:
+        return refs[key]
+  raise GitDeployError(f"ref '{ref}' not found in {repo_url}")
+
+
+def cache_repo_path(cache_dir: Union[str, Path], repo_url: str) -> Path:
+  """
+  path of the local bare repository `repo_url` is fetched into.
+  """
+
+  return Path(cache_dir) / f"{hashlib.sha256(repo_url.encode('utf8')).hexdigest()[:16]}.git"
+
+
+def fetch_commit(cache_dir: Union[str, Path], repo_url: str, sha: str,
+                 ref: Optional[str] = None) -> Path:
+  """
+  make sure commit `sha` of `repo_url` is in a local bare cache repository
+  (see `cache_repo_path`), fetching just that commit (`--depth 1`) if need
+  be, and return the cache repository's path.
+
+  If the server won't serve a commit by sha, `ref` is fetched instead,
+  and must still point to `sha`.
+  """
+
+  repo = cache_repo_path(cache_dir, repo_url)
+  if not repo.is_dir():
+    repo.parent.mkdir(parents=True, exist_ok=True)
+    _git("init", "--quiet", "--bare", str(repo))
+
+  try:
+    _git("-C", str(repo), "cat-file", "-e", f"{sha}^{{commit}}")
+    return repo
+  except GitDeployError:
+    pass
+
+  try:
+    _git("-C", str(repo), "fetch", "--quiet", "--depth", "1", "--no-tags", repo_url, sha)
+  except GitDeployError:
+    if ref is None:
+      raise
+    _git("-C", str(repo), "fetch", "--quiet", "--depth", "1", "--no-tags", repo_url, ref)
+    fetched = _git("-C", str(repo), "rev-parse", "FETCH_HEAD^{commit}").strip()
+    if fetched != sha:
+      raise GitDeployError(f"'{ref}' in {repo_url} moved from {sha} to {fetched}") from None
+  return repo
+
+
+def build_archive(cache_dir: Union[str, Path], repo_url: str, sha: str,
+                  ref: Optional[str] = None) -> Path:
+  """
+  return the path of a gzipped tar archive of the tree at commit `sha` of
+  `repo_url`, creating it (after `fetch_commit`) if it doesn't exist yet.
+  """
+
+  archive = Path(cache_dir) / "archives" / f"{sha}.tar.gz"
+  if archive.is_file():
+    return archive
+
+  repo = fetch_commit(cache_dir, repo_url, sha, ref)
+  archive.parent.mkdir(parents=True, exist_ok=True)
+  partial = archive.with_name(archive.name + ".partial")
+  _git("-C", str(repo), "archive", "--format=tar.gz", f"--output={partial}", sha)
+  partial.rename(archive)
+  return archive
+
+
+def deployed_ref_path(app: str) -> str:
+  """
+  path of the file recording which commit `app` was deployed from.
+  """
+
+  return f"{DEPLOYED_REFS_DIR}/{app}"
+
+
+def render_record_deployed_command(app: str, sha: str) -> str:
+  """
+  return a shell command which records (on a host) that `app` was just
+  deployed from commit `sha`, along with the sha dokku gave the deploy.
+  """
+
+  quoted_app = shlex.quote(app)
+  return (
+      f"mkdir -p {DEPLOYED_REFS_DIR} && "
+      f"printf '%s %s\\n' {shlex.quote(sha)} \"$(dokku git:report {quoted_app} --git-sha)\" "
+      f"> {shlex.quote(deployed_ref_path(app))}"
+  )
+
+
+def parse_deployed_refs(inp: Union[str, Sequence[str]]) -> Dict[str, Tuple[str, str]]:
+  """
+  parse lines of the form `APP SHA DOKKU_SHA` (the contents of the files in
+  DEPLOYED_REFS_DIR, prefixed with the app name) into a dict mapping app
+  names to (sha, dokku sha) pairs.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result = {}
+  for line in lines:
+    fields = line.split()
+    if len(fields) == 3:
+      result[fields[0]] = (fields[1], fields[2])
+  return result
+
+
+def needs_deploy(app: str, sha: str,
+                 deployed_refs: Mapping[str, Tuple[str, str]],
+                 git_reports: Mapping[str, Mapping[str, str]]) -> bool:
+  """
+  whether `app` must be deployed to be running commit `sha`: false only if
+  it was last deployed from `sha` by us, and dokku's current git sha for it
+  (from the parsed `git:report` sections, `git_reports`) shows nothing has
+  been deployed to it since.
+  """
+
+  recorded = deployed_refs.get(app)
+  if recorded is None or recorded[0] != sha:
+    return True
+  current = git_reports.get(app, {}).get('git sha', '')
+  return not current or current != recorded[1]
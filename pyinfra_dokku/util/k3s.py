@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+"""
+helpers for setting up k3s clusters for dokku's k3s scheduler
+"""
+
+import json
+import re
+
+from typing import Any, Iterable, List, Mapping, Optional, Sequence, Union, cast
+
+K3S_ROLES = ('server', 'worker')
+
+K3S_VERSION_REGEX = re.compile(r'^k3s version (?P<version>\S+)')
+
+
+def find_control_plane(hosts: Iterable[Any]) -> Any:
+  """
+  given pyinfra inventory hosts, return the one whose `k3s_role` data is
+  'server'.
+
+  Raises a ValueError unless there's exactly one.
+  """
+
+  servers: List[Any] = [inv_host for inv_host in hosts
+                        if inv_host.data.get('k3s_role') == 'server']
+  if len(servers) != 1:
+    names = [inv_host.name for inv_host in servers]
+    raise ValueError(f"expected exactly one host with k3s_role 'server', got {names}")
+  return servers[0]
+
+
+def render_registries_yaml(registry: str,
+                           username: Optional[str] = None,
+                           password: Optional[str] = None) -> str:
+  """
+  return the contents of a k3s `/etc/rancher/k3s/registries.yaml` file
+  letting nodes pull from `registry` (with credentials, if given).
+
+  JSON is valid YAML, so we emit that rather than depending on a YAML
+  library.
+  """
+
+  conts: Mapping[str, Any] = {
+    'mirrors': {
+      registry: {'endpoint': [f"https://{registry}"]},
+    },
+  }
+  if username is not None and password is not None:
+    conts = {
+      **conts,
+      'configs': {
+        registry: {'auth': {'username': username, 'password': password}},
+      },
+    }
+  return json.dumps(conts, indent=2, sort_keys=True) + "\n"
+
+
+def parse_k3s_version(inp: Union[str, Sequence[str]]) -> Optional[str]:
+  """
+  parse the output of `k3s --version`, returning the version (e.g.
+  'v1.28.2+k3s1', as taken by the k3s install script's
+  `INSTALL_K3S_VERSION`), or None if it isn't there.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  for line in lines:
+    match = K3S_VERSION_REGEX.match(line.strip())
+    if match:
+      return match.group('version')
+  return None
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+parse dokku-letsencrypt output, and plan bulk certificate issuance
+"""
+
+import re
+import shlex
+
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union, cast
+
+# Let's Encrypt allows at most this many names on one certificate
+MAX_NAMES_PER_CERTIFICATE = 100
+
+# and at most this many new certificates per registered domain per week
+MAX_CERTS_PER_REGISTERED_DOMAIN = 50
+
+DAYS_REGEX = re.compile(r'(?P<days>-?\d+)d')
+
+
+def parse_letsencrypt_list(inp: Union[str, Sequence[str]]) -> Dict[str, Optional[int]]:
+  """
+  parse output of `dokku letsencrypt:list`, e.g. something like
+
+      -----> App name      Certificate Expiry   Time before expiry   Time before renewal
+      node-js-app          2016-07-08 14:43:09  89d, 23h, 59m, 19s   59d, 23h, 59m, 19s
+
+  Will take either a string (str) or list of lines.
+
+  Returns a dict mapping app name to the number of whole days before its
+  certificate expires (or None, if that couldn't be determined). Apps
+  whose certificate has expired get a negative or zero number of days.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result: Dict[str, Optional[int]] = {}
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith('----->') or line.startswith('!'):
+      continue
+    fields = line.split()
+    app = fields[0]
+    # fields 1 and 2 are the expiry date and time; next is time before expiry
+    match = DAYS_REGEX.match(fields[3]) if len(fields) > 3 else None
+    if match:
+      result[app] = int(match.group('days'))
+    elif len(fields) > 3 and fields[3].lower().startswith('expired'):
+      result[app] = 0
+    else:
+      result[app] = None
+  return result
+
+
+def registered_domain(domain: str) -> str:
+  """
+  return the registered domain (the last two labels) of `domain`,
+  e.g. "example.com" for "www.app.example.com".
+
+  This ignores multi-label public suffixes (like ".co.uk"), which only
+  makes rate-limit estimates more conservative.
+  """
+
+  labels = domain.lower().rstrip('.').split('.')
+  return '.'.join(labels[-2:])
+
+
+class CertificatePlan(NamedTuple):
+
+  """
+  Result of planning bulk certificate issuance.
+
+  attributes are:
+
+  - issue: apps to issue (or re-issue) certificates for, in order
+  - skipped: apps whose certificates are still valid, mapped to days left
+  - deferred: apps left for a later run, to stay under rate limits
+  """
+
+  issue: List[str]
+  skipped: Dict[str, int]
+  deferred: List[str]
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+def plan_certificates(apps: Mapping[str, Sequence[str]],
+                      current_domains: Mapping[str, Sequence[str]],
+                      days_left: Mapping[str, Optional[int]],
+                      renew_within_days: int = 30,
+                      max_orders: int = 300,
+                      max_per_registered_domain: int = MAX_CERTS_PER_REGISTERED_DOMAIN,
+                     ) -> CertificatePlan:
+  """
+  work out which apps need certificates issued.
+
+  args:
+
+  - apps: maps app names to the domains their certificate should cover.
+    All of an app's domains go on one (SAN) certificate.
+  - current_domains: maps app names to the domains currently set for them
+  - days_left: maps app names to days before their current certificate
+    expires (as returned by `parse_letsencrypt_list`)
+  - renew_within_days: apps whose certificate expires further away than
+    this (and whose domains are unchanged) are skipped
+  - max_orders: most certificates to issue in one run (Let's Encrypt
+    limits new orders per account)
+  - max_per_registered_domain: most certificates to issue in one run for
+    any one registered domain
+
+  Raises a ValueError if an app has no domains, or more than
+  MAX_NAMES_PER_CERTIFICATE.
+  """
+
+  issue: List[str] = []
+  skipped: Dict[str, int] = {}
+  deferred: List[str] = []
+  per_domain: Dict[str, int] = {}
+
+  for app, domains in sorted(apps.items()):
+    if not domains:
+      raise ValueError(f"no domains given for app '{app}'")
+    if len(domains) > MAX_NAMES_PER_CERTIFICATE:
+      raise ValueError(f"app '{app}' has {len(domains)} domains; a certificate "
+                       f"can cover at most {MAX_NAMES_PER_CERTIFICATE}")
+
+    left = days_left.get(app)
+    unchanged = sorted(domains) == sorted(current_domains.get(app, []))
+    if unchanged and left is not None and left > renew_within_days:
+      skipped[app] = left
+      continue
+
+    registered = {registered_domain(domain) for domain in domains}
+    if len(issue) >= max_orders or \
+        any(per_domain.get(reg, 0) >= max_per_registered_domain for reg in registered):
+      deferred.append(app)
+      continue
+
+    for reg in registered:
+      per_domain[reg] = per_domain.get(reg, 0) + 1
+    issue.append(app)
+
+  return CertificatePlan(issue=issue, skipped=skipped, deferred=deferred)
+
+
+def render_issue_queue_script(apps: Sequence[str],
+                              concurrency: int = 4,
+                              launch_interval: float = 2.0,
+                              retry_attempts: int = 3,
+                              retry_backoff: int = 30,
+                             ) -> str:
+  """
+  return a bash script which runs `dokku letsencrypt:enable` for each of
+  `apps`, at most `concurrency` at a time, starting one at most every
+  `launch_interval` seconds. Failed attempts are retried up to
+  `retry_attempts` times in all, waiting `retry_backoff` seconds before the
+  first retry and doubling the wait each time.
+
+  The script prints "ISSUED app" or "FAILED app" for each app, and exits
+  non-zero if any app failed.
+  """
+
+  app_args = " ".join(shlex.quote(app) for app in apps)
+  params: List[Tuple[str, Union[int, float]]] = [
+    ('concurrency', max(1, int(concurrency))),
+    ('launch_interval', launch_interval),
+    ('retry_attempts', max(1, int(retry_attempts))),
+    ('retry_backoff', int(retry_backoff)),
+  ]
+  assignments = "\n".join(f"{name}={value}" for name, value in params)
+
+  return f"""\
+set -uo pipefail
+
+{assignments}
+
+issue() {{
+  local app="$1" attempt=1 delay="$retry_backoff"
+  until dokku letsencrypt:enable "$app"; do
+    if ((attempt >= retry_attempts)); then
+      echo "FAILED $app"
+      return 1
+    fi
+    sleep "$delay"
+    delay=$((delay * 2))
+    attempt=$((attempt + 1))
+  done
+  echo "ISSUED $app"
+}}
+
+pids=()
+for app in {app_args}; do
+  while (( $(jobs -rp | wc -l) >= concurrency )); do
+    sleep 1
+  done
+  issue "$app" &
+  pids+=($!)
+  sleep "$launch_interval"
+done
+
+failures=0
+for pid in "${{pids[@]}}"; do
+  wait "$pid" || failures=$((failures + 1))
+done
+
+exit $((failures > 0))
+"""
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+plan log driver, rotation and log shipping settings for Dokku apps, and
+parse per-app log disk usage
+"""
+
+import shlex
+
+from typing import Any, Dict, List, Mapping, Sequence, Union, cast
+
+# drivers which store logs on the host, and so support rotation
+ROTATING_LOG_DRIVERS = ('json-file', 'local')
+
+LOG_SPEC_KEYS = ('driver', 'max_size', 'max_file', 'non_blocking', 'max_buffer_size', 'vector_sink')
+
+
+def check_log_spec(app: str, spec: Mapping[str, Any]):
+  """
+  raise a ValueError if `spec` (see `plan_app_log_commands`) has unknown keys.
+  """
+
+  unknown = sorted(set(spec) - set(LOG_SPEC_KEYS))
+  if unknown:
+    raise ValueError(f"unknown log settings {unknown} for app '{app}', "
+                     f"expected some of {LOG_SPEC_KEYS}")
+
+
+def daemon_log_config(driver: str, max_size: str, max_file: int) -> Dict[str, Any]:
+  """
+  return docker daemon config updates (see `merge_daemon_config`) setting
+  the default log driver, with rotation if the driver supports it. For
+  other drivers, any `log-opts` are removed, since docker won't start with
+  options the driver doesn't accept.
+  """
+
+  config: Dict[str, Any] = {'log-driver': driver}
+  if driver in ROTATING_LOG_DRIVERS:
+    config['log-opts'] = {'max-size': max_size, 'max-file': str(max_file)}
+  else:
+    config['log-opts'] = None
+  return config
+
+
+def wanted_log_options(spec: Mapping[str, Any]) -> List[str]:
+  """
+  return the docker `--log-*` options (for `dokku docker-options:add`) an
+  app with log `spec` should have. Rotation size isn't included: that's
+  set with `dokku logs:set APP max-size`.
+  """
+
+  options = []
+  if spec.get('driver'):
+    options.append(f"--log-driver={spec['driver']}")
+  if spec.get('max_file') is not None:
+    options.append(f"--log-opt=max-file={int(spec['max_file'])}")
+  if spec.get('non_blocking'):
+    options.append("--log-opt=mode=non-blocking")
+    options.append(f"--log-opt=max-buffer-size={spec.get('max_buffer_size', '1m')}")
+  return options
+
+
+def current_log_options(docker_options: str) -> Dict[str, str]:
+  """
+  return the `--log-driver` and `--log-opt` options in `docker_options`
+  (an app's deploy-phase docker options), mapping each option normalized
+  to `--opt=value` form to the form it was originally added in (which is
+  what `dokku docker-options:remove` needs).
+  """
+
+  words = shlex.split(docker_options or '')
+  options = {}
+  i = 0
+  while i < len(words):
+    word = words[i]
+    if word in ('--log-driver', '--log-opt') and i + 1 < len(words):
+      options[f"{word}={words[i + 1]}"] = f"{word} {words[i + 1]}"
+      i += 2
+      continue
+    if word.startswith('--log-driver=') or word.startswith('--log-opt='):
+      options[word] = word
+    i += 1
+  return options
+
+
+def plan_app_log_commands(app: str, spec: Mapping[str, Any],
+                          logs_report: Mapping[str, str],
+                          docker_options_report: Mapping[str, str]) -> List[str]:
+  """
+  return the dokku commands needed to give `app` the log settings in
+  `spec`, given its parsed `logs:report` and `docker-options:report`
+  sections. None of the commands restart the app.
+
+  `spec` may have keys:
+
+  - 'driver': docker log driver, e.g. 'local', 'journald'
+  - 'max_size': rotate logs at this size, e.g. '10m' (only for drivers
+    which store logs on the host; for other drivers it's set to 'unlimited',
+    so dokku doesn't pass a `max-size` option the driver would reject)
+  - 'max_file': number of rotated files to keep
+  - 'non_blocking': if true, log in non-blocking mode: a noisy app never
+    stalls on logging, and lines beyond a `max_buffer_size` (default '1m')
+    backlog are dropped
+  - 'vector_sink': vector sink DSN to ship the app's logs to (see
+    `dokku logs:set`)
+
+  Returns an empty list if nothing needs changing.
+  """
+
+  check_log_spec(app, spec)
+  quoted_app = shlex.quote(app)
+  commands = []
+
+  current = current_log_options(docker_options_report.get('docker options deploy', ''))
+  wanted = wanted_log_options(spec)
+  for option, original in sorted(current.items()):
+    if option not in wanted:
+      commands.append(f"dokku docker-options:remove {quoted_app} deploy {shlex.quote(original)}")
+  for option in wanted:
+    if option not in current:
+      commands.append(f"dokku docker-options:add {quoted_app} deploy {shlex.quote(option)}")
+
+  max_size = spec.get('max_size')
+  if spec.get('driver') and spec['driver'] not in ROTATING_LOG_DRIVERS:
+    max_size = 'unlimited'
+  if max_size and logs_report.get('logs max size', '') != str(max_size):
+    commands.append(f"dokku logs:set {quoted_app} max-size {shlex.quote(str(max_size))}")
+
+  sink = spec.get('vector_sink')
+  if sink is not None and logs_report.get('logs vector sink', '') != sink:
+    commands.append(f"dokku logs:set {quoted_app} vector-sink {shlex.quote(sink)}")
+
+  return commands
+
+
+def parse_log_usage(inp: Union[str, Sequence[str]]) -> Dict[str, int]:
+  """
+  parse lines of `APP BYTES` (one per container) into a dict mapping each
+  app to the total bytes of log files its containers have on disk.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  usage: Dict[str, int] = {}
+  for line in lines:
+    fields = line.split()
+    if len(fields) != 2 or not fields[1].isdigit():
+      continue
+    usage[fields[0]] = usage.get(fields[0], 0) + int(fields[1])
+  return usage
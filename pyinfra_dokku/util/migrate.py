@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+render the scripts used by `pyinfra_dokku.migrate.migrate_app` to stream an
+app's image, config and storage between hosts, and parse their output
+"""
+
+import shlex
+
+from typing import List, Mapping, NamedTuple, Sequence, Union, cast
+
+TRANSFER_PREFIX = 'TRANSFERRED'
+
+
+class Transfer(NamedTuple):
+  """
+  one item streamed between hosts, as reported by a transfer script.
+  """
+  item: str
+  bytes: int
+  seconds: float
+
+
+def parse_mount_specs(storage_report: Mapping[str, str]) -> List[str]:
+  """
+  given an app's parsed `dokku storage:report` output, return its storage
+  mounts as `SOURCE:DEST[:OPTIONS]` strings, as accepted by
+  `dokku storage:mount`.
+  """
+
+  args = shlex.split(storage_report.get('storage deploy mounts') or '')
+  return [value for flag, value in zip(args, args[1:]) if flag == '-v']
+
+
+def host_path_mounts(mount_specs: Sequence[str]) -> List[str]:
+  """
+  return the host directories (rather than named volumes) mounted by
+  `mount_specs`.
+  """
+
+  return [spec.split(':', 1)[0] for spec in mount_specs if spec.startswith('/')]
+
+
+def app_image(app: str) -> str:
+  """
+  return the name of the image dokku runs for `app`.
+  """
+
+  return f"dokku/{app}:latest"
+
+
+def migrated_image(app: str) -> str:
+  """
+  return the name an app's image is loaded under on the target host,
+  ready for `dokku git:from-image`.
+  """
+
+  return f"dokku-migrate/{app}:latest"
+
+
+def render_transfer_script(app: str, target: str, mounts: Sequence[str],
+                           include_image: bool = True) -> str:
+  """
+  return a bash script, to be run as root on the source host, which streams
+  `app`'s data to `target` (an ssh destination, e.g. `root@dokku2`), with
+  all items transferred in parallel:
+
+  - if `include_image` is true, the app's image, via `docker save` and
+    `docker load` (compressed with zstd in transit)
+  - the app's config (`/home/dokku/APP/ENV`)
+  - each directory in `mounts`, via `rsync --delete`, so that repeating the
+    script only sends what changed
+
+  For each item, a line `TRANSFERRED ITEM BYTES SECONDS` is output; the
+  script fails if any transfer does.
+  """
+
+  ssh = f"ssh -o BatchMode=yes {shlex.quote(target)}"
+  env_path = shlex.quote(f"/home/dokku/{app}/ENV")
+  image = shlex.quote(app_image(app))
+  loaded_as = shlex.quote(migrated_image(app))
+
+  jobs = [
+      f"""(
+  start=$(date +%s.%N)
+  if [ -e {env_path} ]; then
+    {ssh} "cat > {env_path}.migrating && chown dokku:dokku {env_path}.migrating &&
+           mv {env_path}.migrating {env_path}" < {env_path}
+    report config "$(stat -c %s {env_path})" "$start"
+  fi
+) &""",
+  ]
+
+  if include_image:
+    jobs.append(f"""(
+  start=$(date +%s.%N)
+  docker save {image} | zstd --quiet -T0 |
+    {ssh} "zstd -d | docker load --quiet && docker tag {image} {loaded_as}"
+  report image "$(docker image inspect --format '{{{{.Size}}}}' {image})" "$start"
+) &""")
+
+  for mount in mounts:
+    source = shlex.quote(mount.rstrip('/') + '/')
+    jobs.append(f"""(
+  start=$(date +%s.%N)
+  sent=$(rsync --archive --hard-links --delete --stats --rsh="ssh -o BatchMode=yes" \\
+           --rsync-path="mkdir -p {source} && rsync" {source} {shlex.quote(target)}:{source} |
+         sed -n 's/^Total bytes sent: //p' | tr -d ,)
+  report {shlex.quote('storage:' + mount)} "$sent" "$start"
+) &""")
+
+  return (
+      "#!/usr/bin/env bash\n"
+      "set -euo pipefail\n"
+      "\n"
+      "report() {\n"
+      "  local elapsed\n"
+      "  elapsed=\"$(awk -v start=\"$3\" -v end=\"$(date +%s.%N)\" \\\n"
+      "              'BEGIN { printf \"%.2f\", end - start }')\"\n"
+      f"  echo \"{TRANSFER_PREFIX} $1 ${{2:-0}} $elapsed\"\n"
+      "}\n"
+      "\n"
+      + "\n".join(jobs) + "\n"
+      "\n"
+      "failed=0\n"
+      "for job in $(jobs -p); do\n"
+      "  wait \"$job\" || failed=1\n"
+      "done\n"
+      "exit \"$failed\"\n"
+  )
+
+
+def parse_transfer_output(inp: Union[str, Sequence[str]]) -> List[Transfer]:
+  """
+  parse the `TRANSFERRED` lines output by a transfer script
+  (see `render_transfer_script`); other lines are ignored.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  transfers = []
+  for line in lines:
+    fields = line.split()
+    if len(fields) != 4 or fields[0] != TRANSFER_PREFIX:
+      continue
+    try:
+      transfers.append(Transfer(fields[1], int(fields[2]), float(fields[3])))
+    except ValueError:
+      continue
+  return transfers
+
+
+def summarize_transfers(transfers: Sequence[Transfer]) -> str:
+  """
+  return a one-line summary of `transfers`: total bytes, and throughput
+  (items are transferred in parallel, so this is total bytes over the
+  longest item's duration).
+  """
+
+  total = sum(transfer.bytes for transfer in transfers)
+  seconds = max((transfer.seconds for transfer in transfers), default=0.0)
+  rate = total / seconds if seconds > 0 else 0.0
+  return f"{total} bytes in {seconds:.1f}s ({rate / 1024 / 1024:.1f} MiB/s)"
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+measure and rank candidate apt mirrors, and render apt mirror lists
+(for apt's `mirror+file:` method, which falls back to the next mirror
+in a list when one fails)
+"""
+
+import shlex
+
+from typing import Dict, List, Mapping, NamedTuple, Sequence, Union, cast
+
+MIRROR_SOURCES  = ('ubuntu', 'docker', 'dokku')
+MIRROR_LIST_DIR = '/etc/apt/mirrors'
+
+# size of download mirrors are compared on: roughly a typical package
+REFERENCE_BYTES = 10 * 1024 * 1024
+
+FAILED_PROBE    = "000 0 0"
+
+
+class Probe(NamedTuple):
+  """
+  result of fetching a small file from a mirror.
+  """
+  ok: bool
+  latency: float        # seconds to connect
+  bytes_per_sec: float  # download speed
+
+  def score(self, reference_bytes: int = REFERENCE_BYTES) -> float:
+    """
+    estimated seconds to download `reference_bytes` from the mirror
+    (lower is better).
+    """
+    if not self.ok or self.bytes_per_sec <= 0:
+      return float('inf')
+    return self.latency + reference_bytes / self.bytes_per_sec
+
+
+def probe_url(base: str, codename: str) -> str:
+  """
+  return the URL fetched to measure a repository at `base` (a URL, as
+  would appear in an apt `deb` line): its `Release` file for `codename`.
+  """
+
+  return f"{base.rstrip('/')}/dists/{codename}/Release"
+
+
+def render_probe_command(urls: Sequence[str], timeout: int = 10) -> str:
+  """
+  return a shell command which fetches each of `urls` with curl, and
+  outputs a line `URL HTTP_STATUS CONNECT_SECONDS BYTES_PER_SECOND`
+  for each (parsed by `parse_probe_output`).
+  """
+
+  fmt = shlex.quote(r"%{http_code} %{time_connect} %{speed_download}")
+  return "; ".join(
+    f"result=$(curl --output /dev/null --silent --location --max-time {int(timeout)} "
+    f"--write-out {fmt} {shlex.quote(url)} 2>/dev/null); "
+    f"echo {shlex.quote(url)} \"${{result:-{FAILED_PROBE}}}\""
+    for url in urls
+  )
+
+
+def parse_probe_output(inp: Union[str, Sequence[str]]) -> Dict[str, Probe]:
+  """
+  parse the output of a probe command (see `render_probe_command`)
+  into a dict mapping URLs to `Probe`s. A probe is ok if the fetch
+  returned HTTP status 200.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  probes = {}
+  for line in lines:
+    fields = line.split()
+    if len(fields) != 4:
+      continue
+    url, status, latency, speed = fields
+    try:
+      probes[url] = Probe(status == '200', float(latency), float(speed))
+    except ValueError:
+      probes[url] = Probe(False, 0.0, 0.0)
+  return probes
+
+
+def rank_mirrors(candidates: Sequence[str], probes: Mapping[str, Probe],
+                 codename: str) -> List[str]:
+  """
+  order `candidates` (repository base URLs) fastest first, judged by
+  `probes` (keyed by probe URL; see `probe_url`). Mirrors whose probe
+  failed go last, in their original order, so they're still tried as
+  a last resort.
+  """
+
+  def probe_for(base):
+    return probes.get(probe_url(base, codename), Probe(False, 0.0, 0.0))
+
+  working = [base for base in candidates if probe_for(base).ok]
+  failing = [base for base in candidates if not probe_for(base).ok]
+  return sorted(working, key=lambda base: probe_for(base).score()) + failing
+
+
+def mirror_list_path(source: str) -> str:
+  """
+  return the path of the apt mirror list for `source` (one of MIRROR_SOURCES).
+  """
+
+  return f"{MIRROR_LIST_DIR}/{source}.list"
+
+
+def render_mirror_list(ranked: Sequence[str]) -> str:
+  """
+  render an apt mirror list, preferring mirrors in the order given.
+  """
+
+  return "".join(f"{base}\tpriority:{rank}\n" for rank, base in enumerate(ranked, start=1))
+
+
+def render_ubuntu_sources(codename: str,
+                          components: str = "main restricted universe multiverse") -> str:
+  """
+  render apt sources for the Ubuntu archive (release, updates and
+  backports pockets; security updates are left to the existing sources)
+  using the Ubuntu mirror list.
+  """
+
+  uri = f"mirror+file:{mirror_list_path('ubuntu')}"
+  return "".join(f"deb {uri} {codename}{pocket} {components}\n"
+                 for pocket in ('', '-updates', '-backports'))
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+plan Dokku network settings for apps
+"""
+
+import shlex
+
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+NETWORK_PROPERTIES = (
+  'attach-post-create', 'attach-post-deploy', 'initial-network', 'bind-all-interfaces', 'tld',
+)
+
+# properties whose values are lists of networks, where order doesn't matter
+NETWORK_LIST_PROPERTIES = ('attach-post-create', 'attach-post-deploy')
+
+
+def _report_key(prop: str) -> str:
+  return "network " + prop.replace('-', ' ')
+
+
+def _as_words(value: Any) -> List[str]:
+  if isinstance(value, bool):
+    return ['true' if value else 'false']
+  if isinstance(value, str):
+    return value.split()
+  if isinstance(value, (list, tuple)):
+    return [str(item) for item in value]
+  return [str(value)]
+
+
+def plan_network_commands(networks: Sequence[str],
+                          apps: Mapping[str, Mapping[str, Any]],
+                          existing_networks: Sequence[str],
+                          network_reports: Mapping[str, Mapping[str, str]],
+                         ) -> Tuple[List[str], List[str]]:
+  """
+  return the dokku commands needed to create `networks` (those not in
+  `existing_networks`) and to apply per-app network properties, given
+  current state as parsed from `dokku network:report` (app names mapped
+  to report keys, as from the `DokkuReports` fact).
+
+  `apps` maps app names to dicts of network properties (from
+  NETWORK_PROPERTIES) and values; values may be strings, or lists of network
+  names. An empty value clears a property. e.g.
+
+  .. code:: python
+
+      {"api": {"attach-post-deploy": ["internal"]}}
+
+  Returns a tuple `(commands, changed_apps)`; changed apps need rebuilding
+  for changes to take effect.
+
+  Raises a ValueError for unknown properties.
+  """
+
+  commands = [f"dokku network:create {shlex.quote(network)}"
+              for network in networks if network not in existing_networks]
+
+  changed_apps = []
+  for app, props in sorted(apps.items()):
+    report = network_reports.get(app, {})
+    app_changed = False
+    for prop, value in sorted(props.items()):
+      if prop not in NETWORK_PROPERTIES:
+        raise ValueError(f"unknown network property '{prop}' for app '{app}', "
+                         f"expected one of {NETWORK_PROPERTIES}")
+      wanted = _as_words(value)
+      current = report.get(_report_key(prop), '').split()
+      if prop in NETWORK_LIST_PROPERTIES:
+        same = sorted(wanted) == sorted(current)
+      else:
+        same = wanted == current
+      if same:
+        continue
+      app_changed = True
+      commands.append(" ".join(["dokku network:set", shlex.quote(app), prop]
+                               + [shlex.quote(word) for word in wanted]))
+    if app_changed:
+      changed_apps.append(app)
+
+  return commands, changed_apps
+
+
+def app_network_hosts(apps: Mapping[str, Mapping[str, Any]]) -> Dict[str, List[str]]:
+  """
+  return, for each network in `apps` (as for `plan_network_commands`), the
+  apps attached to it: other apps on the same network can reach them at
+  `APP.web` (for the `web` process; likewise for other process types).
+  """
+
+  attached: Dict[str, List[str]] = {}
+  for app, props in sorted(apps.items()):
+    for prop in NETWORK_LIST_PROPERTIES:
+      for network in _as_words(props.get(prop, [])):
+        if app not in attached.setdefault(network, []):
+          attached[network].append(app)
+  return attached
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+"""
+plan `resource:limit`, `resource:reserve` and `ps:scale` changes for dokku apps
+"""
+
+import re
+import shlex
+
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Union, cast
+
+from .dokku_reports import APP_HEADER_REGEX, render_app_list_command
+
+# process type dokku uses for limits that apply to all process types
+DEFAULT_PROCESS_TYPE = '_default_'
+
+RESOURCE_KINDS = ('limit', 'reserve')
+
+SCALE_LINE_REGEX = re.compile(r'^(?P<proctype>[\w-]+):\s+(?P<count>\d+)$')
+
+
+def default_resource_spec(cpus: int) -> Dict[str, Any]:
+  """
+  return the per-app defaults used for apps that don't specify their own
+  values, derived from the host's CPU count: no single app may use more
+  than half the host's cores.
+  """
+
+  return {
+    'limit': {'cpu': max(1, cpus // 2)},
+    'reserve': {},
+    'scale': {},
+  }
+
+
+def default_restart_parallelism(cpus: int) -> int:
+  """
+  return the number of apps to restart at once, derived from the host's
+  CPU count.
+  """
+
+  return max(1, cpus // 2)
+
+
+def resolve_resource_spec(spec: Mapping[str, Mapping[str, Any]],
+                          cpus: int) -> Dict[str, Dict[str, Any]]:
+  """
+  fill in defaults (see `default_resource_spec`) for each app in `spec`.
+
+  `spec` maps app names to dicts with any of the keys
+  'limit', 'reserve' (each a dict of resource name to value, e.g.
+  `{'cpu': 1, 'memory': '512m'}`) and 'scale' (a dict of process type to
+  count, e.g. `{'web': 2}`).
+  """
+
+  resolved = {}
+  for app, app_spec in spec.items():
+    defaults = default_resource_spec(cpus)
+    unknown = set(app_spec) - set(defaults)
+    if unknown:
+      raise ValueError(f"unknown keys in resource spec for app '{app}': {sorted(unknown)}")
+    resolved[app] = {
+      key: {**default, **app_spec.get(key, {})}
+      for key, default in defaults.items()
+    }
+  return resolved
+
+
+def render_scale_command(apps: Optional[Iterable[str]] = None) -> str:
+  """
+  return a shell command which prints, for each of `apps` (default: every
+  app), a header line `=====> APP` followed by the app's `dokku ps:scale`
+  output.
+  """
+
+  return (
+      f"{render_app_list_command(apps)} | while read -r app; do "
+      "echo \"=====> $app\"; "
+      "dokku ps:scale \"$app\" < /dev/null 2>/dev/null || true; "
+      "done"
+  )
+
+
+def parse_scale(inp: Union[str, Sequence[str]]) -> Dict[str, Dict[str, int]]:
+  """
+  parse the output of `render_scale_command`, returning a dict mapping
+  app names to their configured (not necessarily running) process counts,
+  e.g. `{"node-js-app": {"web": 1, "worker": 0}}`.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  result: Dict[str, Dict[str, int]] = {}
+  section = None
+  for line in lines:
+    line = line.strip()
+    match = APP_HEADER_REGEX.match(line)
+    if match:
+      section = result.setdefault(match.group('app'), {})
+      continue
+    match = SCALE_LINE_REGEX.match(line)
+    if section is not None and match:
+      section[match.group('proctype')] = int(match.group('count'))
+  return result
+
+
+def scale_differs(scale: Mapping[str, int], wanted: Mapping[str, int]) -> bool:
+  """
+  return True if configured process counts `scale` don't match `wanted`
+  (process types not in `wanted` are ignored).
+  """
+
+  return any(scale.get(proctype, 0) != int(count) for proctype, count in wanted.items())
+
+
+def plan_resource_commands(app: str,
+                           desired: Mapping[str, Any],
+                           reports: Mapping[str, Mapping[str, Mapping[str, str]]],
+                           scale: Mapping[str, int],
+                          ) -> List[str]:
+  """
+  return the dokku commands needed to bring `app` to the `desired`
+  (resolved) spec, given current state as returned by the `DokkuReports`
+  fact for the 'resource' plugin and the app's configured process counts
+  `scale` (see `parse_scale`). None of the commands restart the app.
+
+  Returns an empty list if nothing needs changing.
+  """
+
+  quoted_app = shlex.quote(app)
+  commands = []
+
+  resource_report = reports.get('resource', {}).get(app, {})
+  for kind in RESOURCE_KINDS:
+    changed = {}
+    for resource, value in sorted(desired[kind].items()):
+      key = f"{DEFAULT_PROCESS_TYPE} {kind} {resource}"
+      if resource_report.get(key, '') != str(value):
+        changed[resource] = value
+    if changed:
+      args = " ".join(f"--{resource} {shlex.quote(str(value))}"
+                      for resource, value in changed.items())
+      commands.append(f"dokku resource:{kind} {args} {quoted_app}")
+
+  wanted_scale = {proctype: int(count) for proctype, count in desired['scale'].items()}
+  if scale_differs(scale, wanted_scale):
+    args = " ".join(f"{proctype}={count}" for proctype, count in sorted(wanted_scale.items()))
+    commands.append(f"dokku ps:scale --skip-deploy {quoted_app} {args}")
+
+  return commands
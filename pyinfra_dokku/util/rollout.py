@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+plan and sequence rollout waves: a canary, then growing batches of hosts
+"""
+
+import math
+import time
+
+from typing import Callable, Collection, List, NamedTuple, Optional, Sequence, TypeVar
+
+T = TypeVar('T')
+
+
+class WaveResult(NamedTuple):
+  """
+  outcome of one rollout wave.
+  """
+  hosts: List[str]
+  failed: List[str]
+  seconds: float
+
+
+class RolloutResult(NamedTuple):
+  """
+  outcome of a rollout: the waves that were run, and whether the rollout
+  was aborted (leaving later waves unrun) because too many hosts failed.
+  """
+  waves: List[WaveResult]
+  aborted: bool
+
+  @property
+  def failed(self) -> List[str]:
+    """
+    all hosts that failed, over all waves run.
+    """
+    return [name for wave in self.waves for name in wave.failed]
+
+
+def plan_waves(hosts: Sequence[T], canary: int = 1, growth: float = 2.0,
+               max_wave_size: Optional[int] = None) -> List[List[T]]:
+  """
+  split `hosts` (in order) into waves: first `canary` hosts, then batches
+  each `growth` times the size of the previous one, capped at
+  `max_wave_size` hosts (if given).
+
+  Raises a ValueError for a canary of less than 1, or growth of less than 1.
+  """
+
+  if canary < 1:
+    raise ValueError("canary wave should have at least 1 host")
+  if growth < 1:
+    raise ValueError("growth should be at least 1")
+
+  waves = []
+  size = canary
+  remaining = list(hosts)
+  while remaining:
+    if max_wave_size is not None:
+      size = min(size, max_wave_size)
+    waves.append(remaining[:size])
+    remaining = remaining[size:]
+    size = max(size + 1, math.ceil(size * growth)) if growth > 1 else size
+  return waves
+
+
+def run_waves(waves: Sequence[Sequence[str]],
+              run_wave: Callable[[Sequence[str]], Collection[str]],
+              max_failure_fraction: float = 0.0,
+              on_wave: Optional[Callable[[WaveResult], None]] = None,
+             ) -> RolloutResult:
+  """
+  run each of `waves` in turn, by calling `run_wave` with the wave's host
+  names (it should return the names of hosts that failed), timing each.
+  `on_wave`, if given, is called with each wave's result.
+
+  Once the fraction of hosts that failed, out of all hosts run so far,
+  exceeds `max_failure_fraction`, later waves aren't run.
+  """
+
+  results = []
+  attempted = 0
+  failed = 0
+  for wave in waves:
+    start = time.monotonic()
+    wave_failed = sorted(run_wave(wave))
+    result = WaveResult(list(wave), wave_failed, time.monotonic() - start)
+    results.append(result)
+    if on_wave:
+      on_wave(result)
+
+    attempted += len(wave)
+    failed += len(wave_failed)
+    if failed / attempted > max_failure_fraction:
+      return RolloutResult(results, aborted=len(results) < len(waves))
+  return RolloutResult(results, aborted=False)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+compute per-host time slots for periodic jobs, so that hosts across
+an inventory don't all run them at the same moment
+"""
+
+import hashlib
+
+from typing import Sequence, Tuple
+
+MINUTES_PER_DAY = 24 * 60
+
+SCHEDULE_STRATEGIES = ('hash', 'spread')
+
+
+def hashed_slot(host_name: str, salt: str = "", period: int = MINUTES_PER_DAY) -> int:
+  """
+  return a minute offset in [0, period) for `host_name`, derived from a hash
+  of the name. The same name (and salt) always gives the same slot.
+
+  `salt` lets different jobs on the same host land in different slots.
+  """
+
+  digest = hashlib.sha256(f"{salt}:{host_name}".encode("utf8")).digest()
+  return int.from_bytes(digest[:8], "big") % period
+
+
+def spread_slot(host_name: str, host_names: Sequence[str],
+                period: int = MINUTES_PER_DAY, offset: int = 0) -> int:
+  """
+  return a minute offset in [0, period) for `host_name`, spacing all of
+  `host_names` evenly across the period (in sorted order, so the result
+  doesn't depend on inventory ordering).
+
+  Raises a ValueError if `host_name` isn't in `host_names`.
+  """
+
+  names = sorted(set(host_names))
+  if host_name not in names:
+    raise ValueError(f"host '{host_name}' not in list of hosts to spread over")
+  return (offset + names.index(host_name) * period // len(names)) % period
+
+
+def host_slot(strategy: str, host_name: str, host_names: Sequence[str],
+              salt: str = "", period: int = MINUTES_PER_DAY) -> int:
+  """
+  return a minute offset for `host_name` using the named strategy (one of
+  SCHEDULE_STRATEGIES): 'hash' uses `hashed_slot`; 'spread' uses `spread_slot`
+  (offset by a hash of the salt, so different jobs are staggered too).
+  """
+
+  if strategy == 'hash':
+    return hashed_slot(host_name, salt, period)
+  if strategy == 'spread':
+    return spread_slot(host_name, host_names, period, offset=hashed_slot("", salt, period))
+  raise ValueError(f"unknown schedule strategy '{strategy}', expected one of {SCHEDULE_STRATEGIES}")
+
+
+def slot_to_time(slot: int) -> Tuple[int, int]:
+  """
+  convert a minute-of-day offset to an (hour, minute) tuple.
+  """
+
+  slot = slot % MINUTES_PER_DAY
+  return divmod(slot, 60)
+
+
+def daily_cron_line(slot: int, user: str, command: str) -> str:
+  """
+  return an `/etc/cron.d`-format line running `command` as `user` once a day,
+  at the time given by `slot`.
+  """
+
+  hour, minute = slot_to_time(slot)
+  return f"{minute} {hour} * * * {user} {command}"
+
+
+def daily_on_calendar(slot: int) -> str:
+  """
+  return a systemd `OnCalendar=` expression for once a day, at the time
+  given by `slot`.
+  """
+
+  hour, minute = slot_to_time(slot)
+  return f"*-*-* {hour:02d}:{minute:02d}:00"
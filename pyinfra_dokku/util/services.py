@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+"""
+plan Dokku datastore services (dokku-postgres, dokku-redis), and compute
+service settings tuned to host memory
+"""
+
+import re
+import shlex
+
+from typing import Any, Dict, List, Mapping, Sequence, Union, cast
+
+SERVICE_PLUGIN_URLS = {
+  'postgres': 'https://github.com/dokku/dokku-postgres.git',
+  'redis':    'https://github.com/dokku/dokku-redis.git',
+}
+
+SERVICES_ROOT = '/var/lib/dokku/services'
+
+# config file, relative to the service's directory, and the separator
+# between key and value in it
+SERVICE_CONFIG_FILES = {
+  'postgres': ('data/postgresql.conf', ' = '),
+  'redis':    ('config/redis.conf', ' '),
+}
+
+REDIS_PERSISTENCE = ('rdb', 'aof', 'none')
+
+MIN_SERVICE_MEMORY_MB = 64
+
+KEY_REGEX     = re.compile(r'^[A-Za-z_][A-Za-z0-9_-]*$')
+SETTING_REGEX = re.compile(
+  r'^\s*(?P<key>[A-Za-z_][A-Za-z0-9_.-]*)\s*(?:=\s*|\s+)(?P<value>.*?)\s*$'
+)
+
+
+def service_config_path(plugin: str, service: str) -> str:
+  """
+  return the path of the config file for `service` of datastore `plugin`.
+  """
+
+  rel_path, _sep = SERVICE_CONFIG_FILES[plugin]
+  return f"{SERVICES_ROOT}/{plugin}/{service}/{rel_path}"
+
+
+def postgres_settings(memory_mb: int, max_connections: int = 100) -> Dict[str, str]:
+  """
+  return postgres settings for a service allotted `memory_mb` MB of RAM:
+  a quarter of it for shared buffers, and enough work_mem that
+  `max_connections` queries can each sort in memory without exceeding
+  another quarter.
+  """
+
+  memory_mb = max(MIN_SERVICE_MEMORY_MB, memory_mb)
+  return {
+    'shared_buffers': f"{memory_mb // 4}MB",
+    'effective_cache_size': f"{memory_mb * 3 // 4}MB",
+    'work_mem': f"{max(4096, memory_mb * 1024 // 4 // max(1, max_connections))}kB",
+    'maintenance_work_mem': f"{min(2048, max(64, memory_mb // 16))}MB",
+    'max_connections': str(max_connections),
+  }
+
+
+def redis_settings(memory_mb: int, persistence: str = 'rdb') -> Dict[str, str]:
+  """
+  return redis settings for a service allotted `memory_mb` MB of RAM,
+  leaving headroom for fragmentation and forks for persistence.
+
+  `persistence` is one of REDIS_PERSISTENCE: 'rdb' (periodic snapshots),
+  'aof' (append-only file, fsynced every second) or 'none' (a pure cache,
+  evicting least recently used keys when full).
+  """
+
+  if persistence not in REDIS_PERSISTENCE:
+    raise ValueError(f"unknown redis persistence '{persistence}', "
+                     f"expected one of {REDIS_PERSISTENCE}")
+
+  memory_mb = max(MIN_SERVICE_MEMORY_MB, memory_mb)
+  settings = {
+    'maxmemory': f"{memory_mb * 3 // 4}mb",
+    'maxmemory-policy': 'allkeys-lru' if persistence == 'none' else 'noeviction',
+    'appendonly': 'yes' if persistence == 'aof' else 'no',
+    'save': '"900 1 300 10 60 10000"' if persistence == 'rdb' else '""',
+  }
+  if persistence == 'aof':
+    settings['appendfsync'] = 'everysec'
+  return settings
+
+
+def resolve_service_specs(spec: Mapping[str, Mapping[str, Mapping[str, Any]]],
+                          host_memory_mb: int,
+                          memory_fraction: float = 0.5,
+                         ) -> Dict[str, Dict[str, Dict[str, Any]]]:
+  """
+  fill in tuned settings for each service in `spec`, which maps plugin names
+  to service names to dicts with keys:
+
+  - 'apps': (optional) apps to link the service to
+  - 'memory_mb': (optional) RAM to tune the service for. By default,
+    `memory_fraction` of host RAM is split evenly between services that
+    don't specify this.
+  - 'persistence': (optional, redis only) see `redis_settings`
+  - 'max_connections': (optional, postgres only) see `postgres_settings`
+  - 'settings': (optional) settings which override the tuned ones
+
+  Returns the same structure, with keys 'apps' (a sorted list) and
+  'settings' (tuned settings plus overrides, all strings) for each service.
+
+  Raises a ValueError for unknown plugins.
+  """
+
+  for plugin in spec:
+    if plugin not in SERVICE_PLUGIN_URLS:
+      raise ValueError(f"unknown datastore plugin '{plugin}', expected one of "
+                       f"{sorted(SERVICE_PLUGIN_URLS)}")
+
+  services = [opts for plugin_spec in spec.values() for opts in plugin_spec.values()]
+  reserved = sum(int(opts['memory_mb']) for opts in services if 'memory_mb' in opts)
+  unsized = sum(1 for opts in services if 'memory_mb' not in opts)
+  default_mb = max(0, int(host_memory_mb * memory_fraction) - reserved) // max(1, unsized)
+
+  resolved: Dict[str, Dict[str, Dict[str, Any]]] = {}
+  for plugin, plugin_spec in spec.items():
+    for service, opts in plugin_spec.items():
+      memory_mb = int(opts.get('memory_mb', default_mb))
+      if plugin == 'postgres':
+        settings = postgres_settings(memory_mb, int(opts.get('max_connections', 100)))
+      else:
+        settings = redis_settings(memory_mb, opts.get('persistence', 'rdb'))
+      settings.update({key: str(value) for key, value in opts.get('settings', {}).items()})
+      resolved.setdefault(plugin, {})[service] = {
+        'apps': sorted(opts.get('apps', [])),
+        'settings': settings,
+      }
+  return resolved
+
+
+def parse_service_config(inp: Union[str, Sequence[str]]) -> Dict[str, str]:
+  """
+  parse a postgres or redis config file into a dict of settings (for keys
+  set more than once, the last value wins). Comments are skipped, and
+  simple trailing comments removed.
+
+  Will take either a string (str) or list of lines.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  settings = {}
+  for line in lines:
+    if line.strip().startswith('#'):
+      continue
+    match = SETTING_REGEX.match(line)
+    if not match:
+      continue
+    value = match.group('value')
+    if value and value[0] not in "'\"" and '#' in value:
+      value = value.split('#', 1)[0].rstrip()
+    settings[match.group('key')] = value
+  return settings
+
+
+def _normalize(value: str) -> str:
+  if len(value) >= 2 and value[0] == value[-1] == "'":
+    value = value[1:-1]
+  return value.lower()
+
+
+def changed_settings(current: Mapping[str, str], wanted: Mapping[str, str]) -> Dict[str, str]:
+  """
+  return the settings in `wanted` whose value differs from `current`
+  (ignoring case, and postgres-style single quotes).
+  """
+
+  return {
+    key: value for key, value in wanted.items()
+    if key not in current or _normalize(current[key]) != _normalize(value)
+  }
+
+
+def render_settings_commands(plugin: str, service: str, settings: Mapping[str, str]) -> List[str]:
+  """
+  return shell commands which set `settings` in the config file for
+  `service` of datastore `plugin` (replacing any existing lines for
+  those keys).
+  """
+
+  path = shlex.quote(service_config_path(plugin, service))
+  _rel_path, sep = SERVICE_CONFIG_FILES[plugin]
+
+  commands = []
+  for key, value in sorted(settings.items()):
+    if not KEY_REGEX.match(key):
+      raise ValueError(f"invalid setting name '{key}' for {plugin} service '{service}'")
+    pattern = shlex.quote(rf"/^\s*{key}(\s|=)/d")
+    commands.append(f"sed -i -E {pattern} {path}")
+    commands.append(f"echo {shlex.quote(key + sep + value)} >> {path}")
+  return commands
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""
+compute kernel, limit and swap settings for a Dokku host
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Union, cast
+
+PROFILES = ('default', 'high-connection', 'build')
+
+# upper bounds on values which scale with host size
+MAX_SOMAXCONN       = 65535
+MAX_CONNTRACK       = 2097152
+MAX_SWAP_MB         = 8192
+
+# sysctl values are ints, or lists of ints for multi-valued keys (as
+# pyinfra's Sysctl fact reports them, so unchanged keys compare equal)
+SysctlValue = Union[int, str, List[int]]
+
+
+def _clamp(value: int, lower: int, upper: int) -> int:
+  return max(lower, min(upper, value))
+
+
+def compute_swap_mb(profile: str, memory_mb: int) -> int:
+  """
+  return the size (in MB) of the swap file a host with `memory_mb` MB of RAM
+  should have under the given profile.
+
+  Small hosts get proportionally more swap, since it's mostly there to stop
+  builds getting OOM-killed; large hosts get none under the `default` and
+  `high-connection` profiles.
+  """
+
+  if profile == 'build':
+    if memory_mb <= 2048:
+      swap_mb = 2 * memory_mb
+    elif memory_mb <= 8192:
+      swap_mb = memory_mb
+    else:
+      swap_mb = 4096
+  else:
+    if memory_mb <= 2048:
+      swap_mb = memory_mb
+    elif memory_mb <= 8192:
+      swap_mb = memory_mb // 2
+    else:
+      swap_mb = 0
+
+  return min(swap_mb, MAX_SWAP_MB)
+
+
+def compute_tuning(profile: str, cpus: int, memory_mb: int) -> Dict[str, Any]:
+  """
+  return a dict of tuning settings for a host with `cpus` CPUs and
+  `memory_mb` MB of RAM.
+
+  args:
+
+  - profile: one of PROFILES. `high-connection` is for hosts sitting behind
+    a load balancer and handling many concurrent connections; `build`
+    is for (typically small) hosts that mostly build images.
+  - cpus: number of online CPUs
+  - memory_mb: total RAM, in MB
+
+  The returned dict has keys:
+
+  - 'sysctl': dict mapping sysctl keys to values
+  - 'nofile': open-files limit for the docker daemon and dokku user
+  - 'nproc': process limit for the dokku user
+  - 'swap_mb': size of swap file to create (0 means "don't manage swap")
+  - 'thp': transparent hugepage mode ('always', 'madvise' or 'never')
+
+  Raises a ValueError for an unknown profile.
+  """
+
+  if profile not in PROFILES:
+    raise ValueError(f"unknown tuning profile '{profile}', expected one of {PROFILES}")
+
+  cpus      = max(1, cpus)
+  memory_mb = max(1, memory_mb)
+
+  somaxconn = _clamp(1024 * cpus, 4096, MAX_SOMAXCONN)
+  conntrack = _clamp(64 * memory_mb, 65536, MAX_CONNTRACK)
+
+  sysctl: Dict[str, SysctlValue] = {
+    'net.core.somaxconn':                   somaxconn,
+    'net.ipv4.tcp_max_syn_backlog':         somaxconn,
+    'net.core.netdev_max_backlog':          _clamp(1000 * cpus, 1000, 65536),
+    'net.netfilter.nf_conntrack_max':       conntrack,
+    'vm.swappiness':                        10,
+    'fs.inotify.max_user_watches':          524288,
+  }
+
+  nofile = 65536
+  nproc  = _clamp(4096 * cpus, 16384, 262144)
+
+  if profile == 'high-connection':
+    sysctl.update({
+      'net.core.somaxconn':                 MAX_SOMAXCONN,
+      'net.ipv4.tcp_max_syn_backlog':       MAX_SOMAXCONN,
+      'net.ipv4.ip_local_port_range':       [1024, 65535],
+      'net.ipv4.tcp_tw_reuse':              1,
+      'net.ipv4.tcp_fin_timeout':           15,
+      'net.netfilter.nf_conntrack_max':     min(2 * conntrack, MAX_CONNTRACK),
+    })
+    nofile = 1048576
+
+  elif profile == 'build':
+    sysctl.update({
+      'vm.swappiness':                      30,
+      'fs.inotify.max_user_instances':      1024,
+    })
+
+  return {
+    'sysctl':   sysctl,
+    'nofile':   nofile,
+    'nproc':    nproc,
+    'swap_mb':  compute_swap_mb(profile, memory_mb),
+    'thp':      'madvise',
+  }
+
+
+def render_sysctl_conf(settings: Dict[str, SysctlValue]) -> str:
+  """
+  render a dict of sysctl settings as the contents of
+  an `/etc/sysctl.d` drop-in file (keys are sorted, so that output
+  is stable between runs). List values are space-separated.
+  """
+
+  lines = ["# managed by pyinfra-dokku; local changes will be overwritten"]
+  for key in sorted(settings):
+    value = settings[key]
+    if isinstance(value, list):
+      value = " ".join(str(item) for item in value)
+    lines.append(f"{key} = {value}")
+  return "\n".join(lines) + "\n"
+
+
+def parse_thp_mode(inp: Union[str, Sequence[str]]) -> Optional[str]:
+  """
+  parse the contents of `/sys/kernel/mm/transparent_hugepage/enabled`,
+  e.g.
+
+      always [madvise] never
+
+  Will take either a string (str) or list of lines.
+
+  Returns the currently selected mode (the bracketed word), or None if there
+  isn't one.
+  """
+
+  try:
+    lines = cast(str, inp).splitlines()
+  except AttributeError:
+    lines = cast(List[str], inp)
+
+  for line in lines:
+    for word in line.split():
+      if word.startswith('[') and word.endswith(']'):
+        return word[1:-1]
+  return None
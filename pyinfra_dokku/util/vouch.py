@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+render the config for a Vouch (https://github.com/vouch/vouch-proxy) auth
+proxy app, and the nginx config protecting other apps with it
+"""
+
+import shlex
+
+from typing import Dict, Mapping, Optional, Sequence
+
+DEFAULT_VOUCH_IMAGE = 'quay.io/vouch/vouch-proxy:0.39.0'
+
+DEFAULT_VOUCH_PORT = 9090
+
+DEFAULT_COOKIE_NAME = 'VouchCookie'
+
+# http-level nginx config: the upstream and the auth response cache
+VOUCH_NGINX_CONF_PATH = '/etc/nginx/conf.d/vouch.conf'
+
+VOUCH_UPSTREAM = 'vouch_auth'
+VOUCH_CACHE_ZONE = 'vouch_auth_cache'
+VOUCH_CACHE_DIR = '/var/cache/nginx/vouch'
+
+# internal location protected apps send auth subrequests to
+VOUCH_VALIDATE_LOCATION = '/_vouch/validate'
+
+
+def default_cookie_domain(vouch_domain: str) -> str:
+  """
+  the domain Vouch's cookie is set for, by default: the parent of
+  `vouch_domain` (e.g. "example.com" for "vouch.example.com"), so it's
+  sent to sibling apps.
+  """
+
+  parts = vouch_domain.split('.')
+  return '.'.join(parts[1:]) if len(parts) > 2 else vouch_domain
+
+
+# pylint: disable=too-many-arguments
+def vouch_env(vouch_domain: str,
+              oauth: Mapping[str, str],
+              port: int = DEFAULT_VOUCH_PORT,
+              cookie_domains: Optional[Sequence[str]] = None,
+              whitelist: Sequence[str] = (),
+              cookie_name: str = DEFAULT_COOKIE_NAME,
+             ) -> Dict[str, str]:
+  """
+  return the config vars for the Vouch app.
+
+  - oauth: maps OAuth settings to values, e.g. `{"provider": "github",
+    "client_id": "...", "client_secret": "..."}`; each key becomes an
+    `OAUTH_KEY` var (see Vouch's docs for the settings each provider needs)
+  - cookie_domains: domains whose apps may be protected (and for which
+    Vouch sets its cookie); default: `default_cookie_domain(vouch_domain)`
+  - whitelist: if given, only these users (e.g. email addresses) are
+    allowed; otherwise any user the OAuth provider authenticates is
+  """
+
+  env = {
+    'VOUCH_LISTEN': '0.0.0.0',
+    'VOUCH_PORT': str(port),
+    'VOUCH_DOMAINS': ','.join(cookie_domains or [default_cookie_domain(vouch_domain)]),
+    'VOUCH_COOKIE_NAME': cookie_name,
+    'OAUTH_CALLBACK_URL': f"https://{vouch_domain}/auth",
+  }
+  if whitelist:
+    env['VOUCH_WHITELIST'] = ','.join(whitelist)
+  else:
+    env['VOUCH_ALLOWALLUSERS'] = 'true'
+  for key, value in oauth.items():
+    env[f"OAUTH_{key.upper()}"] = str(value)
+  return env
+
+
+def plan_config_set_command(app: str, desired: Mapping[str, str],
+                            current: Mapping[str, str]) -> Optional[str]:
+  """
+  return a `dokku config:set --no-restart` command setting those of
+  `desired` config vars which differ from `current` ones, or None if none
+  do.
+  """
+
+  changed = {key: value for key, value in sorted(desired.items()) if current.get(key) != value}
+  if not changed:
+    return None
+  assignments = " ".join(f"{key}={shlex.quote(value)}" for key, value in changed.items())
+  return f"dokku config:set --no-restart {shlex.quote(app)} {assignments}"
+
+
+def vouch_docker_option(port: int = DEFAULT_VOUCH_PORT) -> str:
+  """
+  docker option publishing Vouch's port on the host's loopback interface,
+  giving nginx a fixed address to keep connections to it open.
+  """
+
+  return f"-p 127.0.0.1:{port}:{port}"
+
+
+def render_vouch_http_conf(port: int = DEFAULT_VOUCH_PORT,
+                           keepalive: int = 16,
+                           cookie_name: str = DEFAULT_COOKIE_NAME) -> str:
+  """
+  return http-level nginx config for Vouch: an upstream keeping up to
+  `keepalive` idle connections to it open, and a small cache for its
+  responses to auth subrequests (see `render_protected_app_conf`).
+  """
+
+  return f"""# generated by pyinfra_dokku; see pyinfra_dokku.vouch
+
+upstream {VOUCH_UPSTREAM} {{
+  server 127.0.0.1:{int(port)};
+  keepalive {int(keepalive)};
+  keepalive_timeout 60s;
+}}
+
+proxy_cache_path {VOUCH_CACHE_DIR} levels=1:2 keys_zone={VOUCH_CACHE_ZONE}:1m
+                 max_size=16m inactive=5m use_temp_path=off;
+
+# requests without a Vouch cookie are never answered from the cache
+map $cookie_{cookie_name} $vouch_no_cookie {{
+  ""      1;
+  default 0;
+}}
+"""
+
+
+def render_protected_app_conf(vouch_domain: str,
+                              cache_seconds: int = 30,
+                              cookie_name: str = DEFAULT_COOKIE_NAME) -> str:
+  """
+  return server-level nginx config (for an app's `nginx.conf.d`) requiring
+  requests to the app to be authenticated by Vouch, redirecting
+  unauthenticated users to Vouch's login page.
+
+  Vouch's successful responses are cached for `cache_seconds` per host and
+  cookie (0 disables caching), so a user's requests within that time don't
+  each wait for a subrequest to Vouch; concurrent cache misses for the same
+  cookie wait for a single subrequest. Connections to Vouch are kept open
+  (see `render_vouch_http_conf`).
+  """
+
+  if cache_seconds > 0:
+    cache = f"""
+    proxy_cache           {VOUCH_CACHE_ZONE};
+    proxy_cache_key       "$http_host$cookie_{cookie_name}";
+    proxy_cache_valid     200 {int(cache_seconds)}s;
+    proxy_cache_lock      on;
+    proxy_cache_bypass    $vouch_no_cookie;
+    proxy_no_cache        $vouch_no_cookie;
+    proxy_ignore_headers  Cache-Control Expires Set-Cookie;
+"""
+  else:
+    cache = ""
+
+  return f"""# generated by pyinfra_dokku; see pyinfra_dokku.vouch
+
+auth_request {VOUCH_VALIDATE_LOCATION};
+auth_request_set $auth_resp_jwt $upstream_http_x_vouch_jwt;
+auth_request_set $auth_resp_err $upstream_http_x_vouch_err;
+auth_request_set $auth_resp_failcount $upstream_http_x_vouch_failcount;
+
+location = {VOUCH_VALIDATE_LOCATION} {{
+    internal;
+    proxy_pass            http://{VOUCH_UPSTREAM}/validate;
+    proxy_http_version    1.1;
+    proxy_set_header      Connection "";
+    proxy_set_header      Host $http_host;
+    proxy_pass_request_body off;
+    proxy_set_header      Content-Length "";
+{cache}}}
+
+error_page 401 = @vouch_login;
+
+location @vouch_login {{
+    return 302 https://{vouch_domain}/login?url=$scheme://$http_host$request_uri&vouch-failcount=$auth_resp_failcount&X-Vouch-Token=$auth_resp_jwt&error=$auth_resp_err;
+}}
+"""
+
+
+def protected_app_conf_path(app: str) -> str:
+  """
+  path of the Vouch nginx config for protected app `app`.
+  """
+
+  return f"/home/dokku/{app}/nginx.conf.d/vouch.conf"
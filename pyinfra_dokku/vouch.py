@@ -0,0 +1,160 @@
+"""
+create and configure a Vouch (https://github.com/vouch/vouch-proxy) auth
+proxy app, and protect other apps with it
+"""
+
+import shlex
+
+from io     import StringIO
+from typing import Mapping, Optional, Sequence
+
+from pyinfra                import config, host
+from pyinfra.api            import deploy
+from pyinfra.operations     import files, server
+
+from .facts                 import AppConfigVars, DokkuReports
+from .util.checks           import plan_checks_commands
+from .util.vouch            import (DEFAULT_COOKIE_NAME, DEFAULT_VOUCH_IMAGE, DEFAULT_VOUCH_PORT,
+                                    VOUCH_CACHE_DIR, VOUCH_NGINX_CONF_PATH,
+                                    plan_config_set_command, protected_app_conf_path,
+                                    render_protected_app_conf, render_vouch_http_conf,
+                                    vouch_docker_option, vouch_env)
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+@deploy("Install Vouch auth proxy")
+def install_vouch(vouch_domain: str,
+                  oauth: Mapping[str, str],
+                  protected_apps: Sequence[str] = (),
+                  cookie_domains: Optional[Sequence[str]] = None,
+                  whitelist: Sequence[str] = (),
+                  app: str = 'vouch',
+                  image: str = DEFAULT_VOUCH_IMAGE,
+                  port: int = DEFAULT_VOUCH_PORT,
+                  cache_seconds: int = 30,
+                  keepalive: int = 16,
+                  cookie_name: str = DEFAULT_COOKIE_NAME,
+                 ):
+  """
+  Create and configure a Vouch app (deployed from Vouch's docker image),
+  and require users of `protected_apps` to log in through it.
+
+  Protected apps' nginx config sends an auth subrequest to Vouch for each
+  request; Vouch's answers are cached by nginx for `cache_seconds` per
+  user, and nginx keeps up to `keepalive` connections to Vouch open, so
+  most requests don't wait on Vouch at all.
+
+  args:
+
+  - vouch_domain: domain the Vouch app is served at, e.g.
+    "vouch.example.com" (its TLS certificate isn't managed here)
+  - oauth: OAuth settings for Vouch, e.g. `{"provider": "github",
+    "client_id": "...", "client_secret": "..."}` (see `vouch_env`)
+  - protected_apps: apps only logged-in users may access
+  - cookie_domains: domains Vouch sets its cookie for (default: the parent
+    of `vouch_domain`); protected apps must be served from these
+  - whitelist: users allowed in (default: anyone the OAuth provider
+    authenticates)
+  - app: name of the Vouch app
+  - image: Vouch docker image to deploy
+  - port: port Vouch listens on; it's published on the host's loopback
+    interface only
+  - cache_seconds: how long successful auth responses are cached (0 to
+    disable caching)
+  - keepalive: idle connections to Vouch nginx keeps open
+  - cookie_name: name of Vouch's cookie
+
+  prereqs:
+
+  - Dokku must be installed, and the protected apps must exist.
+  """
+
+  config.SUDO = True
+  if app in protected_apps:
+    raise ValueError(f"the Vouch app '{app}' can't protect itself")
+
+  env     = vouch_env(vouch_domain, oauth, port, cookie_domains, whitelist, cookie_name)
+  reports = host.get_fact(DokkuReports, ('git', 'domains', 'docker-options', 'checks'))
+  current = host.get_fact(AppConfigVars, tuple(sorted(env)), (app,)).get(app, {})
+
+  quoted_app = shlex.quote(app)
+  app_exists = app in reports.get('git', {})
+  commands = []
+  if not app_exists:
+    commands.append(f"dokku apps:create {quoted_app}")
+
+  config_set = plan_config_set_command(app, env, current)
+  if config_set:
+    commands.append(config_set)
+
+  vhosts = reports.get('domains', {}).get(app, {}).get('domains app vhosts', '')
+  if vhosts.split() != [vouch_domain]:
+    commands.append(f"dokku domains:set {quoted_app} {shlex.quote(vouch_domain)}")
+
+  docker_option = vouch_docker_option(port)
+  options_changed = docker_option not in \
+      reports.get('docker options', {}).get(app, {}).get('docker options deploy', '')
+  if options_changed:
+    commands.append(f"dokku docker-options:add {quoted_app} deploy {shlex.quote(docker_option)}")
+
+  # a new container can't publish the same host port while the old one
+  # runs, so Vouch is restarted in place rather than with checks
+  commands.extend(plan_checks_commands(app, {'disabled': ['_all_']}, {},
+                                       reports.get('checks', {}).get(app, {})))
+
+  if reports.get('git', {}).get(app, {}).get('git source image', '') != image:
+    commands.append(f"dokku git:from-image {quoted_app} {shlex.quote(image)}")
+  elif config_set or options_changed:
+    commands.append(f"dokku ps:restart {quoted_app}")
+
+  if commands:
+    # pylint: disable=unexpected-keyword-arg
+    server.shell(name=f"Create and configure Vouch app {app}",
+                 commands=commands,
+                 _sudo=True,
+                )
+  else:
+    host.noop(f"Vouch app {app} already configured")
+
+  # pylint: disable=unexpected-keyword-arg
+  files.directory(name="Create Vouch auth cache directory",
+                  path=VOUCH_CACHE_DIR,
+                  user='www-data',
+                  group='www-data',
+                  mode='700',
+                  _sudo=True,
+                 )
+  http_conf = files.put(name="Install Vouch nginx config",
+                        src=StringIO(render_vouch_http_conf(port, keepalive, cookie_name)),
+                        dest=VOUCH_NGINX_CONF_PATH,
+                        mode='644',
+                        _sudo=True,
+                       )
+  # pylint: disable=no-member
+  nginx_changed = http_conf.changed
+
+  app_conf = render_protected_app_conf(vouch_domain, cache_seconds, cookie_name)
+  for protected in protected_apps:
+    conf_path = protected_app_conf_path(protected)
+    files.directory(name=f"Create nginx.conf.d for app {protected}",
+                    path=conf_path.rsplit('/', 1)[0],
+                    user='dokku',
+                    group='dokku',
+                    mode='755',
+                    _sudo=True,
+                   )
+    put = files.put(name=f"Protect app {protected} with Vouch",
+                    src=StringIO(app_conf),
+                    dest=conf_path,
+                    user='dokku',
+                    group='dokku',
+                    mode='644',
+                    _sudo=True,
+                   )
+    nginx_changed = nginx_changed or put.changed
+
+  if nginx_changed:
+    server.shell(name="Reload nginx",
+                 commands=["nginx -t && systemctl reload nginx"],
+                 _sudo=True,
+                )
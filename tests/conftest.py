@@ -14,6 +14,7 @@ import pytest
 # pylint: disable=abstract-class-instantiated
 from filelock import FileLock
 
+from timing import SESSION_TIMINGS, summarize_timings, write_timings
 from utils import verbose_run, log_command_output
 
 ###
@@ -39,6 +40,12 @@ def pytest_addoption(parser):
     help="docker image with Dokku installed to use for tests"
   )
 
+  parser.addoption(
+    "--acme-test-server-image", action="store",
+    default="ghcr.io/letsencrypt/pebble:latest",
+    help="docker image of an ACME test server to use in place of Let's Encrypt"
+  )
+
   ###
   # whether to tear down vagrant boxes
 
@@ -48,6 +55,15 @@ def pytest_addoption(parser):
     help="whether to tear down (destroy) vagrant boxes"
   )
 
+  ###
+  # where to write pyinfra timings
+
+  parser.addoption(
+    "--deploy-timings", action="store",
+    default="deploy-timings.json",
+    help="file to write per-test pyinfra operation timings to (as JSON)"
+  )
+
 
 ###
 # fixtures
@@ -128,6 +144,47 @@ def docker_container(request):
     verbose_run(["bash", "-c", cmd], check=True)
     logging.info(f"killed ctr id {ctr_id}")
 
+@pytest.fixture
+def acme_test_server(request):
+  """
+  Spins up a local ACME test server (pebble, by default) in a docker
+  container, which can stand in for Let's Encrypt.
+
+  Challenge validation is switched off (`PEBBLE_VA_ALWAYS_VALID`), so
+  hosts under test needn't be reachable from the server.
+
+  Yields: an object containing information on the server.
+
+  - Its `.id` attribute is the container ID.
+  - Its `.directory_url` attribute is the URL of the ACME directory.
+
+  The container is stopped after use unless `--keep-containers` was passed
+  to pytest.
+  """
+
+  image_to_use = request.config.getoption("--acme-test-server-image")
+
+  logging.info(f"creating ACME test server from image: {image_to_use}")
+
+  cmd  = f"docker -D run --rm -d -e PEBBLE_VA_ALWAYS_VALID=1 {image_to_use}"
+  res = verbose_run(["bash", "-c", cmd], capture_output=True, check=True, encoding="utf8")
+  ctr_id = res.stdout.strip()
+
+  cmd  = f"docker inspect -f '{{{{range .NetworkSettings.Networks}}}}{{{{.IPAddress}}}}{{{{end}}}}' {ctr_id}"
+  res = verbose_run(["bash", "-c", cmd], capture_output=True, check=True, encoding="utf8")
+  ip_address = res.stdout.strip()
+
+  server = SimpleNamespace(id=ctr_id, directory_url=f"https://{ip_address}:14000/dir")
+
+  yield server
+
+  if request.config.getoption("--keep-containers"):
+    logging.info("--keep-containers passed, not bothering to stop ACME test server")
+  else:
+    cmd = f"docker -D stop -t 0 {ctr_id}"
+    verbose_run(["bash", "-c", cmd], check=True)
+    logging.info(f"killed ACME test server ctr id {ctr_id}")
+
 @pytest.fixture
 def vagrant_box(request):
   """
@@ -210,3 +267,18 @@ def vagrant_box(request):
       logging.info("destroyed vagrant box")
 
 
+###
+# pyinfra timing report
+
+def pytest_sessionfinish(session):
+  if SESSION_TIMINGS:
+    write_timings(session.config.getoption("--deploy-timings"), SESSION_TIMINGS)
+
+
+def pytest_terminal_summary(terminalreporter, config):
+  if not SESSION_TIMINGS:
+    return
+  terminalreporter.section("pyinfra deploy timings")
+  for line in summarize_timings(SESSION_TIMINGS):
+    terminalreporter.write_line(line)
+  terminalreporter.write_line(f"(details in {config.getoption('--deploy-timings')})")
@@ -0,0 +1,19 @@
+
+"""
+install the LetsEncrypt plugin, and issue certificates for the apps
+given in the `letsencrypt_apps` data, in the form
+"app1=domain1,domain2;app2=domain3".
+"""
+
+from pyinfra import host
+
+import pyinfra_dokku.certificates as dc
+import pyinfra_dokku.install as di
+
+apps = {}
+for entry in host.data.get("letsencrypt_apps").split(";"):
+  app, domains = entry.split("=", 1)
+  apps[app] = domains.split(",")
+
+di.install_letsencrypt_plugin()
+dc.enable_letsencrypt(apps, concurrency=2)
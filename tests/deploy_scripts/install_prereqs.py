@@ -0,0 +1,7 @@
+"""
+install Dokku's prerequisites (docker etc.) only.
+"""
+
+import pyinfra_dokku.install as di
+
+di.install_dokku_prerequisites()
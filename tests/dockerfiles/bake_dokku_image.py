@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+"""
+Bake a docker image with Dokku installed, by running this package's
+deploys against a container (with systemd as init) started from a base
+image, and committing the result
+
+Command-line args: IMAGE_IN IMAGE_OUT (run with `--help` for options)
+
+The bake happens in stages, each run in a fresh container started from
+the previous stage's image and committed as a checkpoint image:
+
+- prereqs: `tests/deploy_scripts/install_prereqs.py`, committed as
+  IMAGE_OUT with "-prereqs" appended to its tag
+- dokku: `tests/deploy_scripts/install.py`, committed as IMAGE_OUT
+
+`--from-stage dokku` rebuilds only the later stage, from an existing
+prereqs checkpoint.
+
+A host-side directory (`--apt-cache-dir`) is bind-mounted as each
+container's apt archive cache, and containers are told to keep the
+packages they download there, so rebuilds needn't download docker.io,
+dokku etc. again. (Bind mounts aren't part of committed images, so the
+images don't grow.)
+
+Rather than sleeping for a fixed time after starting a container, we
+wait until `systemctl is-system-running` reports systemd has finished
+starting up.
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing  import Callable, List, NamedTuple, Optional
+
+DEFAULT_APT_CACHE_DIR = ".apt-cache"
+
+DEFAULT_FQDN = "localhost.lan"
+
+DEPLOY_SCRIPTS = Path(__file__).resolve().parent.parent / "deploy_scripts"
+
+DOCKER_RUN_ARGS = ["--privileged", "--cap-add", "SYS_ADMIN",
+                   "-v", "/sys/fs/cgroup:/sys/fs/cgroup:ro", "--rm", "-d"]
+
+PYINFRA_ARGS = ["-vv", "--debug"]
+
+# states `systemctl is-system-running` reports once startup has finished
+# ("degraded" just means some unit failed, which is common in containers)
+SYSTEMD_READY_STATES = ("running", "degraded")
+
+APT_ARCHIVES = "/var/cache/apt/archives"
+
+# ubuntu docker images delete downloaded packages after each install
+DOCKER_CLEAN_CONF = "/etc/apt/apt.conf.d/docker-clean"
+KEEP_DEBS_CONF = "/etc/apt/apt.conf.d/99-bake-keep-downloaded-packages"
+
+
+class BakeError(Exception):
+  pass
+
+
+class Stage(NamedTuple):
+  name: str
+  deploy_script: Path
+  image_in: str
+  image_out: str
+
+
+def verbose_run(cmd, **kwargs):
+  print("running: ", cmd, file=sys.stderr)
+  sys.stderr.flush()
+  sys.stdout.flush()
+  # pylint: disable=subprocess-run-check
+  return subprocess.run(cmd, **kwargs)
+
+
+def checkpoint_tag(image: str, stage: str) -> str:
+  """
+  tag for the checkpoint image of `stage`, a variant of `image`:
+  "phlummox/focal-dokku:0.1.0" -> "phlummox/focal-dokku:0.1.0-prereqs".
+  """
+
+  if ":" in image.rsplit("/", 1)[-1]:
+    return f"{image}-{stage}"
+  return f"{image}:{stage}"
+
+
+def plan_stages(image_in: str, image_out: str, from_stage: str = "prereqs") -> List[Stage]:
+  """
+  the stages needed to bake `image_out` from `image_in`, starting at
+  `from_stage` (whose input is the previous stage's checkpoint).
+  """
+
+  names_scripts = [
+    ("prereqs", DEPLOY_SCRIPTS / "install_prereqs.py"),
+    ("dokku",   DEPLOY_SCRIPTS / "install.py"),
+  ]
+  names = [name for name, _script in names_scripts]
+  if from_stage not in names:
+    raise BakeError(f"unknown stage {from_stage!r}, expected one of {names}")
+
+  stages = []
+  previous = image_in
+  for i, (name, script) in enumerate(names_scripts):
+    out = image_out if i == len(names_scripts) - 1 else checkpoint_tag(image_out, name)
+    stages.append(Stage(name, script, previous, out))
+    previous = out
+  return stages[names.index(from_stage):]
+
+
+def wait_for_systemd(ctr: str, timeout: float = 60.0, interval: float = 0.25,
+                     clock: Callable[[], float] = time.monotonic) -> str:
+  """
+  poll container `ctr` until systemd reports it has finished starting up,
+  and return its state; raise BakeError if that doesn't happen within
+  `timeout` seconds (or the container stops).
+  """
+
+  deadline = clock() + timeout
+  state = "unknown"
+  while True:
+    # pylint: disable=subprocess-run-check
+    res = subprocess.run(["docker", "exec", ctr, "systemctl", "is-system-running"],
+                         capture_output=True, encoding="utf8")
+    state = res.stdout.strip() or state
+    if state in SYSTEMD_READY_STATES:
+      return state
+
+    running = subprocess.run(["docker", "container", "inspect", "-f", "{{.State.Running}}", ctr],
+                             capture_output=True, encoding="utf8")
+    if running.stdout.strip() != "true":
+      raise BakeError(f"container {ctr} stopped while waiting for systemd")
+    if clock() >= deadline:
+      raise BakeError(f"systemd in container {ctr} not ready after {timeout}s (state: {state})")
+    time.sleep(interval)
+
+
+def docker_exec(ctr: str, script: str):
+  verbose_run(["docker", "exec", ctr, "bash", "-c", script], check=True)
+
+
+def keep_downloaded_packages(ctr: str, keep: bool):
+  """
+  make apt in `ctr` keep the packages it downloads (in the bind-mounted
+  cache), or restore the image's usual behaviour before committing.
+  """
+
+  if keep:
+    docker_exec(ctr, f"if [ -f {DOCKER_CLEAN_CONF} ]; then "
+                     f"mv {DOCKER_CLEAN_CONF} {DOCKER_CLEAN_CONF}.baking; fi; "
+                     f"echo 'APT::Keep-Downloaded-Packages \"true\";' > {KEEP_DEBS_CONF}")
+  else:
+    docker_exec(ctr, f"rm -f {KEEP_DEBS_CONF}; "
+                     f"if [ -f {DOCKER_CLEAN_CONF}.baking ]; then "
+                     f"mv {DOCKER_CLEAN_CONF}.baking {DOCKER_CLEAN_CONF}; fi")
+
+
+def run_stage(stage: Stage, apt_cache_dir: Path, fqdn: str, systemd_timeout: float) -> float:
+  """
+  run one stage, committing its image; return the time taken.
+  """
+
+  start = time.monotonic()
+  print(f"=== stage {stage.name}: {stage.image_in} -> {stage.image_out}", file=sys.stderr)
+
+  res = verbose_run(["docker", "run", *DOCKER_RUN_ARGS,
+                     "-v", f"{apt_cache_dir.resolve()}:{APT_ARCHIVES}", stage.image_in],
+                    capture_output=True, check=True, encoding="utf8")
+  ctr = res.stdout.strip()
+
+  try:
+    state = wait_for_systemd(ctr, systemd_timeout)
+    print(f"systemd {state} after {time.monotonic() - start:.1f}s", file=sys.stderr)
+
+    keep_downloaded_packages(ctr, True)
+    verbose_run(["pyinfra", *PYINFRA_ARGS, "--data", f"fqdn={fqdn}",
+                 f"@docker/{ctr}", str(stage.deploy_script)], check=True)
+    keep_downloaded_packages(ctr, False)
+
+    verbose_run(["docker", "commit", ctr, stage.image_out], check=True)
+  finally:
+    verbose_run(["docker", "stop", "-t", "0", ctr], check=False)
+
+  return time.monotonic() - start
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+  parser = argparse.ArgumentParser(description="bake a docker image with Dokku installed")
+  parser.add_argument("image_in", help="base image (with systemd as init)")
+  parser.add_argument("image_out", help="image to create")
+  parser.add_argument("--from-stage", default="prereqs", choices=["prereqs", "dokku"],
+                      help="stage to start from; later stages start from the previous "
+                           "stage's checkpoint image (default: %(default)s)")
+  parser.add_argument("--apt-cache-dir", type=Path,
+                      default=Path(os.environ.get("APT_CACHE_DIR", DEFAULT_APT_CACHE_DIR)),
+                      help="host directory to cache apt packages in "
+                           "(default: $APT_CACHE_DIR or %(default)s)")
+  parser.add_argument("--fqdn", default=DEFAULT_FQDN,
+                      help="fqdn to configure Dokku with (default: %(default)s)")
+  parser.add_argument("--systemd-timeout", type=float, default=60.0,
+                      help="seconds to wait for systemd to start (default: %(default)s)")
+  args = parser.parse_args(argv)
+
+  args.apt_cache_dir.mkdir(parents=True, exist_ok=True)
+
+  timings = []
+  try:
+    for stage in plan_stages(args.image_in, args.image_out, args.from_stage):
+      timings.append((stage, run_stage(stage, args.apt_cache_dir, args.fqdn,
+                                       args.systemd_timeout)))
+  except (BakeError, subprocess.CalledProcessError) as ex:
+    print(f"bake failed: {ex}", file=sys.stderr)
+    return 1
+  finally:
+    for stage, seconds in timings:
+      print(f"{seconds:8.1f}s  {stage.name:<8}  {stage.image_out}", file=sys.stderr)
+
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,116 +1,336 @@
 #!/usr/bin/env python3
 
 """
-Build docker images
+Build docker images, skipping those whose build context hasn't changed
 
 Expected to have following env vars:
 
-IMAGE_NAME
 IMAGE_VERSION
-GH_IMAGE_ID
-REPO_OWNER
+
+And optionally:
+
+IMAGE_NAME    (default: taken from the dockerfile name, e.g.
+              "focal-base" for "focal-base-Dockerfile")
+GH_IMAGE_ID   (image to build, without tag; only if one dockerfile
+              is given. Otherwise IMAGE_REPO/IMAGE_NAME is used.)
+IMAGE_REPO    (default: REPO_OWNER)
+REPO_OWNER    (default: phlummox)
 
 And a bunch of org.opencontainers.image metadata
 assignments in a file "oc_labels".
 
-1 command-line arg: dockerfile.
-
-Will its parent directory as working directory.
+Command-line args: one or more dockerfiles, built concurrently
+using BuildKit (`docker buildx`). Each uses its parent directory
+as build context. Run with `--help` for options.
 
+A hash of each dockerfile and its build context is stored in the
+image's CONTEXT_HASH_LABEL label; if an image with the same hash is
+available locally or can be pulled, it isn't rebuilt. BuildKit's
+layer cache is exported to and imported from a local directory
+(`--cache-dir`), which CI can persist between runs.
 """
 
 # pylint: disable=missing-class-docstring,missing-function-docstring
 
+import argparse
+import fnmatch
+import hashlib
 import os
 import os.path
+import shutil
 import subprocess
 import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib            import Path
+from typing             import Dict, List, NamedTuple, Optional
+
+CONTEXT_HASH_LABEL = "io.github.phlummox.pyinfra-dokku.context-hash"
+
+BUILDER_NAME = "pyinfra-dokku-builder"
+
+DEFAULT_CACHE_DIR = ".buildx-cache"
+
+# never part of a build context, as far as we're concerned
+ALWAYS_IGNORED = ["__pycache__", "*.pyc"]
+
+_print_lock = threading.Lock()
+
+
+class ImageBuild(NamedTuple):
+  dockerfile: Path
+  name: str
+  image_id: str
+  version: str
+
+  @property
+  def tag(self) -> str:
+    return f"{self.image_id}:{self.version}"
+
+  @property
+  def context(self) -> Path:
+    return self.dockerfile.parent
+
+
+class BuildResult(NamedTuple):
+  build: ImageBuild
+  status: str       # 'built', 'up to date' or 'failed'
+  seconds: float
+
+
+def log(*args):
+  with _print_lock:
+    print(*args, file=sys.stderr)
+    sys.stderr.flush()
 
-from pathlib import Path
-
-args = sys.argv[1:]
-
-if len(args) != 1:
-  print("expected 1 arg, dockerfile")
-  sys.exit(1)
-
-dockerfile = args[0]
-build_dir  = Path(dockerfile).parent
-
-# pylint: disable=invalid-name
-try:
-  repo_owner = os.environ["REPO_OWNER"]
-except KeyError:
-  repo_owner = "phlummox"
-
-image_name  = os.environ["IMAGE_NAME"]
-version     = os.environ["IMAGE_VERSION"]
-gh_image_id = os.environ["GH_IMAGE_ID"]
-
-# org.opencontainers.image metadata
-oc_labels = {}
-
-if os.path.isfile("oc_labels"):
-  with open("oc_labels", encoding="utf8") as infile:
-    for line in infile.readlines():
-      k, v = line.strip().split(sep="=", maxsplit=1)
-      oc_labels[k] = v
-else:
-  print("WARNING: no oc_labels file found, image will be missing some labels",
-        file=sys.stderr
-       )
-
-if oc_labels:
-  # override version
-  oc_labels["org.opencontainers.image.version"] = version
-
-  # org.label-schema metadata
-  ls_labels = { "org.label-schema.schema-version":  "1.0",
-                "org.label-schema.build-date":      oc_labels["org.opencontainers.image.created"],
-                "org.label-schema.name":            f"{repo_owner}/{image_name}",
-                "org.label-schema.description":     oc_labels["org.opencontainers.image.description"],
-                "org.label-schema.vcs-url":         oc_labels["org.opencontainers.image.url"],
-                "org.label-schema.vcs-ref":         oc_labels["org.opencontainers.image.revision"],
-                "org.label-schema.version":         version }
-else:
-  ls_labels = {}
 
 def verbose_run(cmd, **kwargs):
-  print("running: ", cmd, file=sys.stderr)
-  sys.stderr.flush()
+  log("running: ", cmd)
   sys.stdout.flush()
   # pylint: disable=subprocess-run-check
-  subprocess.run(cmd, **kwargs)
+  return subprocess.run(cmd, **kwargs)
+
+
+def image_name_for(dockerfile: Path) -> str:
+  """
+  name of the image a dockerfile builds: "focal-base-Dockerfile" ->
+  "focal-base", "Dockerfile.focal-base" -> "focal-base", and a plain
+  "Dockerfile" is named after its directory.
+  """
+
+  name = dockerfile.name
+  if name.endswith("-Dockerfile"):
+    return name[:-len("-Dockerfile")]
+  if name.startswith("Dockerfile."):
+    return name[len("Dockerfile."):]
+  return dockerfile.resolve().parent.name
+
+
+def read_ignore_patterns(context: Path) -> List[str]:
+  """
+  patterns from the context's .dockerignore (if any), plus ALWAYS_IGNORED.
+  Exception ("!") patterns aren't supported, and are skipped.
+  """
+
+  patterns = list(ALWAYS_IGNORED)
+  ignore_file = context / ".dockerignore"
+  if ignore_file.is_file():
+    for line in ignore_file.read_text(encoding="utf8").splitlines():
+      line = line.strip()
+      if line and not line.startswith(("#", "!")):
+        patterns.append(line.strip("/"))
+  return patterns
+
+
+def _is_ignored(rel_path: str, patterns: List[str]) -> bool:
+  parts = rel_path.split("/")
+  prefixes = ["/".join(parts[:i]) for i in range(1, len(parts) + 1)]
+  return any(fnmatch.fnmatchcase(prefix, pattern) or fnmatch.fnmatchcase(part, pattern)
+             for pattern in patterns
+             for prefix, part in zip(prefixes, parts))
+
+
+def context_hash(dockerfile: Path, build_args: Optional[Dict[str, str]] = None) -> str:
+  """
+  hash of everything that determines the image built from `dockerfile`:
+  its contents, the path, mode and contents of each file in its build
+  context (apart from ignored ones), and any build args. Labels like the
+  build date are deliberately not included.
+  """
+
+  context = dockerfile.parent
+  patterns = read_ignore_patterns(context)
+  digest = hashlib.sha256()
+  digest.update(b"dockerfile\0" + dockerfile.read_bytes() + b"\0")
+  for key, val in sorted((build_args or {}).items()):
+    digest.update(f"arg\0{key}={val}\0".encode("utf8"))
+
+  for path in sorted(context.rglob("*")):
+    rel_path = path.relative_to(context).as_posix()
+    if path.is_dir() or _is_ignored(rel_path, patterns):
+      continue
+    executable = "x" if os.access(path, os.X_OK) else "-"
+    digest.update(f"file\0{rel_path}\0{executable}\0".encode("utf8"))
+    digest.update(path.read_bytes() + b"\0")
+  return digest.hexdigest()
+
+
+def image_context_hash(tag: str) -> Optional[str]:
+  """
+  the CONTEXT_HASH_LABEL label of local image `tag`, or None if there's
+  no such image or label.
+  """
+
+  # pylint: disable=subprocess-run-check
+  res = subprocess.run(
+    ["docker", "image", "inspect", "--format",
+     f'{{{{ index .Config.Labels "{CONTEXT_HASH_LABEL}" }}}}', tag],
+    capture_output=True, encoding="utf8"
+  )
+  value = res.stdout.strip()
+  if res.returncode != 0 or not value or value == "<no value>":
+    return None
+  return value
+
+
+def ensure_builder():
+  """
+  create (if need be) a BuildKit builder using the docker-container driver,
+  which (unlike the default driver) can export cache to a local directory.
+  """
+
+  res = subprocess.run(["docker", "buildx", "inspect", BUILDER_NAME],
+                       capture_output=True, check=False)
+  if res.returncode != 0:
+    verbose_run(["docker", "buildx", "create", "--name", BUILDER_NAME,
+                 "--driver", "docker-container"], check=True)
+
+
+def read_oc_labels(path: str = "oc_labels") -> Dict[str, str]:
+  oc_labels = {}
+  if os.path.isfile(path):
+    with open(path, encoding="utf8") as infile:
+      for line in infile.readlines():
+        k, v = line.strip().split(sep="=", maxsplit=1)
+        oc_labels[k] = v
+  else:
+    log("WARNING: no oc_labels file found, image will be missing some labels")
+  return oc_labels
+
+
+def image_labels(build: ImageBuild, oc_labels: Dict[str, str], repo_owner: str,
+                 hash_value: str) -> Dict[str, str]:
+  labels = {}
+  if oc_labels:
+    labels.update(oc_labels)
+    # override version
+    labels["org.opencontainers.image.version"] = build.version
+
+    # org.label-schema metadata
+    labels.update({
+      "org.label-schema.schema-version":  "1.0",
+      "org.label-schema.build-date":      oc_labels["org.opencontainers.image.created"],
+      "org.label-schema.name":            f"{repo_owner}/{build.name}",
+      "org.label-schema.description":     oc_labels["org.opencontainers.image.description"],
+      "org.label-schema.vcs-url":         oc_labels["org.opencontainers.image.url"],
+      "org.label-schema.vcs-ref":         oc_labels["org.opencontainers.image.revision"],
+      "org.label-schema.version":         build.version,
+    })
+  labels[CONTEXT_HASH_LABEL] = hash_value
+  return labels
+
+
+def build_command(build: ImageBuild, labels: Dict[str, str], cache_dir: Path) -> List[str]:
+  """
+  `docker buildx build` command for `build`: imports cache from the
+  image's version and latest tags (and `cache_dir/NAME`, if present),
+  exports it to `cache_dir/NAME-new`, and loads the result into docker.
+  """
+
+  cmd = ["docker", "buildx", "build", "--builder", BUILDER_NAME,
+         "--pull", "--load", "--progress=plain",
+         "-f", str(build.dockerfile),
+         "--cache-from", f"type=registry,ref={build.tag}",
+         "--cache-from", f"type=registry,ref={build.image_id}:latest",
+         "--cache-to", f"type=local,dest={cache_dir / build.name}-new,mode=max",
+         "-t", build.tag]
+  if (cache_dir / build.name).is_dir():
+    cmd += ["--cache-from", f"type=local,src={cache_dir / build.name}"]
+
+  # build up --label args
+  for k, val in labels.items():
+    cmd += ["--label", f"{k}={val}"]
+
+  cmd += [str(build.context)]
+  return cmd
+
+
+def _run_prefixed(cmd: List[str], prefix: str) -> int:
+  log("running: ", cmd)
+  with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+    for line in proc.stdout: # type: ignore
+      log(f"{prefix}| " + str(line, "utf-8", errors="replace").rstrip())
+  return proc.returncode
+
+
+def build_image(build: ImageBuild, oc_labels: Dict[str, str], repo_owner: str,
+                cache_dir: Path, force: bool = False) -> BuildResult:
+  """
+  build one image, unless (and `force` is false) an image with the same
+  context hash is already present or can be pulled.
+  """
+
+  start = time.monotonic()
+  hash_value = context_hash(build.dockerfile)
+
+  if not force:
+    if image_context_hash(build.tag) != hash_value:
+      verbose_run(["docker", "pull", "--quiet", build.tag], check=False, capture_output=True)
+    if image_context_hash(build.tag) == hash_value:
+      log(f"{build.name}: {build.tag} is up to date (context hash {hash_value[:12]})")
+      return BuildResult(build, "up to date", time.monotonic() - start)
+
+  labels = image_labels(build, oc_labels, repo_owner, hash_value)
+  exit_code = _run_prefixed(build_command(build, labels, cache_dir), build.name)
+  if exit_code != 0:
+    return BuildResult(build, "failed", time.monotonic() - start)
+
+  # replace the old cache, so it doesn't grow without bound
+  old_cache, new_cache = cache_dir / build.name, cache_dir / f"{build.name}-new"
+  if new_cache.is_dir():
+    shutil.rmtree(old_cache, ignore_errors=True)
+    new_cache.rename(old_cache)
+  return BuildResult(build, "built", time.monotonic() - start)
+
+
+def format_report(results: List[BuildResult]) -> str:
+  return "\n".join(
+    f"{result.seconds:8.1f}s  {result.status:<10}  {result.build.tag}"
+    for result in results
+  )
 
-# pull existing images if there
 
-cmd = ["docker", "pull", f"{gh_image_id}:{version}"]
-verbose_run(cmd, check=False)
-cmd = ["docker", "pull", f"{gh_image_id}:latest"]
-verbose_run(cmd, check=False)
+def main(argv: Optional[List[str]] = None) -> int:
+  parser = argparse.ArgumentParser(description="build docker images used for tests")
+  parser.add_argument("dockerfiles", nargs="+", type=Path)
+  parser.add_argument("--jobs", "-j", type=int, default=4,
+                      help="how many images to build at once (default: %(default)s)")
+  parser.add_argument("--cache-dir", type=Path,
+                      default=Path(os.environ.get("BUILD_CACHE_DIR", DEFAULT_CACHE_DIR)),
+                      help="BuildKit cache directory (default: $BUILD_CACHE_DIR or %(default)s)")
+  parser.add_argument("--force", action="store_true",
+                      help="build even if the context hash hasn't changed")
+  args = parser.parse_args(argv)
 
-## builder image
-#cmd = f"""docker build --pull -f Dockerfile --target build
-#  --cache-from {gh_image_id}:{version}-builder
-#  -t {gh_image_id}:{version}-builder .""".split()
-#
-#verbose_run(cmd, check=True)
+  repo_owner  = os.environ.get("REPO_OWNER", "phlummox")
+  image_repo  = os.environ.get("IMAGE_REPO", repo_owner)
+  version     = os.environ["IMAGE_VERSION"]
 
-# main image
-cmd = f"""docker build --pull -f {dockerfile}
-  --cache-from {gh_image_id}:{version}-builder
-  --cache-from {gh_image_id}:latest
-  --cache-from {gh_image_id}:{version}
-  -t {gh_image_id}:{version}""".split()
+  builds = []
+  for dockerfile in args.dockerfiles:
+    if len(args.dockerfiles) == 1:
+      name = os.environ.get("IMAGE_NAME") or image_name_for(dockerfile)
+      image_id = os.environ.get("GH_IMAGE_ID") or f"{image_repo}/{name}"
+    else:
+      name = image_name_for(dockerfile)
+      image_id = f"{image_repo}/{name}"
+    builds.append(ImageBuild(dockerfile, name, image_id, version))
 
-# build up --label args
-for k, val in oc_labels.items():
-  cmd += ["--label", f"{k}={val}"]
+  oc_labels = read_oc_labels()
+  args.cache_dir.mkdir(parents=True, exist_ok=True)
+  ensure_builder()
 
-for k, val in ls_labels.items():
-  cmd += ["--label", f"{k}={val}"]
+  with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+    results = list(executor.map(
+      lambda build: build_image(build, oc_labels, repo_owner, args.cache_dir, args.force),
+      builds
+    ))
 
-cmd += [str(build_dir)]
+  log("build times:\n" + format_report(results))
+  return 1 if any(result.status == "failed" for result in results) else 0
 
-verbose_run(cmd, check=True)
 
+if __name__ == "__main__":
+  sys.exit(main())
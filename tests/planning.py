@@ -0,0 +1,77 @@
+"""
+plan pyinfra deploys against canned fact values, without connecting to or
+changing any host, and return the commands they would run
+
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+from typing       import Any, Callable, List, Mapping, Optional, Tuple
+
+import pyinfra.api.facts
+
+from pyinfra.api           import Config, Inventory, State
+from pyinfra.api.command   import FileUploadCommand, FunctionCommand, StringCommand
+from pyinfra.api.connect   import connect_all
+from pyinfra.api.deploy    import add_deploy
+from pyinfra.context       import ctx_config, ctx_inventory
+
+
+def fake_get_fact(facts: Mapping[type, Any]):
+  """
+  return a replacement for `pyinfra.api.facts.get_fact` which answers with
+  `facts[FactClass]` (whatever the fact's arguments), or the fact's
+  default, instead of running anything. Facts created with
+  `host.create_fact` are still returned from pyinfra's per-host cache.
+  """
+
+  # pylint: disable=too-many-arguments,unused-argument
+  def get_fact(state, host, cls, args=None, kwargs=None, ensure_hosts=None,
+               apply_failed_hosts=True, fact_hash=None, use_cache=True):
+    if use_cache and fact_hash and fact_hash in host.facts:
+      return host.facts[fact_hash]
+    data = facts[cls] if cls in facts else cls.default()
+    if fact_hash:
+      host.facts[fact_hash] = data
+    return data
+
+  return get_fact
+
+
+def command_text(command) -> str:
+  if isinstance(command, StringCommand):
+    return command.get_raw_value()
+  if isinstance(command, FileUploadCommand):
+    src = command.src.getvalue() if hasattr(command.src, 'getvalue') else command.src
+    return f"upload {command.dest}:\n{src}"
+  if isinstance(command, FunctionCommand):
+    return f"call {command.function.__name__}"
+  return str(command)
+
+
+def plan_deploy(monkeypatch, deploy_func: Callable[..., Any], facts: Mapping[type, Any],
+                *args, data: Optional[Mapping[str, Any]] = None,
+                **kwargs) -> Tuple[State, List[Tuple[str, List[str]]]]:
+  """
+  plan `deploy_func(*args, **kwargs)` for a single local host, answering
+  fact reads from `facts` (see `fake_get_fact`), and return the pyinfra
+  state and a list of (operation name, commands) pairs, in order.
+  Nothing is executed.
+  """
+
+  monkeypatch.setattr(pyinfra.api.facts, "get_fact", fake_get_fact(facts))
+  inventory = Inventory(([("@local", dict(data or {}))], {}))
+  state = State(inventory, Config())
+  connect_all(state)
+  with ctx_config.use(state.config), ctx_inventory.use(inventory):
+    add_deploy(state, deploy_func, *args, **kwargs)
+
+  host = inventory.get_host("@local")
+  ops = []
+  for op_hash in state.get_op_order():
+    if op_hash not in state.ops[host]:
+      continue
+    # drop the "Deploy name | " prefix
+    name = ", ".join(name.split(" | ")[-1] for name in state.get_op_meta(op_hash)["names"])
+    ops.append((name, [command_text(command) for command in state.get_op_data(host, op_hash)["commands"]]))
+  return state, ops
@@ -0,0 +1,27 @@
+
+"""
+test pyinfra_dokku.util.arch module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra_dokku.facts import DpkgArchitecture
+from pyinfra_dokku.util import arch
+
+class TestArch:
+
+  def test_check_architecture(self):
+    arch.check_architecture('amd64')
+    arch.check_architecture('arm64')
+    with pytest.raises(ValueError, match="unsupported architecture 'armhf'"):
+      arch.check_architecture('armhf')
+
+  def test_ubuntu_archive_url(self):
+    assert arch.ubuntu_archive_url('amd64') == 'http://archive.ubuntu.com/ubuntu'
+    assert arch.ubuntu_archive_url('arm64') == 'http://ports.ubuntu.com/ubuntu-ports'
+
+  def test_dpkg_architecture_fact(self):
+    assert DpkgArchitecture().process(["arm64\n"]) == 'arm64'
+    assert DpkgArchitecture().process([]) is None
@@ -0,0 +1,86 @@
+
+"""
+test pyinfra_dokku.util.backup module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import os
+import subprocess
+import tarfile
+
+import pytest
+
+from pyinfra_dokku.util import backup
+
+class TestBackup:
+
+  def test_parse_storage_mounts(self):
+    reports = {
+      'node-js-app': {'storage deploy mounts': '-v /var/lib/dokku/data/storage/node-js-app:/app/storage -v uploads:/app/uploads'},
+      'other-app': {'storage deploy mounts': ''},
+    }
+    assert backup.parse_storage_mounts(reports) == [
+      '/var/lib/docker/volumes/uploads/_data',
+      '/var/lib/dokku/data/storage/node-js-app',
+    ]
+
+  def test_ssh_target(self):
+    sink = backup.render_sink_function("backup@store.example.com:/srv/backups")
+    assert "ssh -o BatchMode=yes backup@store.example.com" in sink
+
+  def test_bad_target_rejected(self):
+    with pytest.raises(ValueError):
+      backup.render_sink_function("relative/dir")
+
+  def test_bad_bandwidth_rejected(self):
+    with pytest.raises(ValueError):
+      backup.render_backup_script("/backups", ["/home/dokku"], bandwidth_limit="fast")
+
+  def test_backup_script_to_local_dir(self, tmp_path):
+    # fake `zstd` (no compression) and `dokku` (one postgres service)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "zstd").write_text("#!/usr/bin/env bash\ncat\n")
+    (bin_dir / "dokku").write_text("""#!/usr/bin/env bash
+case "$2$1" in
+  postgres:list--quiet) echo db1 ;;
+esac
+if [ "$1" = postgres:export ]; then
+  echo "dump of $2"
+fi
+""")
+    for fake in bin_dir.iterdir():
+      fake.chmod(0o755)
+
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "unchanged").write_text("old")
+    (data_dir / "cache").mkdir()
+    (data_dir / "cache" / "big").write_text("regenerable")
+
+    target = tmp_path / "backups"
+    script = backup.render_backup_script(str(target), [str(data_dir)],
+                                         excludes=["*/data/cache"],
+                                         state_dir=str(tmp_path / "state"))
+    env = dict(os.environ, PATH=f"{bin_dir}:{os.environ['PATH']}")
+
+    def run_backup():
+      res = subprocess.run(["bash", "-c", script], env=env, capture_output=True, encoding="utf8", check=False)
+      assert res.returncode == 0, res.stderr
+      return res.stdout
+
+    def archive_members(level):
+      [archive] = target.glob(f"*-files-{level}.tar.zst")
+      with tarfile.open(archive) as tar:
+        return {os.path.basename(member.name) for member in tar.getmembers() if member.isfile()}
+
+    assert "BACKED UP files (full)" in run_backup()
+    assert archive_members("full") == {"unchanged"}
+    [dump] = target.glob("*-postgres-db1.dump.zst")
+    assert dump.read_text() == "dump of db1\n"
+
+    (data_dir / "new").write_text("new")
+    assert "BACKED UP files (incremental)" in run_backup()
+    assert archive_members("incremental") == {"new"}
+    assert not list(target.glob("*.partial"))
@@ -0,0 +1,31 @@
+
+"""
+test pyinfra_dokku.builder module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+from planning import plan_deploy
+from pyinfra_dokku.builder import configure_builders
+from pyinfra_dokku.facts import DokkuGlobalProperties
+from pyinfra_dokku.util import dokku_reports
+
+class TestSelectBuilders:
+
+  def plan(self, monkeypatch, global_properties, **kwargs):
+    return dict(plan_deploy(monkeypatch, configure_builders, {DokkuGlobalProperties: global_properties},
+                            buildkit=False, **kwargs)[1])
+
+  def test_parse_global_properties(self):
+    assert dokku_reports.parse_global_properties("selected dockerfile\nvector-sink http://?uri=a b\nempty \n") == {
+      'selected': 'dockerfile', 'vector-sink': 'http://?uri=a b', 'empty': ''}
+    assert "/var/lib/dokku/config/builder/--global/*" in dokku_reports.render_global_properties_command('builder')
+
+  def test_global_builder_read_without_apps(self, monkeypatch):
+    assert 'Select builders' not in self.plan(monkeypatch, {'selected': 'dockerfile'}, builder='dockerfile')
+
+  def test_global_builder_changed(self, monkeypatch):
+    ops = self.plan(monkeypatch, {'selected': 'herokuish'}, builder='dockerfile')
+    assert ops['Select builders'] == ["dokku builder:set --global selected dockerfile"]
+    ops = self.plan(monkeypatch, {}, builder='dockerfile', apps={'api': 'pack'})
+    assert ops['Select builders'] == ["dokku builder:set --global selected dockerfile", "dokku builder:set api selected pack"]
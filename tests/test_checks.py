@@ -0,0 +1,149 @@
+
+"""
+test pyinfra_dokku.util.checks module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import os
+import stat
+import subprocess
+
+import pytest
+
+from pyinfra_dokku.util import checks, dokku_reports
+from pyinfra_dokku.util.checks import CalibrationTrial
+
+# fake docker: "web-app" has a running web container, "idle-app" doesn't
+FAKE_DOCKER = """#!/usr/bin/env bash
+echo "$*" >> "$FAKE_LOG"
+case "$1" in
+  ps) case "$*" in *app-name=web-app*) echo ctr1;; esac;;
+  inspect)
+    case "$3" in
+      *Config.Image*) echo dokku/web-app:latest;;
+      *NetworkMode*) echo bridge;;
+      *Config.Env*) printf 'PORT=5000\\nSECRET=s3cret\\n\\n';;
+      *Config.Cmd*) printf '/start\\nweb\\n\\n';;
+      *Links*) printf '/dokku.postgres.db:/web-app.web.1/dokku-postgres-db\\n\\n';;
+      *State.Running*) echo true;;
+      *NetworkSettings*) echo 172.17.0.9;;
+    esac;;
+  run) echo clone1;;
+esac
+"""
+
+# fake curl: no response until it's been called $FAKE_CURL_READY times
+FAKE_CURL = """#!/usr/bin/env bash
+echo "curl ${@: -1}" >> "$FAKE_LOG"
+calls=$(( $(cat "$FAKE_CURL_COUNT" 2>/dev/null || echo 0) + 1 ))
+echo "$calls" > "$FAKE_CURL_COUNT"
+if (( calls >= FAKE_CURL_READY )); then printf '200 0.012'; else printf '000 0.000'; exit 7; fi
+"""
+
+class TestChecks:
+
+  @pytest.fixture
+  def sample_report(self):
+    return """\
+=====> node-js-app checks information
+       Checks disabled list:          none
+       Checks skipped list:           worker
+       Checks computed wait to retire: 60
+       Checks global wait to retire:  60
+       Checks wait to retire:         60
+"""
+
+  def test_parse_config_vars(self):
+    output = """\
+=====> node-js-app
+DOKKU_CHECKS_WAIT="2"
+export DOKKU_CHECKS_ATTEMPTS='8'
+=====> other-app
+"""
+    assert dokku_reports.parse_config_vars(output) == {
+      'node-js-app': {'DOKKU_CHECKS_WAIT': '2', 'DOKKU_CHECKS_ATTEMPTS': '8'},
+      'other-app': {},
+    }
+
+  def test_no_changes_needed(self, sample_report):
+    report = dokku_reports.parse_report(sample_report)['checks']['node-js-app']
+    desired = {'wait': 2, 'attempts': 8, 'wait_to_retire': 60, 'skipped': ['worker'], 'disabled': []}
+    config = {'DOKKU_CHECKS_WAIT': '2', 'DOKKU_CHECKS_ATTEMPTS': '8'}
+    assert checks.plan_checks_commands('node-js-app', desired, config, report) == []
+
+  def test_changes_batched(self, sample_report):
+    report = dokku_reports.parse_report(sample_report)['checks']['node-js-app']
+    desired = {'wait': 1, 'timeout': 3, 'attempts': 8, 'default_wait': 4, 'wait_to_retire': 10, 'disabled': ['web']}
+    config = {'DOKKU_CHECKS_ATTEMPTS': '8'}
+    assert checks.plan_checks_commands('node-js-app', desired, config, report) == [
+      "dokku config:set --no-restart node-js-app DOKKU_CHECKS_WAIT=1 DOKKU_CHECKS_TIMEOUT=3 DOKKU_DEFAULT_CHECKS_WAIT=4",
+      "dokku checks:set node-js-app wait-to-retire 10",
+      "dokku checks:disable node-js-app web",
+    ]
+
+  def test_unlisted_process_types_reenabled(self, sample_report):
+    report = dokku_reports.parse_report(sample_report)['checks']['node-js-app']
+    assert checks.plan_checks_commands('node-js-app', {'skipped': []}, {}, report) == [
+      "dokku checks:enable node-js-app worker",
+    ]
+
+  def test_invalid_spec_rejected(self):
+    with pytest.raises(ValueError):
+      checks.validate_checks_spec({'app': {'checks_wait': 1}})
+    with pytest.raises(ValueError):
+      checks.validate_checks_spec({'app': {'wait': '1'}})
+    with pytest.raises(ValueError):
+      checks.validate_checks_spec({'app': {'attempts': 0}})
+    checks.validate_checks_spec({'app': {'wait': 0, 'disabled': ['web']}})
+
+  def test_parse_calibration_output(self):
+    output = """\
+CALIBRATE web-app ok 2350 0.012
+some noise
+CALIBRATE idle-app failed no-web-container
+CALIBRATE web-app ok garbage 0.1
+"""
+    assert checks.parse_calibration_output(output) == [
+      CalibrationTrial('web-app', True, 2.35, 0.012),
+      CalibrationTrial('idle-app', False, 0.0, 0.0, 'no-web-container'),
+    ]
+
+  def test_suggest_checks(self):
+    trials = [CalibrationTrial('app', True, 2.2, 0.1), CalibrationTrial('app', True, 3.1, 0.4),
+              CalibrationTrial('app', False, 0.0, 0.0, 'timeout')]
+    assert checks.suggest_checks(trials) == {'wait': 1, 'attempts': 5, 'timeout': 2, 'default_wait': 5}
+
+    slow = [CalibrationTrial('app', True, 40.0, 3.0)]
+    assert checks.suggest_checks(slow) == {'wait': 6, 'attempts': 10, 'timeout': 5, 'default_wait': 60}
+
+    assert checks.suggest_checks(trials[2:]) is None
+
+  def test_calibration_script(self, tmp_path):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, contents in [("docker", FAKE_DOCKER), ("curl", FAKE_CURL)]:
+      path = bin_dir / name
+      path.write_text(contents)
+      path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    log = tmp_path / "log"
+    env = dict(os.environ, PATH=f"{bin_dir}{os.pathsep}{os.environ['PATH']}", FAKE_LOG=str(log),
+               FAKE_CURL_COUNT=str(tmp_path / "count"), FAKE_CURL_READY="3")
+
+    script = checks.render_calibration_script(["web-app", "idle-app"], trials=2, check_path="/health", timeout=10)
+    res = subprocess.run(["bash", "-c", script], env=env, capture_output=True, encoding="utf8", check=False)
+    assert res.returncode == 0, res.stderr
+
+    trials = checks.parse_calibration_output(res.stdout)
+    assert [(t.app, t.ok, t.reason) for t in trials] == [
+      ('web-app', True, ''), ('web-app', True, ''),
+      ('idle-app', False, 'no-web-container'), ('idle-app', False, 'no-web-container'),
+    ]
+    assert trials[0].startup >= 0.4  # two polls, 0.2s apart, before ready
+    assert trials[0].response == 0.012
+
+    calls = log.read_text()
+    assert "run -d --rm --env-file" in calls
+    assert "--network bridge --link dokku.postgres.db:dokku-postgres-db dokku/web-app:latest /start web" in calls
+    assert "curl http://172.17.0.9:5000/health" in calls
+    assert "stop -t 0 clone1" in calls
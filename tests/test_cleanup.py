@@ -0,0 +1,57 @@
+
+"""
+test pyinfra_dokku.util.cleanup module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import os
+import subprocess
+
+import pytest
+
+from pyinfra_dokku.util import cleanup
+
+class TestCleanup:
+
+  def test_keep_releases_must_be_positive(self):
+    with pytest.raises(ValueError):
+      cleanup.render_cleanup_script(0, 10, 24, "/tmp/log")
+
+  def test_cleanup_script_keeps_recent_and_in_use_images(self, tmp_path):
+    # a fake `docker`: app "a" has 4 releases, the oldest of which is
+    # still used by a container; app "b" has one release.
+    fake_docker = tmp_path / "docker"
+    fake_docker.write_text(f"""#!/usr/bin/env bash
+case "$1 $2" in
+  "info --format") echo {tmp_path} ;;
+  "ps --all") echo c1 ;;
+  "inspect --format") echo sha256:a1 ;;
+  "image ls") printf 'sha256:a1\\nsha256:a2\\nsha256:a3\\nsha256:a4\\nsha256:b1\\n' ;;
+  "image inspect")
+    printf '%s\\n' 'a 2023-01-01T00:00:00Z sha256:a1' 'a 2023-01-02T00:00:00Z sha256:a2' \\
+        'a 2023-01-03T00:00:00Z sha256:a3' 'a 2023-01-04T00:00:00Z sha256:a4' \\
+        'b 2023-01-01T00:00:00Z sha256:b1' ;;
+  "image rm") echo "$3" >> {tmp_path}/removed ;;
+esac
+""")
+    fake_docker.chmod(0o755)
+
+    log_path = tmp_path / "runs.jsonl"
+    script = cleanup.render_cleanup_script(2, 10, 24, str(log_path))
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+    res = subprocess.run(["bash", "-c", script], env=env, capture_output=True, encoding="utf8", check=False)
+    assert res.returncode == 0, res.stderr
+
+    assert (tmp_path / "removed").read_text().split() == ["sha256:a2"]
+    runs = cleanup.parse_cleanup_log(log_path.read_text())
+    assert len(runs) == 1
+    assert runs[0]['images_removed'] == 1
+    assert runs[0]['reclaimed_bytes'] >= 0
+
+  def test_parse_cleanup_log_skips_bad_lines(self):
+    log = ['{"time": 1, "reclaimed_bytes": 10}', 'garbage', '{"time": 2, "reclaimed_bytes": 20}']
+    assert [run['time'] for run in cleanup.parse_cleanup_log(log)] == [1, 2]
+
+  def test_timer_runs_at_calendar_time(self):
+    assert "OnCalendar=*-*-* 03:17:00\n" in cleanup.render_cleanup_timer("*-*-* 03:17:00")
@@ -0,0 +1,96 @@
+
+"""
+test pyinfra_dokku.util.compiled_install module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import os
+import subprocess
+
+from pyinfra_dokku.install import get_expected_debconf_values
+from pyinfra_dokku.util import compiled_install
+from pyinfra_dokku.util.compiled_install import Step, StepResult
+
+def run_script(script, tmp_path, env=None):
+  path = tmp_path / "install.sh"
+  path.write_text(script)
+  return subprocess.run(["bash", str(path)], env=env, capture_output=True, encoding="utf8", check=False)
+
+class TestCompiledInstall:
+
+  def test_steps_are_checked_run_and_checkpointed(self, tmp_path):
+    marker = tmp_path / "marker"
+    steps = [
+      Step('already', 'already in effect', check="true", run="false"),
+      Step('create', 'create marker', check=f"[ -f {marker} ]", run=f"touch {marker}"),
+    ]
+    script = compiled_install.render_install_script(steps, str(tmp_path / "state"), str(tmp_path / "log"))
+
+    res = run_script(script, tmp_path)
+    assert res.returncode == 0, res.stderr
+    assert [(r.name, r.status) for r in compiled_install.parse_step_results(res.stdout)] == [('already', 'ok'), ('create', 'changed')]
+    assert marker.exists()
+
+    res = run_script(script, tmp_path)
+    assert [r.status for r in compiled_install.parse_step_results(res.stdout)] == ['done', 'done']
+
+  def test_drifted_step_is_repaired(self, tmp_path):
+    marker = tmp_path / "marker"
+    steps = [Step('create', 'create marker', check=f"[ -f {marker} ]", run=f"touch {marker}")]
+    script = compiled_install.render_install_script(steps, str(tmp_path / "state"), str(tmp_path / "log"))
+    run_script(script, tmp_path)
+    marker.unlink()
+
+    res = run_script(script, tmp_path)
+    assert [r.status for r in compiled_install.parse_step_results(res.stdout)] == ['changed']
+    assert marker.exists()
+
+  def test_changed_step_is_rechecked(self, tmp_path):
+    state, log = str(tmp_path / "state"), str(tmp_path / "log")
+    run_script(compiled_install.render_install_script([Step('s', 's', check="true", run="true")], state, log), tmp_path)
+    res = run_script(compiled_install.render_install_script([Step('s', 's', check="false", run="true")], state, log), tmp_path)
+    assert [r.status for r in compiled_install.parse_step_results(res.stdout)] == ['changed']
+
+  def test_stops_at_failed_step(self, tmp_path):
+    steps = [
+      Step('broken', 'broken', check="false", run="echo oops; false"),
+      Step('never', 'never', check="false", run="true"),
+    ]
+    script = compiled_install.render_install_script(steps, str(tmp_path / "state"), str(tmp_path / "log"))
+    res = run_script(script, tmp_path)
+    assert res.returncode != 0
+    assert [(r.name, r.status) for r in compiled_install.parse_step_results(res.stdout)] == [('broken', 'failed')]
+    assert "oops" in (tmp_path / "log").read_text()
+    assert not (tmp_path / "state" / "broken").exists()
+
+  def test_parse_step_results_ignores_other_lines(self):
+    assert compiled_install.parse_step_results(["noise", "STEP packages changed 1500", "STEP x bogus 1"]) == [StepResult('packages', 'changed', 1.5)]
+
+  def test_dokku_step_checks_debconf(self, tmp_path):
+    # fake dpkg-query and debconf-show, for an installed dokku
+    # configured for example.com
+    (tmp_path / "dpkg-query").write_text("#!/usr/bin/env bash\necho 'install ok installed'\n")
+    (tmp_path / "debconf-show").write_text("""#!/usr/bin/env bash
+cat <<'END'
+* dokku/hostname: example.com
+  dokku/key_file: /root/.ssh/id_rsa.pub
+* dokku/nginx_enable: true
+* dokku/skip_key_file: true
+* dokku/vhost_enable: true
+* dokku/web_config: false
+END
+""")
+    for name in ("dpkg-query", "debconf-show"):
+      (tmp_path / name).chmod(0o755)
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+
+    def dokku_status(fqdn):
+      steps = compiled_install.install_steps([], [], {}, "/nonexistent", get_expected_debconf_values(fqdn))
+      dokku_step = [step for step in steps if step.name == 'dokku']
+      script = compiled_install.render_install_script(dokku_step, str(tmp_path / f"state-{fqdn}"), str(tmp_path / "log"))
+      script = script.replace("run_dokku() {\n", "run_dokku() {\n  return 1\n")
+      return compiled_install.parse_step_results(run_script(script, tmp_path, env).stdout)[0].status
+
+    assert dokku_status("example.com") == 'ok'
+    assert dokku_status("other.example.com") == 'failed'
@@ -0,0 +1,121 @@
+
+"""
+test pyinfra_dokku.util.container_usage module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import datetime
+import os
+import stat
+import subprocess
+
+import pytest
+
+from pyinfra_dokku.util import container_usage
+
+# fake docker: two web containers for "web-app" (pids 101 and 102), and a
+# worker whose process has gone (pid 0)
+FAKE_DOCKER = """#!/usr/bin/env bash
+case "$1" in
+  ps) printf 'ctr1\\nctr2\\nctr3\\n';;
+  inspect)
+    echo "101 $STARTED web-app web"
+    echo "102 $STARTED web-app web"
+    echo "0 $STARTED web-app worker";;
+esac
+"""
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo:  999999      10    0    0    0     0          0         0   999999      10    0    0    0     0       0          0
+  eth0:    1000      10    0    0    0     0          0         0     2000      20    0    0    0     0       0          0
+"""
+
+
+def _write(path, content):
+  path.parent.mkdir(parents=True, exist_ok=True)
+  path.write_text(content)
+
+
+@pytest.fixture
+def fake_host(tmp_path, monkeypatch):
+  bin_dir = tmp_path / "bin"
+  bin_dir.mkdir()
+  docker = bin_dir / "docker"
+  docker.write_text(FAKE_DOCKER)
+  docker.chmod(docker.stat().st_mode | stat.S_IEXEC)
+  monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+  started = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=100)
+  monkeypatch.setenv("STARTED", started.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+
+  for pid in (101, 102):
+    _write(tmp_path / "proc" / str(pid) / "net" / "dev", NET_DEV)
+  return tmp_path
+
+
+def _run(tmp_path):
+  command = container_usage.render_usage_command(str(tmp_path / "proc"), str(tmp_path / "cgroup"))
+  res = subprocess.run(["bash", "-c", command], capture_output=True, encoding="utf8", check=True)
+  return container_usage.parse_usage_output(res.stdout)
+
+
+class TestUsageCommand:
+
+  def test_cgroup_v2(self, fake_host):
+    cgroup = fake_host / "cgroup"
+    _write(cgroup / "cgroup.controllers", "cpu io memory\n")
+    for pid, limit in ((101, "268435456"), (102, "268435456")):
+      _write(fake_host / "proc" / str(pid) / "cgroup", f"0::/system.slice/docker-{pid}.scope\n")
+      scope = cgroup / "system.slice" / f"docker-{pid}.scope"
+      _write(scope / "cpu.stat", "usage_usec 10000000\nuser_usec 8000000\n")
+      _write(scope / "memory.current", "1048576\n")
+      _write(scope / "memory.max", f"{limit}\n")
+      _write(scope / "io.stat", "8:0 rbytes=4096 wbytes=512 rios=1 wios=1\n8:16 rbytes=4096 wbytes=0 rios=1 wios=0\n")
+
+    usage = _run(fake_host)
+    assert list(usage) == ['web-app']
+    web = usage['web-app']['web']
+    assert web['containers'] == 2
+    assert web['cpu_seconds'] == 20.0
+    assert web['cpu_cores'] == pytest.approx(0.2, abs=0.01)
+    assert web['memory_bytes'] == 2 * 1048576
+    assert web['memory_limit_bytes'] == 2 * 268435456
+    assert (web['net_rx_bytes'], web['net_tx_bytes']) == (2000, 4000)
+    assert (web['block_read_bytes'], web['block_write_bytes']) == (16384, 1024)
+
+  def test_cgroup_v1_unlimited_memory(self, fake_host):
+    cgroup = fake_host / "cgroup"
+    for pid in (101, 102):
+      _write(fake_host / "proc" / str(pid) / "cgroup",
+             f"4:memory:/docker/{pid}\n3:cpu,cpuacct:/docker/{pid}\n2:blkio:/docker/{pid}\n")
+      _write(cgroup / "cpuacct" / "docker" / str(pid) / "cpuacct.usage", "5000000000\n")
+      _write(cgroup / "memory" / "docker" / str(pid) / "memory.usage_in_bytes", "2048\n")
+      _write(cgroup / "memory" / "docker" / str(pid) / "memory.limit_in_bytes", "9223372036854771712\n")
+      _write(cgroup / "blkio" / "docker" / str(pid) / "blkio.throttle.io_service_bytes",
+             "8:0 Read 100\n8:0 Write 50\n8:0 Sync 150\n8:0 Total 150\nTotal 150\n")
+
+    web = _run(fake_host)['web-app']['web']
+    assert web['cpu_seconds'] == 10.0
+    assert web['memory_bytes'] == 4096
+    assert web['memory_limit_bytes'] is None
+    assert (web['block_read_bytes'], web['block_write_bytes']) == (200, 100)
+
+
+class TestParseUsage:
+
+  def test_missing_values_left_out(self):
+    usage = container_usage.parse_usage_output(
+      "USAGE api web 10 1000000 512 max - - - -\n"
+      "USAGE api worker 10 - - - 1 2 3 4\n"
+      "some noise\n"
+    )
+    assert usage['api']['web']['cpu_seconds'] == 1.0
+    assert usage['api']['web']['cpu_cores'] == 0.1
+    assert usage['api']['web']['memory_limit_bytes'] is None
+    assert usage['api']['web']['net_rx_bytes'] == 0
+    assert usage['api']['worker']['cpu_seconds'] == 0
+    assert usage['api']['worker']['block_write_bytes'] == 4
+
+  def test_no_containers(self):
+    assert container_usage.parse_usage_output("") == {}
@@ -0,0 +1,53 @@
+
+"""
+test pyinfra_dokku.util.docker_config and pyinfra_dokku.util.build_cache modules
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra_dokku.util import build_cache, docker_config
+
+class TestDockerConfig:
+
+  def test_merge_keeps_existing_settings(self):
+    existing = {'log-driver': 'json-file', 'builder': {'gc': {'enabled': False}, 'other': 1}}
+    updates  = {'builder': {'gc': {'enabled': True, 'defaultKeepStorage': '20GB'}}}
+    assert docker_config.merge_daemon_config(existing, updates) == {
+      'log-driver': 'json-file',
+      'builder': {'gc': {'enabled': True, 'defaultKeepStorage': '20GB'}, 'other': 1},
+    }
+    # input not modified
+    assert existing['builder']['gc'] == {'enabled': False}
+
+  def test_merge_removes_none_settings(self):
+    assert docker_config.merge_daemon_config({'log-driver': 'local', 'log-opts': {'max-file': '3'}},
+                                             {'log-opts': None, 'debug': None}) == {'log-driver': 'local'}
+
+  def test_parse_daemon_config(self):
+    assert docker_config.parse_daemon_config("") == {}
+    assert docker_config.parse_daemon_config(['{', '"debug": true', '}']) == {'debug': True}
+    with pytest.raises(ValueError):
+      docker_config.parse_daemon_config("[]")
+
+  @pytest.mark.parametrize("sample_input,expected_output", [
+    ("0B", 0),
+    ("512kB", 512000),
+    ("1.5GB", 1500000000),
+    ("2MiB", 2 * 1024 * 1024),
+  ])
+  def test_parse_size(self, sample_input, expected_output):
+    assert docker_config.parse_size(sample_input) == expected_output
+
+  def test_parse_build_cache_stats(self):
+    sample_input = """\
+[buildkit]
+[{"ID":"a1","Size":"1MB","UsageCount":3},{"ID":"b2","Size":"500kB","UsageCount":1}]
+[app-caches]
+1234\t/home/dokku/node-js-app/cache
+"""
+    assert build_cache.parse_build_cache_stats(sample_input) == {
+      'buildkit': {'entries': 2, 'size_bytes': 1500000, 'reused_entries': 1, 'hits': 2},
+      'app_caches': {'node-js-app': 1234},
+    }
@@ -0,0 +1,42 @@
+
+"""
+test pyinfra_dokku.docker_daemon module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import json
+
+from pyinfra.api import deploy
+
+from planning import plan_deploy
+from pyinfra_dokku.docker_daemon import update_docker_daemon_config
+from pyinfra_dokku.facts import DOCKER_DAEMON_CONFIG_PATH, DockerDaemonConfig
+
+@deploy("Update docker daemon config twice")
+def update_twice(first, second, changed=None):
+  for name, updates in (("First update", first), ("Second update", second)):
+    result = update_docker_daemon_config(name, updates)
+    if changed is not None:
+      changed.append(result)
+
+def uploaded_configs(ops):
+  prefix = f"upload {DOCKER_DAEMON_CONFIG_PATH}:\n"
+  return [json.loads(command[len(prefix):])
+          for _name, commands in ops for command in commands if command.startswith(prefix)]
+
+class TestDockerDaemon:
+
+  def test_second_update_keeps_first(self, monkeypatch):
+    _state, ops = plan_deploy(monkeypatch, update_twice, {DockerDaemonConfig: {'debug': True}},
+                              {'builder': {'gc': {'enabled': True}}}, {'log-driver': 'local'})
+    assert uploaded_configs(ops) == [
+      {'debug': True, 'builder': {'gc': {'enabled': True}}},
+      {'debug': True, 'builder': {'gc': {'enabled': True}}, 'log-driver': 'local'},
+    ]
+
+  def test_repeated_update_is_noop(self, monkeypatch):
+    changed = []
+    plan_deploy(monkeypatch, update_twice, {DockerDaemonConfig: {}},
+                {'log-driver': 'local'}, {'log-driver': 'local'}, changed)
+    assert changed == [True, False]
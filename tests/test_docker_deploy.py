@@ -5,8 +5,9 @@ test deploy scripts by running in Docker containers.
 # pylint: disable=missing-class-docstring,missing-function-docstring
 
 import pytest
+import testinfra
 
-from utils import DeploymentTests, PyinfraInvocation, TinfraInvocation
+from utils import DeploymentTests, PyinfraInvocation, TinfraInvocation, _run_pyinfra, verbose_run
 
 
 class TestDockerDeploy(DeploymentTests):
@@ -66,3 +67,60 @@ class TestDockerDeploy(DeploymentTests):
     self.letsencrypt_install(pyinfra_args, testinfra_args)
 
 
+  @pytest.mark.docker
+  @pytest.mark.container_type("dokku_docker_image")
+  def test_letsencrypt_install_with_acme_test_server(self, docker_container, acme_test_server):
+    """
+    as for test_letsencrypt_install, but with a local ACME test server
+    standing in for Let's Encrypt.
+    """
+
+    ctr_id = docker_container.id
+    pyinfra_args    = PyinfraInvocation.make(f"@docker/{ctr_id}",
+                                             letsencrypt_server=acme_test_server.directory_url)
+    testinfra_args  = TinfraInvocation.make("docker://" + ctr_id)
+
+    self.letsencrypt_install(pyinfra_args, testinfra_args)
+
+
+  @pytest.mark.docker
+  @pytest.mark.container_type("dokku_docker_image")
+  def test_enable_letsencrypt_with_acme_test_server(self, docker_container, acme_test_server):
+    """
+    create and deploy an app, then issue a certificate for it using
+    ./tests/deploy_scripts/enable_letsencrypt.py, with a local ACME test server
+    standing in for Let's Encrypt.
+    """
+
+    ctr_id  = docker_container.id
+    host    = testinfra.get_host("docker://" + ctr_id)
+
+    # "Arrange" - make the test server's CA cert available to lego,
+    # and deploy an app.
+    cmd = f"docker cp {acme_test_server.id}:/test/certs/pebble.minica.pem - | docker cp - {ctr_id}:/etc/ssl/"
+    verbose_run(["bash", "-c", cmd], check=True)
+
+    for cmd in ["dokku apps:create testapp",
+                "dokku git:from-image testapp nginxdemos/hello:plain-text"]:
+      cmd_res = host.run(cmd)
+      assert cmd_res.rc == 0, f"'{cmd}' should succeed"
+
+    # "Act"
+    lego_docker_args = "-v /etc/ssl/pebble.minica.pem:/pebble.minica.pem -e LEGO_CA_CERTIFICATES=/pebble.minica.pem"
+    _run_pyinfra(f"@docker/{ctr_id}",
+                 "./tests/deploy_scripts/enable_letsencrypt.py",
+                 letsencrypt_server=acme_test_server.directory_url,
+                 letsencrypt_email="test@localhost.lan",
+                 letsencrypt_lego_docker_args=lego_docker_args,
+                 letsencrypt_apps="testapp=testapp.localhost.lan,www.localhost.lan",
+    )
+
+    # "Assert"
+    cmd = "dokku letsencrypt:list | grep '^testapp '"
+    cmd_res = host.run(cmd)
+    assert cmd_res.rc == 0, f"'{cmd}' should succeed"
+
+    cmd = "openssl x509 -noout -ext subjectAltName -in /home/dokku/testapp/tls/server.crt"
+    cmd_res = host.run(cmd)
+    assert "testapp.localhost.lan" in cmd_res.stdout
+    assert "www.localhost.lan" in cmd_res.stdout
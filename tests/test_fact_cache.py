@@ -0,0 +1,184 @@
+
+"""
+test pyinfra_dokku.util.fact_cache, pyinfra_dokku.fact_cache and
+pyinfra_dokku.plan modules
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import datetime
+
+from pyinfra.api        import deploy
+from pyinfra.facts.deb  import DebPackage
+from pyinfra.facts.files import File
+from pyinfra.facts.server import LinuxName, LsbRelease
+from pyinfra.operations import python, server
+
+from planning import plan_deploy
+
+from pyinfra_dokku import fact_cache, plan
+from pyinfra_dokku.facts import DokkuDebconf, DokkuPlugins, DpkgArchitecture
+from pyinfra_dokku.install import DOKKU_CONFIGURATION_KEY, INSTALLED_PLUGINS_KEY, ROOT_ID_PATH, get_expected_debconf_values, get_installed_plugins, install_dokku, install_dokku_prerequisites
+from pyinfra_dokku.rollout import run_wave
+from pyinfra_dokku.util.fact_cache import FactCache
+
+class FakeClock: # pylint: disable=too-few-public-methods
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+def cached_install_facts(fqdn, has_dokku=True, plugins=None):
+  return {
+    fact_cache_key: (value, 60.0) for fact_cache_key, value in {
+      fact_cache.fact_cache_key(DebPackage, "dokku"): {'version': '0.30.0'} if has_dokku else None,
+      DOKKU_CONFIGURATION_KEY: get_expected_debconf_values(fqdn),
+      fact_cache.fact_cache_key(File, ROOT_ID_PATH): {'size': 2590},
+      INSTALLED_PLUGINS_KEY: plugins or {},
+    }.items()
+  }
+
+@deploy("Use cached value, then maybe change host")
+def cache_then_run(command, fetched, tag=True):
+  fact_cache.cached('answer', lambda: fetched.append(1) or 42)
+  if command:
+    op_meta = server.shell(commands=command)
+    if tag:
+      fact_cache.invalidates_cached(op_meta, 'answer')
+  else:
+    python.call(function=lambda: None)
+
+def seed_cache(path, fqdn, host="@local"):
+  cache = FactCache(path)
+  for key, (value, _age) in cached_install_facts(fqdn).items():
+    cache.put(host, key, value)
+  return cache
+
+def run_planned(state):
+  """
+  emulate running the planned operations successfully, as far as state
+  callbacks are concerned.
+  """
+  for op_host in state.inventory:
+    for op_hash in state.get_op_order():
+      if op_hash in state.ops[op_host]:
+        state.trigger_callbacks("operation_host_success", op_host, op_hash)
+
+INSTALL_FACTS = {
+  LinuxName: 'Ubuntu',
+  LsbRelease: {'id': 'Ubuntu', 'codename': 'focal'},
+  DpkgArchitecture: 'amd64',
+}
+
+@deploy("Read plugins, plan an install, read again")
+def plan_plugin_install(seen):
+  seen.append(get_installed_plugins())
+  fact_cache.record_planned_fact(DokkuPlugins, {'letsencrypt': {}}, INSTALLED_PLUGINS_KEY)
+  seen.append(get_installed_plugins())
+  seen.append(get_installed_plugins(use_cache=False))
+
+class TestFactCache:
+
+  def test_ttl_and_invalidation(self, tmp_path):
+    clock = FakeClock()
+    cache = FactCache(str(tmp_path / "facts.sqlite"), clock=clock)
+    assert cache.get("h1", "k", 60) == (False, None)
+
+    cache.put("h1", "k", {"a": 1})
+    cache.put("h2", "k", [1, 2])
+    clock.now += 59
+    assert cache.get("h1", "k", 60) == (True, {"a": 1})
+    clock.now += 1
+    assert cache.get("h1", "k", 60) == (False, None)
+    assert cache.get("h1", "k", None) == (True, {"a": 1})
+
+    cache.invalidate("h1")
+    assert cache.get("h1", "k", None) == (False, None)
+    assert cache.entries() == {"h2": {"k": ([1, 2], 60.0)}}
+
+  def test_values_round_trip(self, tmp_path):
+    cache = FactCache(str(tmp_path / "facts.sqlite"))
+    value = {('dokku', 'hostname'): 'example.io', 'mtime': datetime.datetime(2023, 1, 2, 3, 4, 5)}
+    cache.put("h", "k", value)
+    assert cache.get("h", "k", None) == (True, value)
+
+  def test_cached_reuses_values_until_host_changes(self, tmp_path):
+    hosts = [("@local", {"fact_cache_path": str(tmp_path / "facts.sqlite")})]
+    fetched = []
+
+    assert not run_wave(hosts, cache_then_run, (None, fetched), health_check=None)
+    # a shell command not tagged as changing the value leaves it cached
+    assert not run_wave(hosts, cache_then_run, ("true", fetched, False), health_check=None)
+    assert not run_wave(hosts, cache_then_run, ("true", fetched), health_check=None)
+    assert len(fetched) == 1
+    # the tagged shell command may have changed it, so the value is fetched again
+    assert not run_wave(hosts, cache_then_run, (None, fetched), health_check=None)
+    assert len(fetched) == 2
+
+  def test_plan_install_unchanged(self):
+    facts = cached_install_facts("example.io", plugins={'letsencrypt': {}})
+    assert not plan.plan_install(facts, "example.io", ['letsencrypt'])
+
+  def test_plan_install_changes(self):
+    assert plan.plan_install(cached_install_facts("example.io"), "new.example.io", ['letsencrypt']) == [
+      "reconfigure and reinstall dokku (hostname=new.example.io)",
+      "install letsencrypt plugin",
+    ]
+    assert plan.plan_install(cached_install_facts("example.io", has_dokku=False), "example.io")[0] == "install dokku"
+    assert plan.plan_install({}, "example.io")[0].startswith("unknown:")
+
+  def test_plan_fleet(self, tmp_path):
+    path = str(tmp_path / "facts.sqlite")
+    cache = FactCache(path)
+    for key, (value, _age) in cached_install_facts("dokku1").items():
+      cache.put("dokku1", key, value)
+      cache.put("dokku2", key, value)
+
+    fleet = plan.plan_fleet(path, fqdns={"dokku2": "dokku1"})
+    assert sorted(fleet) == ["dokku1", "dokku2"]
+    assert "0 of 2 host(s) would change" in plan.format_plan(fleet)
+    # fqdns default to host names
+    fleet = plan.plan_fleet(path)
+    assert fleet["dokku2"][0] == ["reconfigure and reinstall dokku (hostname=dokku2)"]
+    assert "1 of 2 host(s) would change" in plan.format_plan(fleet)
+
+  def test_dokku_facts_process(self):
+    assert DokkuDebconf().process(["* dokku/hostname: example.io"]) == {('dokku', 'hostname'): 'example.io'}
+    assert DokkuPlugins().process(["letsencrypt 0.20.0 enabled automated certificate management"]) == {
+      'letsencrypt': {'version': '0.20.0', 'status': 'enabled', 'description': 'automated certificate management'}}
+
+  def test_planned_fact_seen_by_later_reads(self, tmp_path):
+    hosts = [("@local", {"fact_cache_path": str(tmp_path / "facts.sqlite")})]
+    seen = []
+    assert not run_wave(hosts, plan_plugin_install, (seen,), health_check=None)
+    # no dokku here, so re-fetching finds no plugins
+    assert seen == [{}, {'letsencrypt': {}}, {}]
+
+  def test_prereq_ops_keep_cache(self, tmp_path, monkeypatch):
+    path = str(tmp_path / "facts.sqlite")
+    cache = seed_cache(path, "example.io")
+    state, ops = plan_deploy(monkeypatch, install_dokku_prerequisites, INSTALL_FACTS,
+                             data={"fact_cache_path": path})
+    assert any("apt-get" in command and "update" in command for _name, commands in ops for command in commands)
+    run_planned(state)
+    assert sorted(cache.entries()["@local"]) == sorted(cached_install_facts("example.io"))
+
+
+  def test_reconfigure_drops_only_changed_facts(self, tmp_path, monkeypatch):
+    path = str(tmp_path / "facts.sqlite")
+    cache = seed_cache(path, "example.io")
+    state, _ops = plan_deploy(monkeypatch, install_dokku, INSTALL_FACTS,
+                              data={"fact_cache_path": path, "fqdn": "new.example.io"})
+    run_planned(state)
+    assert sorted(cache.entries()["@local"]) == sorted([fact_cache.fact_cache_key(File, ROOT_ID_PATH), INSTALLED_PLUGINS_KEY])
+
+  def test_planned_fact_not_cached(self, tmp_path, monkeypatch):
+    path = str(tmp_path / "facts.sqlite")
+    cache = seed_cache(path, "example.io")
+    seen = []
+    # as with `pyinfra --dry`: planned, but never run
+    plan_deploy(monkeypatch, plan_plugin_install, {}, seen, data={"fact_cache_path": path})
+    assert seen[:2] == [{}, {'letsencrypt': {}}]
+    assert cache.get("@local", INSTALLED_PLUGINS_KEY, None) == (True, {})
+    assert sorted(cache.entries()["@local"]) == sorted(cached_install_facts("example.io"))
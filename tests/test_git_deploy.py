@@ -0,0 +1,94 @@
+
+"""
+test pyinfra_dokku.util.git_deploy module, against a local bare repository
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import subprocess
+import tarfile
+
+import pytest
+
+from pyinfra_dokku.util import git_deploy
+from pyinfra_dokku.util.git_deploy import GitDeployError
+
+def git(*args, cwd=None):
+  return subprocess.run(["git", *args], cwd=cwd, capture_output=True, encoding="utf8", check=True).stdout.strip()
+
+@pytest.fixture(name="origin")
+def fixture_origin(tmp_path):
+  """
+  a bare repository with two commits on main: the first tagged v1
+  (annotated), the second adding a file.
+  """
+
+  origin = tmp_path / "origin.git"
+  work = tmp_path / "work"
+  git("init", "--quiet", "--bare", "--initial-branch=main", str(origin))
+  git("init", "--quiet", "--initial-branch=main", str(work))
+  for key, val in [("user.name", "Test"), ("user.email", "test@example.com")]:
+    git("config", key, val, cwd=work)
+
+  (work / "app.py").write_text("print('v1')\n")
+  git("add", ".", cwd=work)
+  git("commit", "--quiet", "-m", "first", cwd=work)
+  git("tag", "-a", "v1", "-m", "version 1", cwd=work)
+  (work / "README").write_text("readme\n")
+  git("add", ".", cwd=work)
+  git("commit", "--quiet", "-m", "second", cwd=work)
+  git("push", "--quiet", "--tags", str(origin), "main", cwd=work)
+
+  return {'url': f"file://{origin}", 'v1': git("rev-parse", "v1^{commit}", cwd=work), 'main': git("rev-parse", "main", cwd=work)}
+
+class TestGitDeploy:
+
+  def test_resolve_ref(self, origin):
+    assert git_deploy.resolve_ref(origin['url'], "main") == origin['main']
+    assert git_deploy.resolve_ref(origin['url'], "refs/heads/main") == origin['main']
+    assert git_deploy.resolve_ref(origin['url'], "v1") == origin['v1']
+    assert git_deploy.resolve_ref(origin['url'], origin['v1']) == origin['v1']
+    with pytest.raises(GitDeployError):
+      git_deploy.resolve_ref(origin['url'], "nope")
+
+  def test_fetch_is_shallow_and_cached(self, origin, tmp_path):
+    cache = tmp_path / "cache"
+    repo = git_deploy.fetch_commit(cache, origin['url'], origin['main'], "main")
+    assert git("rev-list", "--count", origin['main'], cwd=repo) == "1"
+    with pytest.raises(subprocess.CalledProcessError):
+      git("cat-file", "-e", origin['v1'], cwd=repo)
+
+    # already fetched: works even with the origin gone
+    url = origin['url']
+    origin_path = url[len("file://"):]
+    subprocess.run(["mv", origin_path, origin_path + ".moved"], check=True)
+    assert git_deploy.fetch_commit(cache, url, origin['main']) == repo
+
+  def test_build_archive(self, origin, tmp_path):
+    cache = tmp_path / "cache"
+    archive = git_deploy.build_archive(cache, origin['url'], origin['v1'], "v1")
+    with tarfile.open(archive) as tar:
+      assert sorted(tar.getnames()) == ["app.py"]
+
+    archive = git_deploy.build_archive(cache, origin['url'], origin['main'], "main")
+    with tarfile.open(archive) as tar:
+      assert sorted(tar.getnames()) == ["README", "app.py"]
+    assert git_deploy.build_archive(cache, "file:///nonexistent", origin['main']) == archive
+
+  def test_deployed_refs(self):
+    output = "node-js-app 3b18e512dba79e4c8300dd08aeb37f8e728b8dad 9c1d6b0e\nbad line\n"
+    refs = git_deploy.parse_deployed_refs(output)
+    assert refs == {'node-js-app': ('3b18e512dba79e4c8300dd08aeb37f8e728b8dad', '9c1d6b0e')}
+
+    sha = '3b18e512dba79e4c8300dd08aeb37f8e728b8dad'
+    assert not git_deploy.needs_deploy('node-js-app', sha, refs, {'node-js-app': {'git sha': '9c1d6b0e'}})
+    # deployed since by other means
+    assert git_deploy.needs_deploy('node-js-app', sha, refs, {'node-js-app': {'git sha': 'aaaa1111'}})
+    # different commit wanted, or never deployed by us
+    assert git_deploy.needs_deploy('node-js-app', '0' * 40, refs, {'node-js-app': {'git sha': '9c1d6b0e'}})
+    assert git_deploy.needs_deploy('other-app', sha, refs, {})
+
+  def test_record_deployed_command(self):
+    command = git_deploy.render_record_deployed_command("my app", "abc")
+    assert "dokku git:report 'my app' --git-sha" in command
+    assert command.endswith("> '/var/lib/pyinfra-dokku/deployed/my app'")
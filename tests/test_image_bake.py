@@ -0,0 +1,87 @@
+
+"""
+test tests/dockerfiles/bake_dokku_image.py, using a fake `docker` command
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import importlib.util
+import os
+import stat
+
+from pathlib import Path
+
+import pytest
+
+BAKE_SCRIPT = Path(__file__).parent / "dockerfiles" / "bake_dokku_image.py"
+
+def load_bake_module():
+  spec = importlib.util.spec_from_file_location("bake_dokku_image", BAKE_SCRIPT)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module) # type: ignore
+  return module
+
+bake = load_bake_module()
+
+# fake docker: `systemctl is-system-running` reports "starting" until it's
+# been asked $FAKE_SYSTEMD_POLLS times; the container runs unless
+# $FAKE_CTR_STOPPED is set
+FAKE_DOCKER = """#!/usr/bin/env bash
+case "$1" in
+  exec)
+    polls=$(( $(cat "$FAKE_POLL_COUNT" 2>/dev/null || echo 0) + 1 ))
+    echo "$polls" > "$FAKE_POLL_COUNT"
+    if (( polls >= FAKE_SYSTEMD_POLLS )); then echo degraded; exit 1; fi
+    echo starting; exit 1;;
+  container)
+    if [ -n "$FAKE_CTR_STOPPED" ]; then echo false; else echo true; fi;;
+esac
+"""
+
+@pytest.fixture(name="fake_docker")
+def fixture_fake_docker(tmp_path, monkeypatch):
+  bin_dir = tmp_path / "bin"
+  bin_dir.mkdir()
+  docker = bin_dir / "docker"
+  docker.write_text(FAKE_DOCKER)
+  docker.chmod(docker.stat().st_mode | stat.S_IXUSR)
+  count = tmp_path / "polls"
+  monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+  monkeypatch.setenv("FAKE_POLL_COUNT", str(count))
+  monkeypatch.setenv("FAKE_CTR_STOPPED", "")
+  return count
+
+class TestImageBake:
+
+  def test_checkpoint_tag(self):
+    assert bake.checkpoint_tag("phlummox/focal-dokku:0.1.0", "prereqs") == "phlummox/focal-dokku:0.1.0-prereqs"
+    assert bake.checkpoint_tag("localhost:5000/focal-dokku", "prereqs") == "localhost:5000/focal-dokku:prereqs"
+
+  def test_plan_stages(self):
+    stages = bake.plan_stages("base:1", "dokku:1")
+    assert [(s.name, s.image_in, s.image_out) for s in stages] == [
+      ("prereqs", "base:1", "dokku:1-prereqs"),
+      ("dokku", "dokku:1-prereqs", "dokku:1"),
+    ]
+    assert all(s.deploy_script.is_file() for s in stages)
+
+    [stage] = bake.plan_stages("base:1", "dokku:1", from_stage="dokku") # pylint: disable=unbalanced-tuple-unpacking
+    assert (stage.image_in, stage.image_out) == ("dokku:1-prereqs", "dokku:1")
+
+    with pytest.raises(bake.BakeError):
+      bake.plan_stages("base:1", "dokku:1", from_stage="nope")
+
+  def test_wait_for_systemd_polls_until_ready(self, fake_docker, monkeypatch):
+    monkeypatch.setenv("FAKE_SYSTEMD_POLLS", "3")
+    assert bake.wait_for_systemd("ctr", timeout=10, interval=0.01) == "degraded"
+    assert fake_docker.read_text().strip() == "3"
+
+  def test_wait_for_systemd_gives_up(self, fake_docker, monkeypatch):
+    monkeypatch.setenv("FAKE_SYSTEMD_POLLS", "1000")
+    with pytest.raises(bake.BakeError, match="not ready"):
+      bake.wait_for_systemd("ctr", timeout=0.05, interval=0.01)
+
+    fake_docker.unlink()
+    monkeypatch.setenv("FAKE_CTR_STOPPED", "1")
+    with pytest.raises(bake.BakeError, match="stopped"):
+      bake.wait_for_systemd("ctr", timeout=10, interval=0.01)
@@ -0,0 +1,110 @@
+
+"""
+test tests/dockerfiles/build.py, using a fake `docker` command
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import importlib.util
+import os
+import stat
+
+from pathlib import Path
+
+import pytest
+
+BUILD_SCRIPT = Path(__file__).parent / "dockerfiles" / "build.py"
+
+def load_build_module():
+  spec = importlib.util.spec_from_file_location("image_build", BUILD_SCRIPT)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module) # type: ignore
+  return module
+
+build = load_build_module()
+
+# fake docker: logs its args, reports the label in $FAKE_DOCKER_LABEL for
+# `image inspect`, and creates the cache directory for `buildx build`
+FAKE_DOCKER = """#!/usr/bin/env bash
+echo "$*" >> "$FAKE_DOCKER_LOG"
+case "$1 $2" in
+  "image inspect")
+    [ -n "$FAKE_DOCKER_LABEL" ] || exit 1
+    echo "$FAKE_DOCKER_LABEL";;
+  "buildx build")
+    for arg in "$@"; do
+      case "$arg" in type=local,dest=*) dest="${arg#type=local,dest=}"; mkdir -p "${dest%,mode=max}";; esac
+    done;;
+esac
+"""
+
+@pytest.fixture(name="context")
+def fixture_context(tmp_path):
+  context = tmp_path / "ctx"
+  context.mkdir()
+  (context / "one-Dockerfile").write_text("FROM scratch\nCOPY data /\n")
+  (context / "two-Dockerfile").write_text("FROM scratch\n")
+  (context / "data").write_text("some data\n")
+  return context
+
+@pytest.fixture(name="fake_docker")
+def fixture_fake_docker(tmp_path, monkeypatch):
+  bin_dir = tmp_path / "bin"
+  bin_dir.mkdir()
+  docker = bin_dir / "docker"
+  docker.write_text(FAKE_DOCKER)
+  docker.chmod(docker.stat().st_mode | stat.S_IXUSR)
+  log = tmp_path / "docker.log"
+  monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+  monkeypatch.setenv("FAKE_DOCKER_LOG", str(log))
+  monkeypatch.setenv("FAKE_DOCKER_LABEL", "")
+  monkeypatch.setenv("IMAGE_VERSION", "0.1.0")
+  monkeypatch.setenv("IMAGE_REPO", "example")
+  monkeypatch.chdir(tmp_path)
+  return log
+
+class TestImageBuild:
+
+  def test_image_name_for(self):
+    assert build.image_name_for(Path("tests/dockerfiles/focal-base-Dockerfile")) == "focal-base"
+    assert build.image_name_for(Path("x/Dockerfile.focal-dokku")) == "focal-dokku"
+    assert build.image_name_for(Path("/some/where/Dockerfile")) == "where"
+
+  def test_context_hash_tracks_inputs(self, context):
+    dockerfile = context / "one-Dockerfile"
+    original = build.context_hash(dockerfile)
+
+    (context / "__pycache__").mkdir()
+    (context / "__pycache__" / "x.pyc").write_bytes(b"junk")
+    (context / ".dockerignore").write_text("*.log\n")
+    (context / "build.log").write_text("ignored\n")
+    assert build.context_hash(dockerfile) != original  # .dockerignore itself is sent
+    with_ignore = build.context_hash(dockerfile)
+    (context / "build.log").write_text("still ignored\n")
+    assert build.context_hash(dockerfile) == with_ignore
+
+    (context / "data").write_text("other data\n")
+    assert build.context_hash(dockerfile) != with_ignore
+    assert build.context_hash(dockerfile, {"USER_ID": "1001"}) != build.context_hash(dockerfile)
+
+  def test_builds_images_concurrently_and_skips_unchanged(self, context, fake_docker, monkeypatch, capsys):
+    dockerfiles = [str(context / "one-Dockerfile"), str(context / "two-Dockerfile")]
+    assert build.main(dockerfiles + ["--cache-dir", "cache"]) == 0
+
+    builds = [line for line in fake_docker.read_text().splitlines() if line.startswith("buildx build")]
+    assert len(builds) == 2
+    assert any("-t example/one:0.1.0" in line for line in builds)
+    assert all(f"{build.CONTEXT_HASH_LABEL}=" in line for line in builds)
+    assert sorted(os.listdir("cache")) == ["one", "two"]
+    assert "built" in capsys.readouterr().err
+
+    # both images present with matching hashes: nothing is built
+    fake_docker.write_text("")
+    monkeypatch.setenv("FAKE_DOCKER_LABEL", build.context_hash(context / "one-Dockerfile"))
+    assert build.main(dockerfiles[:1] + ["--cache-dir", "cache"]) == 0
+    assert not [line for line in fake_docker.read_text().splitlines() if line.startswith(("buildx build", "pull"))]
+    assert "up to date" in capsys.readouterr().err
+
+    # ... unless forced; the previous cache is now imported
+    assert build.main(dockerfiles[:1] + ["--cache-dir", "cache", "--force"]) == 0
+    assert "type=local,src=cache/one" in fake_docker.read_text()
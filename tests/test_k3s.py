@@ -0,0 +1,119 @@
+
+"""
+test pyinfra_dokku.util.k3s and pyinfra_dokku.k3s modules
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import json
+
+from types import SimpleNamespace
+
+import pytest
+
+from pyinfra.api.command import StringCommand
+from pyinfra.facts.server import LinuxName
+
+from planning import plan_deploy
+from pyinfra_dokku.facts import AppScale, DokkuReports
+from pyinfra_dokku import k3s as k3s_deploy
+from pyinfra_dokku.k3s import install_k3s_cluster
+from pyinfra_dokku.util import k3s
+
+class TestK3s:
+
+  @staticmethod
+  def make_host(name, role):
+    return SimpleNamespace(name=name, data={'k3s_role': role})
+
+  def test_find_control_plane(self):
+    hosts = [self.make_host("w1", "worker"), self.make_host("cp", "server"), self.make_host("w2", "worker")]
+    assert k3s.find_control_plane(hosts).name == "cp"
+
+  @pytest.mark.parametrize("roles", [["worker"], ["server", "server"]])
+  def test_find_control_plane_needs_exactly_one(self, roles):
+    hosts = [self.make_host(f"h{i}", role) for i, role in enumerate(roles)]
+    with pytest.raises(ValueError):
+      k3s.find_control_plane(hosts)
+
+  def test_render_registries_yaml(self):
+    actual = json.loads(k3s.render_registries_yaml("registry.example.com", "user", "secret"))
+    assert actual['mirrors']['registry.example.com']['endpoint'] == ["https://registry.example.com"]
+    assert actual['configs']['registry.example.com']['auth'] == {'username': 'user', 'password': 'secret'}
+
+    assert 'configs' not in json.loads(k3s.render_registries_yaml("registry.example.com"))
+
+  def test_parse_k3s_version(self):
+    assert k3s.parse_k3s_version("k3s version v1.28.2+k3s1 (6330a5b4)\ngo version go1.20.8\n") == 'v1.28.2+k3s1'
+    assert k3s.parse_k3s_version("") is None
+
+PS_REPORT = """=====> running-app ps information
+       Deployed:                      true
+       Running:                       true
+       Status web 1:                  running (CID: 2c3b8c1f1d0f)
+=====> stopped-app ps information
+       Deployed:                      true
+       Running:                       false
+=====> new-app ps information
+       Deployed:                      false
+       Running:                       false
+"""
+
+SCALE = {'running-app': {'web': 1}, 'stopped-app': {'web': 2}, 'new-app': {'web': 1}}
+
+class TestInstallK3sCluster:
+
+  def plan(self, monkeypatch, registry=None, replicas=None):
+    facts = {LinuxName: 'Ubuntu', DokkuReports: DokkuReports().process(PS_REPORT.splitlines()), AppScale: SCALE}
+    data = {'k3s_role': 'server', 'k3s_token': 's3cret', 'dokku_registry_username': 'user', 'dokku_registry_password': 'pa$$ word'}
+    return dict(plan_deploy(monkeypatch, install_k3s_cluster, facts, registry=registry, replicas=replicas, data=data)[1])
+
+  def plan_worker(self, monkeypatch, control_plane_version, **data):
+    control_plane = SimpleNamespace(name="cp.example.com", data={'k3s_role': 'server'},
+                                    get_fact=lambda cls: control_plane_version)
+    monkeypatch.setattr(k3s_deploy, "find_control_plane", lambda hosts: control_plane)
+    data = {'k3s_role': 'worker', 'k3s_token': 's3cret', **data}
+    return dict(plan_deploy(monkeypatch, install_k3s_cluster, {LinuxName: 'Ubuntu'}, data=data)[1])
+
+  def test_token_masked_on_control_plane(self, monkeypatch):
+    facts = {LinuxName: 'Ubuntu'}
+    state, ops = plan_deploy(monkeypatch, install_k3s_cluster, facts, data={'k3s_role': 'server', 'k3s_token': 's3cret'})
+    assert "dokku scheduler-k3s:set --global token s3cret" in dict(ops)['Initialize k3s control plane']
+    local = state.inventory.get_host("@local")
+    masked = [command.get_masked_value() for op_hash in state.get_op_order()
+              for command in state.get_op_data(local, op_hash)["commands"] if isinstance(command, StringCommand)]
+    assert masked and not [command for command in masked if "s3cret" in command]
+
+  def test_worker_installs_control_plane_version(self, monkeypatch):
+    ops = self.plan_worker(monkeypatch, 'v1.28.2+k3s1')
+    assert "upload /etc/rancher/k3s/cluster-token:\ns3cret\n" in ops['Write k3s cluster token']
+    install = ops['Install k3s agent and join cluster'][0]
+    assert "INSTALL_K3S_VERSION=v1.28.2+k3s1 " in install
+    assert "K3S_TOKEN_FILE=/etc/rancher/k3s/cluster-token " in install
+    assert "s3cret" not in install
+
+    ops = self.plan_worker(monkeypatch, 'v1.28.2+k3s1', k3s_version='v1.27.6+k3s1')
+    assert "INSTALL_K3S_VERSION=v1.27.6+k3s1 " in ops['Install k3s agent and join cluster'][0]
+
+  def test_worker_waits_for_control_plane(self, monkeypatch):
+    ops = self.plan_worker(monkeypatch, None)
+    assert 'Install k3s agent and join cluster' not in ops
+    assert 'Write k3s cluster token' not in ops
+
+  def test_replicas_compared_with_configured_scale(self, monkeypatch):
+    # stopped-app runs no containers, but is already configured for web=2
+    ops = self.plan(monkeypatch, replicas={'running-app': {'web': 1}, 'stopped-app': {'web': 2}})
+    assert not [name for name in ops if name.startswith("Set replicas")]
+
+  def test_only_running_apps_redeployed(self, monkeypatch):
+    ops = self.plan(monkeypatch, replicas={'running-app': {'web': 3}, 'stopped-app': {'web': 3}, 'new-app': {'web': 3}})
+    assert ops['Set replicas for 3 app(s)'] == [
+      "dokku ps:scale --skip-deploy new-app web=3",
+      "dokku ps:scale running-app web=3",
+      "dokku ps:scale --skip-deploy stopped-app web=3",
+    ]
+
+  def test_registry_password_on_stdin(self, monkeypatch):
+    ops = self.plan(monkeypatch, registry="registry.example.com")
+    login = ops['Use registry registry.example.com'][-1]
+    assert login == "printf '%s' 'pa$$ word' | dokku registry:login --password-stdin registry.example.com user"
@@ -0,0 +1,82 @@
+
+"""
+test pyinfra_dokku.util.letsencrypt module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import os
+import subprocess
+
+import pytest
+
+from pyinfra_dokku.util import letsencrypt
+
+class TestLetsencrypt:
+
+  @pytest.fixture
+  def sample_input(self):
+    return """\
+-----> App name           Certificate Expiry        Time before expiry        Time before renewal
+node-js-app               2016-07-08 14:43:09       89d, 23h, 59m, 19s        59d, 23h, 59m, 19s
+old-app                   2016-04-08 14:43:09       3d, 1h, 59m, 19s          -26d, 1h, 59m, 19s
+"""
+
+  def test_parse_letsencrypt_list(self, sample_input):
+    assert letsencrypt.parse_letsencrypt_list(sample_input) == {'node-js-app': 89, 'old-app': 3}
+
+  def test_registered_domain(self):
+    assert letsencrypt.registered_domain("www.app.Example.com.") == "example.com"
+
+  def test_plan_skips_valid_and_reissues_changed(self):
+    plan = letsencrypt.plan_certificates(
+      apps={'valid': ['valid.example.com'],
+            'expiring': ['expiring.example.com'],
+            'changed': ['changed.example.com', 'www.example.com'],
+            'new': ['new.example.org']},
+      current_domains={'valid': ['valid.example.com'],
+                       'expiring': ['expiring.example.com'],
+                       'changed': ['changed.example.com']},
+      days_left={'valid': 80, 'expiring': 10, 'changed': 80},
+    )
+    assert plan.issue == ['changed', 'expiring', 'new']
+    assert plan.skipped == {'valid': 80}
+    assert plan.deferred == []
+
+  def test_plan_defers_over_rate_limits(self):
+    apps = {f"app{i}": [f"app{i}.example.com"] for i in range(5)}
+    plan = letsencrypt.plan_certificates(apps, {}, {}, max_per_registered_domain=2)
+    assert plan.issue == ['app0', 'app1']
+    assert plan.deferred == ['app2', 'app3', 'app4']
+
+    plan = letsencrypt.plan_certificates(apps, {}, {}, max_orders=3)
+    assert len(plan.issue) == 3
+
+  def test_plan_rejects_too_many_names(self):
+    domains = [f"d{i}.example.com" for i in range(letsencrypt.MAX_NAMES_PER_CERTIFICATE + 1)]
+    with pytest.raises(ValueError):
+      letsencrypt.plan_certificates({'app': domains}, {}, {})
+
+  def test_issue_queue_script_retries(self, tmp_path):
+    # a fake `dokku` which fails the first attempt for "flaky"
+    fake_dokku = tmp_path / "dokku"
+    fake_dokku.write_text(f"""#!/usr/bin/env bash
+echo "$2" >> {tmp_path}/calls
+if [ "$2" = flaky ] && [ ! -e {tmp_path}/flaky-seen ]; then
+  touch {tmp_path}/flaky-seen
+  exit 1
+fi
+[ "$2" != broken ]
+""")
+    fake_dokku.chmod(0o755)
+
+    script = letsencrypt.render_issue_queue_script(['good', 'flaky', 'broken'],
+                                                   concurrency=2, launch_interval=0,
+                                                   retry_attempts=2, retry_backoff=0)
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+    res = subprocess.run(["bash", "-c", script], env=env, capture_output=True, encoding="utf8", check=False)
+
+    assert res.returncode == 1
+    assert sorted(res.stdout.split("\n")) == ['', 'FAILED broken', 'ISSUED flaky', 'ISSUED good']
+    calls = (tmp_path / "calls").read_text().split()
+    assert sorted(calls) == ['broken', 'broken', 'flaky', 'flaky', 'good']
@@ -0,0 +1,116 @@
+
+"""
+test pyinfra_dokku.util.logs module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra.facts.hardware import Cpus
+
+from planning import plan_deploy
+from pyinfra_dokku.facts import DockerDaemonConfig, DokkuGlobalProperties, DokkuReports
+from pyinfra_dokku.logs import configure_logs
+from pyinfra_dokku.util import logs
+from pyinfra_dokku.util.docker_config import merge_daemon_config
+
+class TestLogs:
+
+  def test_daemon_log_config(self):
+    assert logs.daemon_log_config('local', '10m', 3) == {'log-driver': 'local', 'log-opts': {'max-size': '10m', 'max-file': '3'}}
+    assert logs.daemon_log_config('journald', '10m', 3) == {'log-driver': 'journald', 'log-opts': None}
+
+  def test_daemon_log_config_switch_drops_rotation_opts(self):
+    existing = {'log-driver': 'local', 'log-opts': {'max-size': '10m', 'max-file': '3'}, 'debug': True}
+    assert merge_daemon_config(existing, logs.daemon_log_config('journald', '10m', 3)) == {'log-driver': 'journald', 'debug': True}
+    assert merge_daemon_config({'log-driver': 'journald'}, logs.daemon_log_config('journald', '10m', 3)) == {'log-driver': 'journald'}
+
+  def test_current_log_options(self):
+    options = logs.current_log_options("--restart=on-failure:10 --log-driver=local --log-opt max-file=5")
+    assert options == {'--log-driver=local': '--log-driver=local', '--log-opt=max-file=5': '--log-opt max-file=5'}
+
+  def test_plan_replaces_changed_options(self):
+    commands = logs.plan_app_log_commands(
+      'noisy-app',
+      {'driver': 'local', 'max_file': 2, 'max_size': '5m', 'non_blocking': True},
+      {'logs max size': '10m'},
+      {'docker options deploy': '--log-driver=local --log-opt max-file=5'})
+    assert commands == [
+      "dokku docker-options:remove noisy-app deploy '--log-opt max-file=5'",
+      "dokku docker-options:add noisy-app deploy --log-opt=max-file=2",
+      "dokku docker-options:add noisy-app deploy --log-opt=mode=non-blocking",
+      "dokku docker-options:add noisy-app deploy --log-opt=max-buffer-size=1m",
+      "dokku logs:set noisy-app max-size 5m",
+    ]
+
+  def test_plan_unchanged(self):
+    assert not logs.plan_app_log_commands(
+      'api', {'driver': 'local', 'max_size': '10m', 'vector_sink': 'console://'},
+      {'logs max size': '10m', 'logs vector sink': 'console://'},
+      {'docker options deploy': '--restart=on-failure:10 --log-driver=local'})
+
+  def test_non_rotating_driver_gets_unlimited_size(self):
+    commands = logs.plan_app_log_commands('api', {'driver': 'journald', 'max_size': '10m'}, {}, {})
+    assert "dokku logs:set api max-size unlimited" in commands
+
+  def test_unknown_setting_rejected(self):
+    with pytest.raises(ValueError):
+      logs.plan_app_log_commands('api', {'sample_rate': 0.1}, {}, {})
+
+  def test_parse_log_usage_sums_containers(self):
+    assert logs.parse_log_usage("api 100\napi 50\nworker 7\nbroken\n") == {'api': 150, 'worker': 7}
+
+DOCKER_OPTIONS_REPORT = """=====> api docker options information
+       Docker options build:
+       Docker options deploy:         --restart=on-failure:10 --log-driver=local --log-opt=max-file=2
+       Docker options run:
+=====> worker docker options information
+       Docker options build:
+       Docker options deploy:         --restart=on-failure:10 --log-driver=local
+       Docker options run:
+"""
+
+LOGS_REPORT = """=====> api logs information
+       Logs max size:                 10m
+       Logs global max size:          10m
+       Logs vector sink:
+       Logs global vector sink:
+=====> worker logs information
+       Logs max size:                 10m
+       Logs global max size:          10m
+       Logs vector sink:
+       Logs global vector sink:
+"""
+
+class TestConfigureLogs:
+
+  def plan(self, monkeypatch, apps, reports=LOGS_REPORT + DOCKER_OPTIONS_REPORT, global_properties=None, **kwargs):
+    return plan_deploy(monkeypatch, configure_logs,
+                       {DokkuReports: DokkuReports().process(reports.splitlines()), Cpus: 2,
+                        DokkuGlobalProperties: {'max-size': '10m'} if global_properties is None else global_properties,
+                        DockerDaemonConfig: {'log-driver': 'local', 'log-opts': {'max-size': '10m', 'max-file': '3'}}},
+                       apps, restart_parallelism=1, **kwargs)[1]
+
+  def test_current_options_read_from_report(self, monkeypatch):
+    ops = self.plan(monkeypatch, {'api': {'driver': 'local', 'max_file': 2, 'max_size': '10m'},
+                                  'worker': {'driver': 'local'}})
+    assert not [name for name, _commands in ops if 'Configure logging' in name or 'Restart' in name]
+
+  def test_changed_driver_replaces_old_option(self, monkeypatch):
+    ops = dict(self.plan(monkeypatch, {'worker': {'driver': 'journald'}}))
+    assert ops['Configure logging (1 app(s) changed)'] == [
+      "dokku docker-options:remove worker deploy --log-driver=local",
+      "dokku docker-options:add worker deploy --log-driver=journald",
+      "dokku logs:set worker max-size unlimited",
+    ]
+    assert "worker" in ops['Restart 1 changed app(s)'][0]
+
+  def test_global_settings_read_without_apps(self, monkeypatch):
+    ops = self.plan(monkeypatch, {}, reports="", global_properties={'max-size': '10m', 'vector-sink': 'console://'},
+                    vector_sink='console://')
+    assert ops == [('Configure logging (0 app(s) changed)', ["dokku logs:vector-start"])]
+
+  def test_global_settings_changed(self, monkeypatch):
+    ops = dict(self.plan(monkeypatch, {}, reports="", global_properties={}, max_size='5m'))
+    assert ops['Configure logging (0 app(s) changed)'] == ["dokku logs:set --global max-size 5m"]
@@ -0,0 +1,67 @@
+
+"""
+test pyinfra_dokku.util.migrate module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import os
+import subprocess
+
+from pyinfra_dokku.util import migrate
+
+class TestMigrate:
+
+  def test_parse_mount_specs(self):
+    report = {'storage deploy mounts': '-v /var/lib/dokku/data/storage/node-js-app:/app/storage -v uploads:/app/uploads:ro'}
+    specs = migrate.parse_mount_specs(report)
+    assert specs == ['/var/lib/dokku/data/storage/node-js-app:/app/storage', 'uploads:/app/uploads:ro']
+    assert migrate.host_path_mounts(specs) == ['/var/lib/dokku/data/storage/node-js-app']
+
+  def test_parse_transfer_output(self):
+    output = ["noise", "TRANSFERRED image 1048576 2.00", "TRANSFERRED storage:/data 1048576 4.00", "TRANSFERRED bad x 1"]
+    transfers = migrate.parse_transfer_output(output)
+    assert transfers == [migrate.Transfer('image', 1048576, 2.0), migrate.Transfer('storage:/data', 1048576, 4.0)]
+    assert migrate.summarize_transfers(transfers) == "2097152 bytes in 4.0s (0.5 MiB/s)"
+
+  def test_transfer_script(self, tmp_path):
+    # fakes: `ssh` runs the remote command locally, `zstd` passes data
+    # through, `docker` saves/loads a fixed "image", `rsync` reports stats.
+    fakes = {
+      "ssh": '#!/usr/bin/env bash\nshift 3\nbash -c "$1"\n',
+      "zstd": "#!/usr/bin/env bash\ncat\n",
+      "docker": f"""#!/usr/bin/env bash
+case "$1" in
+  save) echo image-data ;;
+  load) cat > {tmp_path}/loaded ;;
+  tag) echo "$3" > {tmp_path}/tagged ;;
+  image) echo 11 ;;
+esac
+""",
+      "rsync": f'#!/usr/bin/env bash\necho "$@" > {tmp_path}/rsync-args\necho "Total bytes sent: 1,234"\n',
+    }
+    for name, conts in fakes.items():
+      (tmp_path / name).write_text(conts)
+      (tmp_path / name).chmod(0o755)
+
+    script = migrate.render_transfer_script("node-js-app", "root@dokku2", ["/data/storage"])
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+    res = subprocess.run(["bash", "-c", script], env=env, capture_output=True, encoding="utf8", check=False)
+    assert res.returncode == 0, res.stderr
+
+    transfers = {transfer.item: transfer.bytes for transfer in migrate.parse_transfer_output(res.stdout)}
+    assert transfers == {'image': 11, 'storage:/data/storage': 1234}
+    assert (tmp_path / "loaded").read_text() == "image-data\n"
+    assert (tmp_path / "tagged").read_text().strip() == "dokku-migrate/node-js-app:latest"
+    assert "/data/storage/ root@dokku2:/data/storage/" in (tmp_path / "rsync-args").read_text()
+
+  def test_transfer_script_fails_if_a_transfer_does(self, tmp_path):
+    (tmp_path / "ssh").write_text("#!/usr/bin/env bash\nexit 255\n")
+    (tmp_path / "ssh").chmod(0o755)
+    (tmp_path / "rsync").write_text("#!/usr/bin/env bash\nexit 12\n")
+    (tmp_path / "rsync").chmod(0o755)
+
+    script = migrate.render_transfer_script("node-js-app", "root@dokku2", ["/data/storage"], include_image=False)
+    env = dict(os.environ, PATH=f"{tmp_path}:{os.environ['PATH']}")
+    res = subprocess.run(["bash", "-c", script], env=env, capture_output=True, encoding="utf8", check=False)
+    assert res.returncode != 0
@@ -0,0 +1,135 @@
+
+"""
+test pyinfra_dokku.util.mirrors module, using local HTTP servers as
+stand-in mirrors, and switching hosts' apt sources to and from mirrors
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import functools
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pyinfra.facts.files import File
+from pyinfra.facts.server import LinuxName, LsbRelease
+
+from planning import plan_deploy
+from pyinfra_dokku.facts import DpkgArchitecture
+from pyinfra_dokku.install import install_dokku_prerequisites
+from pyinfra_dokku.util import mirrors
+
+class SlowHandler(SimpleHTTPRequestHandler):
+  delay = 0.5
+
+  def do_GET(self): # pylint: disable=invalid-name
+    time.sleep(self.delay)
+    super().do_GET()
+
+  def log_message(self, *args): # pylint: disable=arguments-differ
+    pass
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+  def log_message(self, *args): # pylint: disable=arguments-differ
+    pass
+
+@pytest.fixture(name="serve_mirror")
+def fixture_serve_mirror(tmp_path):
+  servers = []
+
+  def serve(name, handler=QuietHandler, codename='focal'):
+    root = tmp_path / name
+    (root / 'dists' / codename).mkdir(parents=True)
+    (root / 'dists' / codename / 'Release').write_bytes(b'x' * 256 * 1024)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(handler, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    servers.append(server)
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+  yield serve
+  for server in servers:
+    server.shutdown()
+    server.server_close()
+
+def closed_port_url():
+  with socket.socket() as sock:
+    sock.bind(('127.0.0.1', 0))
+    return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+class TestMirrors:
+
+  def test_parse_probe_output(self):
+    probes = mirrors.parse_probe_output(
+      "http://a/dists/focal/Release 200 0.010 1000000.000\n"
+      "http://b/dists/focal/Release 404 0.020 100.000\n"
+      "http://c/dists/focal/Release 000 0 0\n"
+    )
+    assert probes['http://a/dists/focal/Release'] == mirrors.Probe(True, 0.01, 1000000.0)
+    assert not probes['http://b/dists/focal/Release'].ok
+    assert probes['http://c/dists/focal/Release'] == mirrors.Probe(False, 0.0, 0.0)
+
+  def test_rank_mirrors(self):
+    probes = {
+      'http://slow/dists/focal/Release': mirrors.Probe(True, 0.001, 100_000.0),
+      'http://far/dists/focal/Release':  mirrors.Probe(True, 0.300, 50_000_000.0),
+      'http://down/dists/focal/Release': mirrors.Probe(False, 0.0, 0.0),
+    }
+    ranked = mirrors.rank_mirrors(['http://down', 'http://slow', 'http://far', 'http://unprobed'], probes, 'focal')
+    assert ranked == ['http://far', 'http://slow', 'http://down', 'http://unprobed']
+
+  def test_render_mirror_list(self):
+    assert mirrors.render_mirror_list(['http://a/ubuntu', 'http://b/ubuntu']) == \
+      "http://a/ubuntu\tpriority:1\nhttp://b/ubuntu\tpriority:2\n"
+
+  def test_render_ubuntu_sources(self):
+    sources = mirrors.render_ubuntu_sources('focal').splitlines()
+    assert sources[0] == "deb mirror+file:/etc/apt/mirrors/ubuntu.list focal main restricted universe multiverse"
+    assert [line.split()[2] for line in sources] == ['focal', 'focal-updates', 'focal-backports']
+
+  @pytest.mark.skipif(shutil.which('curl') is None, reason="needs curl")
+  def test_probe_local_mirrors(self, serve_mirror):
+    fast = serve_mirror('fast')
+    slow = serve_mirror('slow', handler=SlowHandler)
+    missing = serve_mirror('missing', codename='jammy')
+    down = closed_port_url()
+    candidates = [down, slow, missing, fast]
+
+    command = mirrors.render_probe_command([mirrors.probe_url(base, 'focal') for base in candidates], timeout=5)
+    result = subprocess.run(command, shell=True, executable='bash', capture_output=True, text=True, check=True)
+    probes = mirrors.parse_probe_output(result.stdout)
+
+    assert len(probes) == 4
+    assert probes[mirrors.probe_url(fast, 'focal')].ok
+    assert not probes[mirrors.probe_url(missing, 'focal')].ok
+    assert not probes[mirrors.probe_url(down, 'focal')].ok
+    assert mirrors.rank_mirrors(candidates, probes, 'focal') == [fast, slow, down, missing]
+
+class TestMirrorSwitching:
+
+  def plan(self, monkeypatch, mirror_candidates, mirrors_in_use):
+    facts = {LinuxName: 'Ubuntu', LsbRelease: {'id': 'Ubuntu', 'codename': 'focal'}, DpkgArchitecture: 'amd64',
+             File: {'size': 100, 'mode': 644, 'user': 'root', 'group': 'root'} if mirrors_in_use else None}
+    return dict(plan_deploy(monkeypatch, install_dokku_prerequisites, facts, mirror_candidates)[1])
+
+  def test_into_mirror_mode(self, monkeypatch):
+    ops = self.plan(monkeypatch, {'ubuntu': ['http://mirror.example.com/ubuntu'],
+                                  'docker': ['http://mirror.example.com/docker']}, False)
+    # the whole file is replaced, so the original repo line doesn't linger
+    assert ops['Add the Docker apt repo'][0] == (
+      "upload /etc/apt/sources.list.d/docker.list:\ndeb [arch=amd64] mirror+file:/etc/apt/mirrors/docker.list focal stable\n")
+    assert ops['Add the Dokku apt repo'][0].endswith("\ndeb [arch=amd64] https://packagecloud.io/dokku/dokku/ubuntu/ focal main\n")
+    assert 'Add Ubuntu apt sources using mirror list' in ops
+    assert 'Remove Ubuntu apt sources using mirror list' not in ops
+
+  def test_out_of_mirror_mode(self, monkeypatch):
+    ops = self.plan(monkeypatch, None, True)
+    assert "upload /etc/apt/sources.list.d/docker.list:\ndeb [arch=amd64] https://download.docker.com/linux/ubuntu focal stable\n" in ops['Add the Docker apt repo']
+    assert ops['Remove Ubuntu apt sources using mirror list'] == ["rm -f /etc/apt/sources.list.d/ubuntu-mirrors.list"]
+    assert ops['Re-enable default Ubuntu apt sources'][0].startswith("sed -i -E 's/^# (deb(-src)?")
@@ -0,0 +1,52 @@
+
+"""
+test pyinfra_dokku.util.networks module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra_dokku.util import networks
+from pyinfra_dokku.util.dokku_reports import parse_report
+
+class TestNetworks:
+
+  @pytest.fixture
+  def reports(self):
+    return parse_report("""\
+=====> api network information
+       Network attach post create:
+       Network attach post deploy:    internal other
+       Network bind all interfaces:   false
+=====> worker network information
+       Network attach post create:
+       Network attach post deploy:
+       Network bind all interfaces:   false
+""")['network']
+
+  def test_unchanged_settings_give_no_commands(self, reports):
+    commands, changed = networks.plan_network_commands(
+      ['internal'], {'api': {'attach-post-deploy': ['other', 'internal'], 'bind-all-interfaces': False}},
+      ['bridge', 'host', 'internal'], reports)
+    assert not commands
+    assert not changed
+
+  def test_plan_creates_networks_and_sets_properties(self, reports):
+    commands, changed = networks.plan_network_commands(
+      ['internal'], {'api': {'attach-post-deploy': 'internal'}, 'worker': {'attach-post-create': ['internal']}},
+      ['bridge'], reports)
+    assert commands == [
+      'dokku network:create internal',
+      'dokku network:set api attach-post-deploy internal',
+      'dokku network:set worker attach-post-create internal',
+    ]
+    assert changed == ['api', 'worker']
+
+  def test_unknown_property_rejected(self, reports):
+    with pytest.raises(ValueError):
+      networks.plan_network_commands([], {'api': {'attach-sometime': 'internal'}}, [], reports)
+
+  def test_app_network_hosts(self):
+    assert networks.app_network_hosts({'api': {'attach-post-deploy': ['internal']}, 'worker': {'attach-post-create': 'internal'}}) == \
+        {'internal': ['api', 'worker']}
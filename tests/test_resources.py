@@ -0,0 +1,99 @@
+
+"""
+test pyinfra_dokku.util.resources and pyinfra_dokku.util.dokku_reports modules
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra.facts.hardware import Cpus
+
+from planning import plan_deploy
+from pyinfra_dokku.facts import AppScale, DokkuReports
+from pyinfra_dokku.resources import configure_app_resources
+from pyinfra_dokku.util import dokku_reports, resources
+
+SCALE_OUTPUT = """\
+=====> node-js-app
+-----> Scaling for node-js-app
+proctype: qty
+--------: ---
+web:  1
+worker: 0
+=====> stopped-app
+-----> Scaling for stopped-app
+proctype: qty
+--------: ---
+web:  2
+=====> missing-app
+"""
+
+class TestResources:
+
+  @pytest.fixture
+  def sample_report(self):
+    return """\
+=====> node-js-app resource information
+       _default_ limit cpu:           1
+       _default_ limit memory:
+       _default_ reserve memory:      256m
+=====> node-js-app ps information
+       Deployed:                      true
+       Processes:                     2
+       Status web 1:                  running (CID: 2c3b8c1f1d0f)
+       Status worker 1:               running (CID: 6e8d0f8ec1b2)
+"""
+
+  def test_parse_report(self, sample_report):
+    actual = dokku_reports.parse_report(sample_report)
+    assert actual['resource']['node-js-app']['_default_ limit cpu'] == '1'
+    assert actual['resource']['node-js-app']['_default_ limit memory'] == ''
+    assert actual['ps']['node-js-app']['processes'] == '2'
+
+  def test_parse_scale(self):
+    assert resources.parse_scale(SCALE_OUTPUT) == {'node-js-app': {'web': 1, 'worker': 0}, 'stopped-app': {'web': 2}, 'missing-app': {}}
+    assert "printf '%s\\n' node-js-app | while read -r app" in resources.render_scale_command(['node-js-app'])
+
+  def test_defaults_from_cores(self):
+    actual = resources.resolve_resource_spec({'app': {'limit': {'memory': '1g'}}}, cpus=8)
+    assert actual['app']['limit'] == {'cpu': 4, 'memory': '1g'}
+    assert resources.default_restart_parallelism(1) == 1
+
+  def test_unknown_spec_key_rejected(self):
+    with pytest.raises(ValueError):
+      resources.resolve_resource_spec({'app': {'limits': {}}}, cpus=2)
+
+  def test_no_changes_needed(self, sample_report):
+    reports = dokku_reports.parse_report(sample_report)
+    desired = resources.resolve_resource_spec(
+      {'node-js-app': {'limit': {'cpu': 1}, 'reserve': {'memory': '256m'}, 'scale': {'web': 1}}},
+      cpus=2)
+    assert resources.plan_resource_commands('node-js-app', desired['node-js-app'], reports, {'web': 1, 'worker': 0}) == []
+
+  def test_changes_batched_per_kind(self, sample_report):
+    reports = dokku_reports.parse_report(sample_report)
+    desired = resources.resolve_resource_spec(
+      {'node-js-app': {'limit': {'cpu': 2, 'memory': '512m'}, 'scale': {'web': 3}}},
+      cpus=2)
+    actual = resources.plan_resource_commands('node-js-app', desired['node-js-app'], reports, {'web': 1, 'worker': 0})
+    assert actual == [
+      "dokku resource:limit --cpu 2 --memory 512m node-js-app",
+      "dokku ps:scale --skip-deploy node-js-app web=3",
+    ]
+
+  def test_stopped_app_at_configured_scale_left_alone(self, monkeypatch):
+    # stopped-app runs no containers, but is already configured for web=2
+    reports = dokku_reports.parse_report("""\
+=====> stopped-app resource information
+       _default_ limit cpu:           1
+""")
+    _state, ops = plan_deploy(monkeypatch, configure_app_resources,
+                              {Cpus: 2, DokkuReports: reports, AppScale: resources.parse_scale(SCALE_OUTPUT)},
+                              {'stopped-app': {'scale': {'web': 2}}})
+    assert not ops
+
+    _state, ops = plan_deploy(monkeypatch, configure_app_resources,
+                              {Cpus: 2, DokkuReports: reports, AppScale: resources.parse_scale(SCALE_OUTPUT)},
+                              {'stopped-app': {'scale': {'web': 3}}})
+    assert [commands for _name, commands in ops][0] == ["dokku ps:scale --skip-deploy stopped-app web=3"]
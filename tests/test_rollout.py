@@ -0,0 +1,72 @@
+
+"""
+test pyinfra_dokku.rollout and pyinfra_dokku.util.rollout modules
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra.api import deploy
+from pyinfra.operations import server
+
+from pyinfra_dokku import rollout
+from pyinfra_dokku.util.rollout import plan_waves, run_waves
+
+@deploy("Run a local command")
+def run_command(command):
+  # pylint: disable=unexpected-keyword-arg
+  server.shell(name="run command", commands=command)
+
+@deploy("Fail while planning")
+def fail_planning():
+  raise ValueError("bad deploy args")
+
+class TestRollout:
+
+  def test_plan_waves(self):
+    hosts = [f"h{i}" for i in range(12)]
+    assert [len(wave) for wave in plan_waves(hosts)] == [1, 2, 4, 5]
+    assert [len(wave) for wave in plan_waves(hosts, canary=2, growth=3, max_wave_size=4)] == [2, 4, 4, 2]
+    assert sum(plan_waves(hosts, growth=1.5), []) == hosts
+
+  def test_bad_canary_rejected(self):
+    with pytest.raises(ValueError):
+      plan_waves(["h1"], canary=0)
+
+  def test_rollout_aborts_over_failure_threshold(self):
+    waves = [["h1"], ["h2", "h3"], ["h4", "h5", "h6", "h7"], ["h8"]]
+    run = []
+    def run_wave(wave):
+      run.append(wave)
+      return [name for name in wave if name in ("h2", "h4", "h5")]
+
+    result = run_waves(waves, run_wave, max_failure_fraction=0.3)
+    # after wave 2, 1/3 of hosts have failed
+    assert result.aborted
+    assert run == waves[:2]
+    assert result.failed == ["h2"]
+
+    result = run_waves(waves, run_wave, max_failure_fraction=0.5)
+    assert not result.aborted
+    assert len(result.waves) == 4
+    assert all(wave.seconds >= 0 for wave in result.waves)
+
+  def test_local_rollout_with_health_check(self):
+    checked = []
+    result = rollout.rollout(["@local"], run_command, "true", health_check=lambda: checked.append(True))
+    assert result.failed == []
+    assert checked == [True]
+
+  def test_failed_deploy_aborts(self):
+    result = rollout.rollout(["@local"], run_command, "false", health_check=None)
+    assert result.failed == ["@local"]
+
+  def test_deploy_raising_fails_wave(self, monkeypatch):
+    disconnected = []
+    real_disconnect_all = rollout.disconnect_all
+    monkeypatch.setattr(rollout, "disconnect_all", lambda state: disconnected.append(state) or real_disconnect_all(state))
+    checked = []
+    assert rollout.run_wave(["@local"], fail_planning, health_check=lambda: checked.append(True)) == {"@local"}
+    assert not checked
+    assert len(disconnected) == 1
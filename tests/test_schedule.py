@@ -0,0 +1,45 @@
+
+"""
+test pyinfra_dokku.util.schedule module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra_dokku.util import schedule
+
+class TestSchedule:
+
+  @pytest.fixture
+  def host_names(self):
+    return [f"dokku{i}.example.com" for i in range(8)]
+
+  def test_hashed_slot_is_deterministic(self):
+    first = schedule.hashed_slot("dokku1.example.com", salt="renew")
+    assert first == schedule.hashed_slot("dokku1.example.com", salt="renew")
+    assert 0 <= first < schedule.MINUTES_PER_DAY
+
+  def test_hashed_slots_differ_between_hosts(self, host_names):
+    slots = {schedule.hashed_slot(name) for name in host_names}
+    assert len(slots) > 1
+
+  def test_spread_slots_evenly_spaced(self, host_names):
+    slots = sorted(schedule.spread_slot(name, host_names) for name in host_names)
+    assert slots == [i * 180 for i in range(8)]
+
+  def test_spread_slot_ignores_inventory_order(self, host_names):
+    assert schedule.spread_slot(host_names[3], host_names) == \
+        schedule.spread_slot(host_names[3], list(reversed(host_names)))
+
+  def test_unknown_strategy_rejected(self, host_names):
+    with pytest.raises(ValueError):
+      schedule.host_slot("random", host_names[0], host_names)
+
+  def test_daily_cron_line(self):
+    assert schedule.daily_cron_line(125, "dokku", "/usr/bin/dokku letsencrypt:auto-renew") == \
+        "5 2 * * * dokku /usr/bin/dokku letsencrypt:auto-renew"
+
+  def test_daily_on_calendar(self):
+    assert schedule.daily_on_calendar(65) == "*-*-* 01:05:00"
+    assert schedule.daily_on_calendar(schedule.MINUTES_PER_DAY + 65) == "*-*-* 01:05:00"
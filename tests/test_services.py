@@ -0,0 +1,74 @@
+
+"""
+test pyinfra_dokku.util.services module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import subprocess
+
+import pytest
+
+from pyinfra_dokku.util import services
+
+class TestServices:
+
+  def test_postgres_settings_scale_with_memory(self):
+    settings = services.postgres_settings(4096, max_connections=100)
+    assert settings['shared_buffers'] == '1024MB'
+    assert settings['effective_cache_size'] == '3072MB'
+    assert settings['work_mem'] == '10485kB'
+    assert settings['maintenance_work_mem'] == '256MB'
+
+  def test_redis_persistence(self):
+    cache = services.redis_settings(1024, 'none')
+    assert cache['maxmemory'] == '768mb'
+    assert cache['maxmemory-policy'] == 'allkeys-lru'
+    assert cache['save'] == '""'
+    assert services.redis_settings(1024, 'aof')['appendonly'] == 'yes'
+    with pytest.raises(ValueError):
+      services.redis_settings(1024, 'sometimes')
+
+  def test_resolve_splits_memory_between_unsized_services(self):
+    resolved = services.resolve_service_specs(
+      {'postgres': {'db': {'apps': ['b', 'a']}},
+       'redis': {'cache': {'memory_mb': 1024, 'persistence': 'none'},
+                 'queue': {'settings': {'maxmemory-policy': 'volatile-lru'}}}},
+      host_memory_mb=8192, memory_fraction=0.5)
+    assert resolved['postgres']['db']['apps'] == ['a', 'b']
+    # (4096 - 1024) / 2 unsized services
+    assert resolved['postgres']['db']['settings']['shared_buffers'] == '384MB'
+    assert resolved['redis']['cache']['settings']['maxmemory'] == '768mb'
+    assert resolved['redis']['queue']['settings']['maxmemory-policy'] == 'volatile-lru'
+
+  def test_unknown_plugin_rejected(self):
+    with pytest.raises(ValueError):
+      services.resolve_service_specs({'mysql': {'db': {}}}, 1024)
+
+  def test_parse_and_diff_settings(self):
+    conf = """\
+# comment
+shared_buffers = 128MB			# min 128kB
+#work_mem = 4MB
+max_connections = 100
+timezone = 'Etc/UTC'
+"""
+    current = services.parse_service_config(conf)
+    assert current == {'shared_buffers': '128MB', 'max_connections': '100', 'timezone': "'Etc/UTC'"}
+    assert services.changed_settings(current, {'shared_buffers': '128mb', 'max_connections': '100', 'work_mem': '8MB', 'timezone': 'Etc/UTC'}) == \
+        {'work_mem': '8MB'}
+
+  def test_settings_commands_replace_lines(self, tmp_path, monkeypatch):
+    monkeypatch.setattr(services, 'SERVICES_ROOT', str(tmp_path))
+    conf = tmp_path / "redis" / "cache" / "config" / "redis.conf"
+    conf.parent.mkdir(parents=True)
+    conf.write_text("maxmemory 100mb\nmaxmemory-policy noeviction\nsave 900 1\nsave 300 10\n")
+
+    commands = services.render_settings_commands('redis', 'cache', {'maxmemory': '768mb', 'save': '""'})
+    subprocess.run(["bash", "-c", " && ".join(commands)], check=True)
+    assert services.parse_service_config(conf.read_text()) == {'maxmemory-policy': 'noeviction', 'maxmemory': '768mb', 'save': '""'}
+    assert conf.read_text().count("save") == 1
+
+  def test_invalid_setting_name_rejected(self):
+    with pytest.raises(ValueError):
+      services.render_settings_commands('postgres', 'db', {'x; rm -rf /': '1'})
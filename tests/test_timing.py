@@ -0,0 +1,57 @@
+
+"""
+test the pyinfra timing helpers in tests/timing.py
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import subprocess
+
+import timing
+import utils
+
+class TestTiming:
+
+  def test_parse_operation_timings(self):
+    deploy_timing = timing.DeployTiming()
+    for stamp, line in [
+      (0.0, "--> Connecting to hosts..."),
+      (1.0, "--> Preparing Operations..."),
+      (3.0, "--> Beginning operation run..."),
+      (3.0, "--> Starting operation: \x1b[1mInstall required packages\x1b[0m "),
+      (5.5, "    [host1] Success"),
+      (7.0, "    [host2] No changes"),
+      (7.0, "--> Starting serial operation: configure dokku "),
+      (8.0, "    [host1] Error: executed 0/1 commands"),
+      (9.0, "--> Results:"),
+    ]:
+      deploy_timing.feed(stamp, line)
+    deploy_timing.finish()
+
+    result = deploy_timing.as_dict()
+    assert result['phases'] == {'connect': 1.0, 'prepare': 2.0, 'execute': 6.0, 'results': 0.0}
+    assert [(op['operation'], op['host'], op['status'], op['seconds']) for op in result['operations']] == [
+      ('Install required packages', 'host1', 'Success', 2.5),
+      ('Install required packages', 'host2', 'No changes', 4.0),
+      ('configure dokku', 'host1', 'Error', 1.0),
+    ]
+
+  def test_stream_lines_timestamps_lines_as_they_arrive(self):
+    script = "printf 'one\\ntw'; sleep 0.3; printf 'o\\nthree'"
+    with subprocess.Popen(["bash", "-c", script], stdout=subprocess.PIPE) as proc:
+      seen = []
+      ring = timing.stream_lines(proc.stdout, lambda stamp, line: seen.append((stamp, line)), ring_size=2)
+    assert [line for _stamp, line in seen] == ["one", "two", "three"]
+    assert seen[1][0] - seen[0][0] >= 0.25
+    assert [line for _stamp, line in ring] == ["two", "three"]
+
+  def test_run_pyinfra_records_timings(self, monkeypatch):
+    monkeypatch.setattr(timing, "SESSION_TIMINGS", [])
+    utils._run_pyinfra("@local", "./tests/deploy_scripts/bogus.py") # pylint: disable=protected-access
+
+    assert len(timing.SESSION_TIMINGS) == 1
+    run = timing.SESSION_TIMINGS[0]
+    assert run['test'].endswith("test_run_pyinfra_records_timings")
+    assert set(run['phases']) >= {'connect', 'prepare', 'execute'}
+    assert [(op['operation'], op['host']) for op in run['operations']] == [("Run an ad-hoc command", "@local")]
+    assert any("Run an ad-hoc command" in line for line in timing.summarize_timings(timing.SESSION_TIMINGS))
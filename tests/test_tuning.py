@@ -0,0 +1,66 @@
+
+"""
+test pyinfra_dokku.util.tuning module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import pytest
+
+from pyinfra.api import deploy
+from pyinfra.facts.server import Sysctl
+
+from planning import plan_deploy
+from pyinfra_dokku.tuning import _tune_sysctl
+from pyinfra_dokku.util import tuning
+
+@deploy("Tune sysctl")
+def tune_sysctl(settings):
+  _tune_sysctl(settings)
+
+class TestTuning:
+
+  def test_unknown_profile_rejected(self):
+    with pytest.raises(ValueError):
+      tuning.compute_tuning("bogus", 2, 2048)
+
+  def test_values_scale_with_host(self):
+    small = tuning.compute_tuning("default", 1, 1024)
+    large = tuning.compute_tuning("default", 16, 65536)
+
+    assert small['sysctl']['net.core.somaxconn'] < large['sysctl']['net.core.somaxconn']
+    assert small['sysctl']['net.netfilter.nf_conntrack_max'] < large['sysctl']['net.netfilter.nf_conntrack_max']
+    assert small['swap_mb'] == 1024
+    assert large['swap_mb'] == 0
+
+  def test_high_connection_profile(self):
+    actual = tuning.compute_tuning("high-connection", 2, 4096)
+    assert actual['sysctl']['net.ipv4.ip_local_port_range'] == [1024, 65535]
+    assert actual['sysctl']['net.core.somaxconn'] == tuning.MAX_SOMAXCONN
+    assert actual['nofile'] == 1048576
+
+  def test_build_profile_swap(self):
+    assert tuning.compute_swap_mb("build", 1024) == 2048
+    assert tuning.compute_swap_mb("build", 65536) == 4096
+
+  def test_render_sysctl_conf(self):
+    actual = tuning.render_sysctl_conf({'vm.swappiness': 10, 'net.core.somaxconn': 4096, 'net.ipv4.ip_local_port_range': [1024, 65535]})
+    assert actual.splitlines()[1:] == ['net.core.somaxconn = 4096', 'net.ipv4.ip_local_port_range = 1024 65535', 'vm.swappiness = 10']
+
+  def test_unchanged_sysctls_not_reapplied(self, monkeypatch):
+    settings = tuning.compute_tuning("high-connection", 2, 4096)['sysctl']
+    # live values as `sysctl -a` prints them, parsed by pyinfra's fact
+    lines = [f"{key} = {value}" for key, value in settings.items() if key not in ('vm.swappiness', 'net.ipv4.ip_local_port_range')]
+    lines += ["vm.swappiness = 60", "net.ipv4.ip_local_port_range = 1024\t65535"]
+    live = Sysctl().process(lines)
+    _state, ops = plan_deploy(monkeypatch, tune_sysctl, {Sysctl: live}, settings)
+    applied = [commands for name, commands in ops if name.startswith("Apply sysctl") and commands]
+    assert applied == [["sysctl vm.swappiness='10'"]]
+
+  @pytest.mark.parametrize("sample_input,expected_output", [
+    ("always [madvise] never\n", "madvise"),
+    (["[always] madvise never"], "always"),
+    ("", None),
+  ])
+  def test_parse_thp_mode(self, sample_input, expected_output):
+    assert tuning.parse_thp_mode(sample_input) == expected_output
@@ -0,0 +1,77 @@
+
+"""
+test pyinfra_dokku.util.vouch module
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+from pyinfra_dokku.util import dokku_reports, vouch
+
+DOCKER_OPTIONS_REPORT = """=====> vouch docker options information
+       Docker options build:
+       Docker options deploy:         --restart=on-failure:10 -p 127.0.0.1:9090:9090
+       Docker options run:
+"""
+
+
+class TestVouchEnv:
+
+  def test_defaults(self):
+    env = vouch.vouch_env('vouch.example.com', {'provider': 'github', 'client_id': 'abc'})
+    assert env['VOUCH_DOMAINS'] == 'example.com'
+    assert env['VOUCH_ALLOWALLUSERS'] == 'true'
+    assert 'VOUCH_WHITELIST' not in env
+    assert env['OAUTH_PROVIDER'] == 'github'
+    assert env['OAUTH_CLIENT_ID'] == 'abc'
+    assert env['OAUTH_CALLBACK_URL'] == 'https://vouch.example.com/auth'
+    assert env['VOUCH_PORT'] == '9090'
+
+  def test_whitelist_and_cookie_domains(self):
+    env = vouch.vouch_env('vouch.example.com', {}, cookie_domains=['a.org', 'b.org'],
+                          whitelist=['me@a.org', 'you@b.org'])
+    assert env['VOUCH_DOMAINS'] == 'a.org,b.org'
+    assert env['VOUCH_WHITELIST'] == 'me@a.org,you@b.org'
+    assert 'VOUCH_ALLOWALLUSERS' not in env
+
+  def test_default_cookie_domain(self):
+    assert vouch.default_cookie_domain('vouch.example.com') == 'example.com'
+    assert vouch.default_cookie_domain('example.com') == 'example.com'
+
+
+class TestPlanConfigSet:
+
+  def test_only_changed_vars_set(self):
+    command = vouch.plan_config_set_command('vouch', {'A': '1', 'B': 'two words'}, {'A': '1'})
+    assert command == "dokku config:set --no-restart vouch B='two words'"
+
+  def test_nothing_to_do(self):
+    assert vouch.plan_config_set_command('vouch', {'A': '1'}, {'A': '1', 'C': '3'}) is None
+
+
+class TestNginxConf:
+
+  def test_http_conf(self):
+    conf = vouch.render_vouch_http_conf(port=9191, keepalive=8, cookie_name='Auth')
+    assert "server 127.0.0.1:9191;" in conf
+    assert "keepalive 8;" in conf
+    assert f"keys_zone={vouch.VOUCH_CACHE_ZONE}:" in conf
+    assert "map $cookie_Auth $vouch_no_cookie" in conf
+
+  def test_app_conf_caches_per_cookie(self):
+    conf = vouch.render_protected_app_conf('vouch.example.com', cache_seconds=45)
+    assert f"auth_request {vouch.VOUCH_VALIDATE_LOCATION};" in conf
+    assert f"proxy_pass            http://{vouch.VOUCH_UPSTREAM}/validate;" in conf
+    assert 'proxy_set_header      Connection "";' in conf
+    assert 'proxy_cache_key       "$http_host$cookie_VouchCookie";' in conf
+    assert "proxy_cache_valid     200 45s;" in conf
+    assert "proxy_no_cache        $vouch_no_cookie;" in conf
+    assert "return 302 https://vouch.example.com/login?url=" in conf
+
+  def test_app_conf_without_cache(self):
+    conf = vouch.render_protected_app_conf('vouch.example.com', cache_seconds=0)
+    assert "proxy_cache" not in conf
+    assert "proxy_pass            http://vouch_auth/validate;" in conf
+
+  def test_docker_option_in_report(self):
+    report = dokku_reports.parse_report(DOCKER_OPTIONS_REPORT)
+    assert vouch.vouch_docker_option(9090) in report['docker options']['vouch']['docker options deploy']
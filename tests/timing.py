@@ -0,0 +1,175 @@
+
+"""
+collect per-operation timings from pyinfra's output, for test runs
+
+"""
+
+# pylint: disable=missing-class-docstring,missing-function-docstring,line-too-long,no-self-use
+
+import json
+import os
+import re
+import selectors
+import time
+
+from collections  import deque
+from typing       import Any, Callable, Deque, Dict, IO, List, Optional, Tuple
+
+# ANSI colour/style escapes, which pyinfra adds to some lines
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+PHASE_RE    = re.compile(r"^--> (Connecting to hosts|Preparing Operations|Beginning operation run|Results)")
+OP_START_RE = re.compile(r"^--> Starting (?:[\w ,]+ )?operation: (?P<name>.*?)\s*$")
+OP_END_RE   = re.compile(r"^\s*\[(?P<host>[^\]]+)\] (?P<status>Success|No changes|Error|Skipped)")
+
+PHASE_NAMES = {
+  'Connecting to hosts': 'connect',
+  'Preparing Operations': 'prepare',
+  'Beginning operation run': 'execute',
+  'Results': 'results',
+}
+
+# timings collected during this pytest session; see conftest.py
+SESSION_TIMINGS: List[Dict[str, Any]] = []
+
+
+def stream_lines(stream: IO[bytes],
+                 on_line: Callable[[float, str], None],
+                 ring_size: int = 200,
+                 clock: Callable[[], float] = time.monotonic,
+) -> Deque[Tuple[float, str]]:
+  """
+  read `stream` (e.g. a subprocess's stdout) without blocking on partial
+  lines, until end of file; call `on_line(timestamp, line)` for each
+  complete line as soon as it arrives.
+
+  returns a ring buffer of the last `ring_size` (timestamp, line) pairs,
+  e.g. for reporting what led up to a failure.
+  """
+
+  ring: Deque[Tuple[float, str]] = deque(maxlen=ring_size)
+  fd = stream.fileno()
+  os.set_blocking(fd, False)
+  pending = b""
+
+  def emit(raw: bytes):
+    stamp = clock()
+    line = str(raw, 'utf-8', errors='replace').rstrip("\r\n")
+    ring.append((stamp, line))
+    on_line(stamp, line)
+
+  with selectors.DefaultSelector() as selector:
+    selector.register(fd, selectors.EVENT_READ)
+    while True:
+      selector.select()
+      try:
+        chunk = os.read(fd, 65536)
+      except BlockingIOError:
+        continue
+      if not chunk:
+        break
+      pending += chunk
+      *lines, pending = pending.split(b"\n")
+      for raw in lines:
+        emit(raw)
+
+  if pending:
+    emit(pending)
+  return ring
+
+
+class DeployTiming:
+
+  """
+  Parses timestamped lines of `pyinfra` output (fed to `feed`) into
+  durations of pyinfra's phases (connect, prepare, execute), and of each
+  operation on each host.
+
+  An operation's duration on a host is measured from the operation's
+  "Starting operation" line to the host's result line, since hosts run
+  each operation in parallel.
+  """
+
+  def __init__(self):
+    self.phases: Dict[str, float] = {}
+    self.operations: List[Dict[str, Any]] = []
+    self._phase: Optional[Tuple[str, float]] = None
+    self._op: Optional[Tuple[str, float]] = None
+    self._last = 0.0
+
+  def _end_phase(self, stamp: float):
+    if self._phase:
+      name, started = self._phase
+      self.phases[name] = self.phases.get(name, 0.0) + stamp - started
+      self._phase = None
+
+  def feed(self, stamp: float, line: str):
+    self._last = stamp
+    line = ANSI_ESCAPE_RE.sub("", line)
+
+    match = PHASE_RE.match(line)
+    if match:
+      self._end_phase(stamp)
+      self._phase = (PHASE_NAMES[match.group(1)], stamp)
+      return
+
+    match = OP_START_RE.match(line)
+    if match:
+      self._op = (match.group('name'), stamp)
+      return
+
+    match = OP_END_RE.match(line)
+    if match and self._op:
+      name, started = self._op
+      self.operations.append({
+        'operation': name,
+        'host': match.group('host'),
+        'status': match.group('status'),
+        'seconds': round(stamp - started, 3),
+      })
+
+  def finish(self):
+    self._end_phase(self._last)
+
+  def as_dict(self) -> Dict[str, Any]:
+    return {
+      'phases': {name: round(secs, 3) for name, secs in self.phases.items()},
+      'operations': self.operations,
+    }
+
+
+def record_timing(command: str, timing: DeployTiming):
+  """
+  add `timing` (for a run of `command`) to SESSION_TIMINGS, under the
+  currently running test.
+  """
+
+  test_id = os.environ.get("PYTEST_CURRENT_TEST", "unknown").rsplit(" ", 1)[0]
+  SESSION_TIMINGS.append(dict(test=test_id, command=command, **timing.as_dict()))
+
+
+def write_timings(path: str, timings: List[Dict[str, Any]]):
+  with open(path, "w", encoding="utf8") as outfile:
+    json.dump(timings, outfile, indent=2)
+
+
+def summarize_timings(timings: List[Dict[str, Any]], top: int = 5) -> List[str]:
+  """
+  return lines summarizing `timings`: total pyinfra time per test, and the
+  `top` slowest operations (on any host).
+  """
+
+  lines = []
+  per_test: Dict[str, float] = {}
+  for run in timings:
+    per_test[run['test']] = per_test.get(run['test'], 0.0) + sum(run['phases'].values())
+  for test, secs in sorted(per_test.items(), key=lambda item: -item[1]):
+    lines.append(f"{secs:8.1f}s  {test}")
+
+  ops = [(op['seconds'], op['operation'], op['host'], run['test'])
+         for run in timings for op in run['operations']]
+  if ops:
+    lines.append("slowest operations:")
+    for secs, name, host, test in sorted(ops, reverse=True)[:top]:
+      lines.append(f"{secs:8.1f}s  {name} [{host}] ({test})")
+  return lines
@@ -12,10 +12,12 @@ import subprocess
 
 from os           import environ
 from types        import MappingProxyType
-from typing       import Any, List, Mapping, NamedTuple, Optional, Sequence, Union
+from typing       import Any, Callable, List, Mapping, NamedTuple, Optional, Sequence, Union
 
 import testinfra
 
+from timing       import DeployTiming, record_timing, stream_lines
+
 
 class PyinfraInvocation(NamedTuple):
 
@@ -98,12 +100,14 @@ def verbose_run(cmd : List[str], **kwargs):
 
 def log_command_output(cmd : Union[str,Sequence[str]],
                       env=MappingProxyType({}),
-                      log_prefix : str = "> "
+                      log_prefix : str = "> ",
+                      on_line : Optional[Callable[[float, str], None]] = None,
 ) -> int:
   """
   run a command using subprocess.Popen and `bash -c`;
   merge the commands stdout and stderr, and log them at the DEBUG
-  level.
+  level as they arrive. If the command fails, its last lines are
+  also logged at the ERROR level.
 
   args:
 
@@ -112,6 +116,8 @@ def log_command_output(cmd : Union[str,Sequence[str]],
   - env. Extra environment variables to set. These are
     added to os.environ and passed to `Popen`.
   - log_prefix. A string - log messages get prefixed with this.
+  - on_line. If given, also called with (timestamp, line) for each
+    line of output (see `timing.stream_lines`).
 
   returns the exit code.
   """
@@ -133,14 +139,16 @@ def log_command_output(cmd : Union[str,Sequence[str]],
                         stderr=subprocess.STDOUT,
   ) as proc:
 
-    while True:
-      output = proc.stdout.readline() # type: ignore
-      if not output and proc.poll() is not None:
-        break
-      if output:
-        logging.debug(log_prefix + str(output.strip(), 'utf-8'))
+    def handle_line(stamp, line):
+      logging.debug(log_prefix + line.strip())
+      if on_line:
+        on_line(stamp, line)
+
+    recent = stream_lines(proc.stdout, handle_line) # type: ignore
+    exit_code = proc.wait()
 
-    exit_code = proc.returncode
+  if exit_code != 0:
+    logging.error("last lines of output:\n" + "\n".join(log_prefix + line for _stamp, line in recent))
 
   return exit_code
 
@@ -165,7 +173,8 @@ def _run_pyinfra(inventory: str, deploy_script : str, env=MappingProxyType({}),
 
   The output of the `pyinfra` command is logged at the 'DEBUG' level,
   so pass `--log-cli-level=DEBUG` to pytest if you need to diagnose
-  problems with it.
+  problems with it. Time taken per operation and host is recorded
+  (see `timing.py`), and reported at the end of the pytest session.
 
   Throws an exception if `pyinfra` didn't give successful exit code.
   """
@@ -174,7 +183,7 @@ def _run_pyinfra(inventory: str, deploy_script : str, env=MappingProxyType({}),
   data_options : Any = []
 
   for k, v in kwargs.items():
-    data_options.append( "--data " + k + "=" + v )
+    data_options.append( "--data " + shlex.quote(k + "=" + v) )
 
   data_options = " ".join(data_options)
 
@@ -184,7 +193,10 @@ def _run_pyinfra(inventory: str, deploy_script : str, env=MappingProxyType({}),
 
   logging.info(f"starting Popen for command: {cmd} with extra env {env}")
 
-  exit_code = log_command_output(cmd_, env=env, log_prefix="pyinfra> ")
+  timing = DeployTiming()
+  exit_code = log_command_output(cmd_, env=env, log_prefix="pyinfra> ", on_line=timing.feed)
+  timing.finish()
+  record_timing(cmd, timing)
 
   if exit_code != 0:
     raise Exception(f"failure executing {cmd}, exit code was {exit_code}")
@@ -374,4 +386,18 @@ class DeploymentTests:
     cmd_res = host.run(cmd)
     assert cmd_res.rc == 0, f"'{cmd}' should succeed"
 
+    # renewal should be scheduled by our cron file, not the
+    # plugin's own cron job.
+    cron_file = host.file("/etc/cron.d/dokku-letsencrypt")
+    assert cron_file.exists
+    assert cron_file.contains("letsencrypt:auto-renew")
+
+    cmd = "crontab -l -u dokku 2>/dev/null | grep letsencrypt:auto-renew"
+    cmd_res = host.run(cmd)
+    assert cmd_res.rc != 0, "plugin's own cron job should have been removed"
+
+    if "letsencrypt_server" in pyinfra_data:
+      server_property = host.file("/var/lib/dokku/config/letsencrypt/--global/server")
+      assert server_property.content_string.strip() == pyinfra_data["letsencrypt_server"]
+
 